@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from uploads import MEMORY_UPLOAD_BYTES, IngestedUpload, UploadTooLarge, ingest_stream, ingest_upload
+
+CHUNK_BYTES = 1 << 20
+
+# Files (archive members included) accepted in one batch request
+MAX_BATCH_ITEMS = int(os.environ.get("ODOREMOVER_MAX_BATCH_ITEMS", 500))
+
+ARCHIVE_EXTENSIONS = (".zip",)
+
+
+class BatchItem:
+    def __init__(self, index: int, filename: str, job_id: Optional[str] = None, error: Optional[str] = None):
+        self.index = index
+        self.filename = filename
+        # None when the item was rejected before it could be queued
+        self.job_id = job_id
+        self.error = error
+
+    @property
+    def folder(self) -> str:
+        """Directory of this item's outputs in the batch ZIP"""
+        return f"{self.index + 1:03d}_{os.path.splitext(self.filename)[0]}"
+
+
+class Batch:
+    def __init__(self, batch_id: str, tool_name: str, items: List[BatchItem]):
+        self.id = batch_id
+        self.tool_name = tool_name
+        self.items = items
+        self.created_at = datetime.utcnow()
+
+
+class BatchStore:
+    """Batches by id, keeping the most recent max_entries
+
+    Only the item-to-job mapping lives here; item state is in the job store.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._batches: "OrderedDict[str, Batch]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, batch: Batch) -> Batch:
+        with self._lock:
+            self._batches[batch.id] = batch
+            while len(self._batches) > self.max_entries:
+                self._batches.popitem(last=False)
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        with self._lock:
+            return self._batches.get(batch_id)
+
+
+def ingest_batch(files: List[UploadFile], spool_path: Callable[[int, str], str],
+                 supported: Tuple[str, ...]) -> List[Tuple[str, Optional[IngestedUpload], Optional[str]]]:
+    """Ingest every audio file of a batch request, expanding ZIP archives
+
+    Returns (filename, upload, error) per item; unsupported, oversized or
+    unreadable items carry an error instead of failing the whole batch.
+    Items share one MEMORY_UPLOAD_BYTES budget, so a large batch spools to
+    disk instead of holding hundreds of tracks in memory. Raises ValueError
+    when the batch has no items or more than MAX_BATCH_ITEMS. Blocking.
+    """
+    items: List[Tuple[str, Optional[IngestedUpload], Optional[str]]] = []
+    budget = MEMORY_UPLOAD_BYTES
+
+    def add(filename: str, ingest: Callable[[str, int], IngestedUpload]):
+        nonlocal budget
+        if len(items) >= MAX_BATCH_ITEMS:
+            raise ValueError(f"A batch may hold at most {MAX_BATCH_ITEMS} files")
+        if not filename.lower().endswith(supported):
+            items.append((filename, None, "Unsupported audio format"))
+            return
+        try:
+            upload = ingest(spool_path(len(items), filename), budget)
+        except UploadTooLarge as e:
+            items.append((filename, None, str(e)))
+            return
+        if upload.in_memory:
+            budget -= upload.size
+        items.append((filename, upload, None))
+
+    try:
+        for file in files:
+            if file.filename.lower().endswith(ARCHIVE_EXTENSIONS):
+                try:
+                    archive = zipfile.ZipFile(file.file)
+                except zipfile.BadZipFile:
+                    items.append((file.filename, None, "Unreadable archive"))
+                    continue
+                with archive:
+                    for info in archive.infolist():
+                        name = os.path.basename(info.filename)
+                        if info.is_dir() or not name or name.startswith(".") or "__MACOSX" in info.filename:
+                            continue
+                        add(name, lambda path, memory, info=info, name=name: ingest_stream(
+                            archive.open(info), name, path, info.file_size, memory_bytes=memory))
+            else:
+                add(file.filename, lambda path, memory, file=file: ingest_upload(file, path, memory_bytes=memory))
+    except BaseException:
+        for _, upload, _ in items:
+            if upload is not None:
+                upload.release()
+        raise
+
+    if not items:
+        raise ValueError("No files in batch")
+    return items
+
+
+class _ChunkSink:
+    """Write-only, unseekable file object; zipfile then streams entries with data descriptors"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """A ZIP archive produced chunk by chunk, never held whole in memory or on disk
+
+    Entries are stored uncompressed: the audio is already compressed or
+    barely compressible, and storing keeps the stream at disk speed.
+    """
+
+    def __init__(self):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, "w", compression=zipfile.ZIP_STORED)
+
+    async def add_file(self, arcname: str, path: str) -> AsyncIterator[bytes]:
+        """Add a file, yielding archive bytes as it is read; raises OSError if it cannot be opened"""
+        src = await run_in_threadpool(open, path, "rb")
+        try:
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.fstat(src.fileno()).st_mtime)[:6])
+            # Lets zipfile pick ZIP64 up front for files over 2 GB
+            info.file_size = os.fstat(src.fileno()).st_size
+            with self._zip.open(info, "w") as dest:
+                while True:
+                    chunk = await run_in_threadpool(src.read, CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield self._sink.drain()
+            yield self._sink.drain()
+        finally:
+            src.close()
+
+    def add_bytes(self, arcname: str, data: bytes) -> bytes:
+        self._zip.writestr(zipfile.ZipInfo(arcname, date_time=time.localtime()[:6]), data)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._sink.drain()
+
+
+async def batch_archive(batch: Batch, wait: Callable[[str], Awaitable[None]],
+                        collect: Callable[[BatchItem], Tuple[Iterable[str], dict]]) -> AsyncIterator[bytes]:
+    """Stream a batch's outputs as a ZIP, adding each item as soon as its job finishes
+
+    wait(job_id) returns once a job has ended; collect(item) gives the
+    output paths of a finished item and its entry for batch.json, which
+    closes the archive with the status and error of every item.
+    """
+    zip_stream = ZipStream()
+    summary = []
+
+    async def finished(item: BatchItem) -> BatchItem:
+        await wait(item.job_id)
+        return item
+
+    waiters = []
+    for item in batch.items:
+        if item.job_id is None:
+            summary.append({"index": item.index, "filename": item.filename, "status": "rejected",
+                            "error": item.error})
+        else:
+            waiters.append(asyncio.ensure_future(finished(item)))
+    try:
+        for next_finished in asyncio.as_completed(waiters):
+            item = await next_finished
+            paths, entry = collect(item)
+            files = []
+            for path in paths:
+                arcname = f"{item.folder}/{os.path.basename(path)}"
+                try:
+                    async for chunk in zip_stream.add_file(arcname, path):
+                        if chunk:
+                            yield chunk
+                    files.append(arcname)
+                except FileNotFoundError:
+                    entry.update(status="failed", error="Output no longer available")
+            summary.append({"index": item.index, "filename": item.filename, **entry, "files": files})
+    finally:
+        # The client went away, or we are done: stop waiting on the remaining jobs
+        for waiter in waiters:
+            waiter.cancel()
+
+    summary.sort(key=lambda entry: entry["index"])
+    yield zip_stream.add_bytes("batch.json", json.dumps({"batch_id": batch.id, "items": summary}, indent=2).encode())
+    yield zip_stream.close()
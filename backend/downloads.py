@@ -0,0 +1,124 @@
+import os
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from services.encoders import OutputFormat, encode_stream
+
+CHUNK_BYTES = 64 << 10
+
+# Artifacts never change once written, so clients and CDNs may keep them
+# for as long as they like; cleanup only ever removes them
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class RangeNotSatisfiable(ValueError):
+    """The requested byte range lies outside the file"""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single-range Range header, or None to send the whole file
+
+    Malformed and multi-range headers are ignored, as RFC 9110 allows.
+    Raises RangeNotSatisfiable for ranges that start past the end.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+    first, _, last = spec.partition("-")
+    if not (first or last) or any(part and not part.isdigit() for part in (first, last)):
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+
+def _opaque_tag(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against etag"""
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or _opaque_tag(etag) in (_opaque_tag(tag) for tag in tags)
+
+
+def _read_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_BYTES, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def artifact_response(request: Request, session_dir: str, artifact: dict) -> Response:
+    """Serve a manifest artifact with ETag, conditional GET and single byte-range support"""
+    path = os.path.join(session_dir, artifact["file"])
+    etag = f'"{artifact["hash"]}"'
+    size = artifact["size"]
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        return FileResponse(path, filename=artifact["file"], media_type=artifact["media_type"], headers=headers)
+
+    start, end = byte_range
+    headers.update({
+        "Content-Range": f"bytes {start}-{end}/{size}",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f'attachment; filename="{artifact["file"]}"',
+    })
+    return StreamingResponse(
+        _read_range(path, start, end), status_code=206, media_type=artifact["media_type"], headers=headers
+    )
+
+
+def transcoded_response(request: Request, session_dir: str, master: dict,
+                        output_format: OutputFormat, bitrate: Optional[int]) -> Response:
+    """Stream a master artifact re-encoded block by block, sent as it is encoded
+
+    The length is unknown up front, so there is no Range support; the weak
+    ETag still lets clients and CDNs revalidate without a new encode.
+    """
+    path = os.path.join(session_dir, master["file"])
+    stem = os.path.splitext(master["file"])[0]
+    if stem.endswith("_master"):
+        stem = stem[:-len("_master")]
+    filename = f"{stem}.{output_format.extension}"
+    etag = f'W/"{master["hash"]}-{output_format.name}-{bitrate or 0}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Accept-Ranges": "none"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return StreamingResponse(
+        encode_stream(path, output_format, bitrate), media_type=output_format.media_type, headers=headers
+    )
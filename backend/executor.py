@@ -0,0 +1,389 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from jobs import JobCancelled
+from manifests import write_manifest
+
+# Processors are built once per worker process, on first use or by the
+# warm-up in _init_worker, and reused for every task that worker runs; a
+# worker that only ever sees pitch/tempo work never imports the separator
+_vocal_separator = None
+_pitch_tempo_processor = None
+_pipeline = None
+# This worker's pid, initialiser time and warm-up timings (see worker_status_task)
+_worker_status: Dict[str, Any] = {}
+
+# Length of the synthetic clip each warmed service processes
+WARMUP_CLIP_SECONDS = 2.0
+# How long a warm-up status task waits for the other workers to take theirs
+WORKER_READY_TIMEOUT = 300
+
+# Worker side of the progress channel: events go out through the queue and
+# cancelled job ids come in through the shared dict
+_progress_queue = None
+_cancelled_jobs = None
+
+
+def default_worker_count() -> int:
+    """Number of worker processes, from ODOREMOVER_WORKERS or the usable cores"""
+    configured = os.environ.get("ODOREMOVER_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+def _get_vocal_separator():
+    global _vocal_separator
+    if _vocal_separator is None:
+        from services.vocal_separator import VocalSeparator
+        _vocal_separator = VocalSeparator()
+    return _vocal_separator
+
+
+def _get_pitch_tempo_processor():
+    global _pitch_tempo_processor
+    if _pitch_tempo_processor is None:
+        from services.pitch_tempo import PitchTempoProcessor
+        _pitch_tempo_processor = PitchTempoProcessor()
+    return _pitch_tempo_processor
+
+
+def _get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        from services.pipeline import Pipeline
+        _pipeline = Pipeline(_get_vocal_separator())
+    return _pipeline
+
+
+# Services a worker can warm up, and how to build each one's processor;
+# the pipeline reuses both, so it has nothing of its own to warm
+WARMUP_SERVICES: Dict[str, Callable[[], Any]] = {
+    "vocal-separator": _get_vocal_separator,
+    "pitch-tempo": _get_pitch_tempo_processor,
+}
+
+
+def warm_up_services() -> Tuple[str, ...]:
+    """Services each worker warms at start, from ODOREMOVER_WARMUP
+
+    A comma-separated list of WARMUP_SERVICES names, "all" (the default)
+    or "none".
+    """
+    configured = os.environ.get("ODOREMOVER_WARMUP", "all").strip().lower()
+    if configured == "all":
+        return tuple(WARMUP_SERVICES)
+    if configured in ("", "none"):
+        return ()
+    services = tuple(name.strip() for name in configured.split(",") if name.strip())
+    unknown = [name for name in services if name not in WARMUP_SERVICES]
+    if unknown:
+        raise ValueError(f"Unknown ODOREMOVER_WARMUP services: {', '.join(unknown)} "
+                         f"(choose from {', '.join(WARMUP_SERVICES)})")
+    return services
+
+
+def _warm_up(services: Tuple[str, ...]) -> Dict[str, dict]:
+    """Build each service's processor and run a synthetic clip through it, timing both
+
+    The first call into a librosa path compiles its numba kernels, which
+    takes seconds; doing it here keeps that off the first real request. A
+    service that fails to warm reports its error and loads again on first use.
+    """
+    import numpy as np
+
+    sr = 44100
+    t = np.arange(int(sr * WARMUP_CLIP_SECONDS)) / sr
+    noise = np.random.default_rng(0).standard_normal((2, len(t))) * 0.05
+    clip = (0.3 * np.sin(2 * np.pi * 220 * t) + noise).astype(np.float32)
+
+    report = {}
+    for name in services:
+        started = time.perf_counter()
+        try:
+            processor = WARMUP_SERVICES[name]()
+            loaded = time.perf_counter()
+            processor.warm_up(clip, sr)
+            report[name] = {"load_seconds": round(loaded - started, 3),
+                            "warm_up_seconds": round(time.perf_counter() - loaded, 3)}
+        except Exception as e:
+            report[name] = {"error": str(e), "seconds": round(time.perf_counter() - started, 3)}
+    return report
+
+
+def _init_worker(progress_queue=None, cancelled_jobs=None, cache_stats=None, warm_up: Tuple[str, ...] = ()):
+    """Set up a freshly started worker and warm up the given services before it takes tasks"""
+    global _progress_queue, _cancelled_jobs
+    started = time.perf_counter()
+    from services.audio_cache import default_cache
+
+    default_cache().stats_sink = cache_stats
+    _progress_queue = progress_queue
+    _cancelled_jobs = cancelled_jobs
+    warmed = _warm_up(warm_up)
+    _worker_status.update({
+        "pid": os.getpid(),
+        "init_seconds": round(time.perf_counter() - started, 3),
+        "warm_up": warmed,
+    })
+
+
+def _progress_callback(job_id: Optional[str]) -> Optional[Callable[[int], None]]:
+    """Progress callback for a job, raising JobCancelled once it has been cancelled"""
+    if job_id is None:
+        return None
+
+    def report(percent: int):
+        if _cancelled_jobs is not None and job_id in _cancelled_jobs:
+            raise JobCancelled(job_id)
+        if _progress_queue is not None:
+            _progress_queue.put((job_id, int(percent)))
+
+    # Report once before any work so queued jobs flip to PROCESSING (or stop,
+    # if they were cancelled while waiting for a worker)
+    report(0)
+    return report
+
+
+# Task functions run inside the worker processes. They must be module-level
+# so the pool can pickle them by reference.
+
+# Inputs are a path or, for uploads ingested in memory, the upload's bytes;
+# content_key is then the upload's content hash and filename its name.
+
+def separate_vocals_task(input_path: Union[str, bytes], output_dir: str, quality: str = "high",
+                         job_id: Optional[str] = None, content_key: Optional[str] = None,
+                         filename: Optional[str] = None, output_format: str = "wav",
+                         bitrate: Optional[int] = None) -> dict:
+    result = _get_vocal_separator().process_file(
+        input_path, output_dir, quality, progress_callback=_progress_callback(job_id),
+        content_key=content_key, filename=filename, output_format=output_format, bitrate=bitrate
+    )
+    if result["success"]:
+        encoding = {"bitrate": result["bitrate"]}
+        result["manifest"] = write_manifest(output_dir, {
+            "vocals": result["vocals_path"],
+            "instrumental": result["instrumentals_path"],
+            "vocals_master": result["vocals_master_path"],
+            "instrumental_master": result["instrumentals_master_path"],
+        }, details={"vocals": encoding, "instrumental": encoding})
+    return result
+
+
+def pitch_tempo_task(input_path: Union[str, bytes], output_path: str, pitch_semitones: float = 0,
+                     tempo_percent: float = 0, quality: str = "high",
+                     job_id: Optional[str] = None, content_key: Optional[str] = None,
+                     filename: Optional[str] = None, output_format: Optional[str] = None,
+                     bitrate: Optional[int] = None) -> dict:
+    result = _get_pitch_tempo_processor().process_file(
+        input_path, output_path, pitch_semitones, tempo_percent, quality,
+        progress_callback=_progress_callback(job_id), content_key=content_key, filename=filename,
+        output_format=output_format, bitrate=bitrate
+    )
+    if result["success"]:
+        result["manifest"] = write_manifest(os.path.dirname(output_path), {
+            "processed": result["output_path"],
+            "processed_master": result["master_path"],
+        }, details={"processed": {"bitrate": result["bitrate"]}})
+    return result
+
+
+def pipeline_task(input_path: Union[str, bytes], output_path: str, steps: list,
+                  job_id: Optional[str] = None, content_key: Optional[str] = None,
+                  filename: Optional[str] = None, output_format: Optional[str] = None,
+                  bitrate: Optional[int] = None) -> dict:
+    result = _get_pipeline().process_file(
+        input_path, output_path, steps, progress_callback=_progress_callback(job_id),
+        content_key=content_key, filename=filename, output_format=output_format, bitrate=bitrate
+    )
+    if result["success"]:
+        result["manifest"] = write_manifest(os.path.dirname(output_path), {
+            "processed": result["output_path"],
+            "processed_master": result["master_path"],
+        }, details={"processed": {"bitrate": result["bitrate"]}})
+    return result
+
+
+def pitch_tempo_preview_task(source: Union[str, bytes, None], content_key: str, filename: Optional[str],
+                             pitch_semitones: float = 0, tempo_percent: float = 0,
+                             start_time: float = 30, duration: float = 10,
+                             quality: str = "fast") -> dict:
+    from services.pitch_tempo import encode_wav
+
+    result = _get_pitch_tempo_processor().get_preview(
+        source, pitch_semitones, tempo_percent, start_time, duration,
+        quality=quality, content_key=content_key, filename=filename
+    )
+    if result["success"]:
+        # Send encoded bytes back rather than pickling the float array
+        result["preview_wav"] = encode_wav(result.pop("preview_audio"), result["sample_rate"])
+    return result
+
+
+def analyze_audio_task(file_path: Union[str, bytes], content_key: Optional[str] = None,
+                       filename: Optional[str] = None) -> dict:
+    return _get_pitch_tempo_processor().analyze_audio(file_path, content_key, filename)
+
+
+def worker_status_task(barrier=None) -> dict:
+    """The warm-up report of the worker that runs this
+
+    With a barrier, the worker holds on until every worker has taken one
+    of these, so one task per worker reaches each of them.
+    """
+    if barrier is not None:
+        try:
+            barrier.wait(WORKER_READY_TIMEOUT)
+        except threading.BrokenBarrierError:
+            pass
+    return dict(_worker_status)
+
+
+class ProcessingExecutor:
+    """Bounded process pool that keeps CPU-heavy audio work off the event loop"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or default_worker_count()
+        # Called as progress_handler(job_id, percent) from the listener thread
+        self.progress_handler: Optional[Callable[[str, int], None]] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._context = multiprocessing.get_context("spawn")
+        self._manager = None
+        self._progress_queue = None
+        self._cancelled_jobs = None
+        self._cache_stats = None
+        self._listener: Optional[threading.Thread] = None
+        self.warm_up_services = warm_up_services()
+        # Ready once every worker has started and warmed up (see warm_up)
+        self.ready = False
+        self._warm_up_seconds: Optional[float] = None
+        self._worker_reports: list = []
+        self._warming: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the worker pool (idempotent)"""
+        if self._progress_queue is None:
+            self._manager = self._context.Manager()
+            self._cancelled_jobs = self._manager.dict()
+            self._cache_stats = self._manager.dict()
+            self._progress_queue = self._context.Queue()
+            self._listener = threading.Thread(target=self._drain_progress, daemon=True)
+            self._listener.start()
+        if self._pool is None:
+            # spawn avoids inheriting the server's threads and numba state via fork
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=self._context,
+                initializer=_init_worker,
+                initargs=(self._progress_queue, self._cancelled_jobs, self._cache_stats, self.warm_up_services),
+            )
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn in a worker process and await its result without blocking the loop"""
+        if self._pool is None:
+            self.start()
+        pool = self._pool
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(pool, partial(fn, *args, **kwargs))
+        except BrokenProcessPool:
+            # A worker died (OOM kill, segfault in a native library); replace the
+            # pool so later requests are not all failed by the same dead pool
+            if self._pool is pool:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                self.start()
+                # The replacement workers start cold; not ready until they are warm
+                self.ready = False
+                self._warming = loop.create_task(self.warm_up())
+            raise
+
+    async def warm_up(self) -> list:
+        """Start every worker, wait until each has run its warm-up, and mark the executor ready
+
+        Workers warm up in their initialiser, before taking any task; one
+        status task per worker returns each one's timings.
+        """
+        self.start()
+        self.ready = False
+        started = time.perf_counter()
+        barrier = self._manager.Barrier(self.max_workers)
+        self._worker_reports = list(await asyncio.gather(
+            *(self.run(worker_status_task, barrier) for _ in range(self.max_workers))
+        ))
+        self._warm_up_seconds = round(time.perf_counter() - started, 3)
+        self.ready = True
+        return self._worker_reports
+
+    def warm_up_status(self) -> dict:
+        """Whether the workers are ready, which services they warm and what each worker's warm-up took"""
+        return {
+            "ready": self.ready,
+            "services": list(self.warm_up_services),
+            "warm_up_seconds": self._warm_up_seconds,
+            "workers": self._worker_reports,
+        }
+
+    def cancel_job(self, job_id: str):
+        """Flag a job so its worker stops at the next progress checkpoint"""
+        if self._cancelled_jobs is not None:
+            self._cancelled_jobs[job_id] = True
+
+    def forget_job(self, job_id: str):
+        """Drop the cancellation flag of a job that has finished"""
+        if self._cancelled_jobs is not None:
+            self._cancelled_jobs.pop(job_id, None)
+
+    def cache_stats(self) -> dict:
+        """Audio cache hit/miss counters summed over every worker"""
+        totals = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if self._cache_stats is not None:
+            for worker_stats in self._cache_stats.values():
+                for name, count in worker_stats.items():
+                    totals[name] = totals.get(name, 0) + count
+        lookups = sum(totals.values())
+        totals["hit_rate"] = (totals["memory_hits"] + totals["disk_hits"]) / lookups if lookups else 0.0
+        return totals
+
+    def _drain_progress(self):
+        """Forward worker progress events to progress_handler until shutdown"""
+        progress_queue = self._progress_queue
+        while True:
+            try:
+                event = progress_queue.get()
+            except (EOFError, OSError, ValueError):
+                return
+            if event is None:
+                return
+            if self.progress_handler is not None:
+                self.progress_handler(*event)
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker pool, cancelling tasks that have not started yet"""
+        self.ready = False
+        if self._warming is not None:
+            self._warming.cancel()
+            self._warming = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+            self._listener.join(timeout=5)
+            self._progress_queue = None
+            self._listener = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+            self._cancelled_jobs = None
+            self._cache_stats = None
@@ -0,0 +1,217 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from models import ProcessingJobModel, ProcessingStatus
+
+FINISHED_STATUSES = (ProcessingStatus.COMPLETED, ProcessingStatus.FAILED, ProcessingStatus.CANCELLED)
+
+
+class JobCancelled(BaseException):
+    """Raised inside a worker when its job has been cancelled.
+
+    Derives from BaseException, like asyncio.CancelledError, so the
+    processors' broad ``except Exception`` handlers do not swallow it.
+    """
+
+
+class JobStore:
+    """Thread-safe in-memory store of processing jobs"""
+
+    def __init__(self):
+        self._jobs: Dict[str, ProcessingJobModel] = {}
+        self._lock = threading.Lock()
+
+    def create(self, tool_name: str, input_file: str, parameters: Dict[str, Any],
+               job_id: Optional[str] = None) -> ProcessingJobModel:
+        job = ProcessingJobModel(
+            id=job_id or str(uuid.uuid4()),
+            tool_name=tool_name,
+            input_file=input_file,
+            parameters=parameters,
+            created_at=datetime.utcnow(),
+        )
+        with self._lock:
+            self._save(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[ProcessingJobModel]:
+        with self._lock:
+            return self._load(job_id)
+
+    def update(self, job_id: str, **fields) -> Optional[ProcessingJobModel]:
+        """Apply field updates to a job; finished jobs are never reopened"""
+        with self._lock:
+            job = self._load(job_id)
+            if job is None:
+                return None
+            if job.status in FINISHED_STATUSES:
+                return job
+            job = job.model_copy(update=fields)
+            self._save(job)
+            return job
+
+    def report_progress(self, job_id: str, progress: int):
+        """Record worker progress, moving a pending job into PROCESSING"""
+        with self._lock:
+            job = self._load(job_id)
+            if job is None or job.status in FINISHED_STATUSES:
+                return
+            job = job.model_copy(update={
+                "status": ProcessingStatus.PROCESSING,
+                "progress": max(job.progress, min(100, int(progress))),
+            })
+            self._save(job)
+
+    def prune(self, finished_before: datetime) -> int:
+        """Drop jobs that finished before finished_before (UTC); how many were dropped"""
+        with self._lock:
+            return self._delete_finished(finished_before)
+
+    def _delete_finished(self, finished_before: datetime) -> int:
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.completed_at is not None and job.completed_at < finished_before]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+    def _load(self, job_id: str) -> Optional[ProcessingJobModel]:
+        return self._jobs.get(job_id)
+
+    def _save(self, job: ProcessingJobModel):
+        self._jobs[job.id] = job
+
+
+class SQLiteJobStore(JobStore):
+    """Job store persisted to SQLite so job status survives API restarts"""
+
+    def __init__(self, db_path: str):
+        super().__init__()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._conn.commit()
+        self._fail_interrupted_jobs()
+
+    def _load(self, job_id: str) -> Optional[ProcessingJobModel]:
+        row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return ProcessingJobModel.model_validate_json(row[0]) if row else None
+
+    def _save(self, job: ProcessingJobModel):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO jobs (id, data) VALUES (?, ?)",
+            (job.id, job.model_dump_json()),
+        )
+        self._conn.commit()
+
+    def _delete_finished(self, finished_before: datetime) -> int:
+        # completed_at is stored as an ISO timestamp, which sorts chronologically
+        deleted = self._conn.execute(
+            "DELETE FROM jobs WHERE json_extract(data, '$.completed_at') < ?",
+            (finished_before.isoformat(),),
+        ).rowcount
+        self._conn.commit()
+        return deleted
+
+    def _fail_interrupted_jobs(self):
+        """Jobs that were running when the previous process exited can never finish"""
+        rows = self._conn.execute("SELECT data FROM jobs").fetchall()
+        for (data,) in rows:
+            job = ProcessingJobModel.model_validate_json(data)
+            if job.status not in FINISHED_STATUSES:
+                self._save(job.model_copy(update={
+                    "status": ProcessingStatus.FAILED,
+                    "error_message": "Interrupted by server restart",
+                    "completed_at": datetime.utcnow(),
+                }))
+
+
+def create_job_store() -> JobStore:
+    """SQLite store when ODOREMOVER_JOB_DB is set, in-memory otherwise"""
+    db_path = os.environ.get("ODOREMOVER_JOB_DB")
+    return SQLiteJobStore(db_path) if db_path else JobStore()
+
+
+class JobManager:
+    """Runs submitted jobs on the executor and keeps their store records current"""
+
+    def __init__(self, store: JobStore, executor):
+        self.store = store
+        self.executor = executor
+        self.executor.progress_handler = store.report_progress
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, job: ProcessingJobModel, fn: Callable[..., dict], *args,
+               on_result: Optional[Callable[[dict], Dict[str, Any]]] = None,
+               on_finish: Optional[Callable[[], None]] = None, **kwargs) -> ProcessingJobModel:
+        """Schedule fn(*args, job_id=job.id) and return immediately.
+
+        on_result turns a successful processor result into the job's
+        result_metadata; on_finish runs once the job ends in any state.
+        """
+        task = asyncio.create_task(self._run(job.id, fn, args, kwargs, on_result, on_finish))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return job
+
+    async def _run(self, job_id, fn, args, kwargs, on_result, on_finish):
+        try:
+            result = await self.executor.run(fn, *args, job_id=job_id, **kwargs)
+            if result.get("success"):
+                metadata = on_result(result) if on_result else result
+                self.store.update(
+                    job_id,
+                    status=ProcessingStatus.COMPLETED,
+                    progress=100,
+                    output_file=result.get("output_path") or result.get("vocals_path"),
+                    result_metadata=metadata,
+                    completed_at=datetime.utcnow(),
+                )
+            else:
+                self._fail(job_id, result.get("error", "Processing failed"))
+        except (JobCancelled, asyncio.CancelledError):
+            self.store.update(job_id, status=ProcessingStatus.CANCELLED, completed_at=datetime.utcnow())
+        except Exception as e:
+            self._fail(job_id, str(e))
+        finally:
+            self.executor.forget_job(job_id)
+            if on_finish:
+                on_finish()
+
+    def _fail(self, job_id: str, error: str):
+        self.store.update(
+            job_id,
+            status=ProcessingStatus.FAILED,
+            error_message=error,
+            completed_at=datetime.utcnow(),
+        )
+
+    def is_running(self, job_id: str) -> bool:
+        return job_id in self._tasks
+
+    async def wait(self, job_id: str):
+        """Return once a job has ended; cancelling the wait leaves the job running"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.wait({task})
+
+    def complete(self, job_id: str, result_metadata: Dict[str, Any]) -> ProcessingJobModel:
+        """Finish a job without running it, e.g. when its result already exists"""
+        return self.store.update(
+            job_id,
+            status=ProcessingStatus.COMPLETED,
+            progress=100,
+            result_metadata=result_metadata,
+            completed_at=datetime.utcnow(),
+        )
+
+    def cancel(self, job_id: str) -> Optional[ProcessingJobModel]:
+        """Cancel a job; a running job stops at its next progress checkpoint"""
+        job = self.store.get(job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return job
+        self.executor.cancel_job(job_id)
+        return self.store.update(job_id, status=ProcessingStatus.CANCELLED, completed_at=datetime.utcnow())
@@ -1,14 +1,40 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+from datetime import datetime
+import json
 import os
-import tempfile
 import shutil
-from typing import Optional
+import time
+from typing import List, Optional
 import uuid
 
-from services.vocal_separator import VocalSeparator
-from services.pitch_tempo import PitchTempoProcessor
+from executor import (
+    ProcessingExecutor,
+    separate_vocals_task,
+    pitch_tempo_task,
+    pitch_tempo_preview_task,
+    pipeline_task,
+    analyze_audio_task,
+)
+from batches import Batch, BatchItem, BatchStore, ZipStream, batch_archive, ingest_batch
+from downloads import artifact_response, transcoded_response
+from jobs import JobManager, create_job_store
+from manifests import ManifestStore
+from results import ResultIndex
+from services.audio_probe import probe_audio
+from services.converter import SEEKABLE_INPUTS, ConverterService, TranscodeError, TranscodeTimeout, TranscoderBusy
+from services.encoders import format_for_path, get_output_format
+from services.metadata_editor import TAG_FIELDS, TAGGABLE_FORMATS, MetadataEditorService, tag_updates
+from services.pipeline import parse_steps
+from startup import FirstRequestMiddleware, StartupMonitor
+from storage import StorageJanitor
+from uploads import MAX_UPLOAD_BYTES, IngestedUpload, UploadTooLarge, ingest_upload
+
+# Cold-start timings, from process start to workers warmed, and first-request latencies
+startup_monitor = StartupMonitor()
 
 app = FastAPI(title="ODOREMOVER API", description="Professional Audio Processing API", version="1.0.0")
 
@@ -20,10 +46,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(FirstRequestMiddleware, monitor=startup_monitor)
+
+# Processors live in the worker pool, not in the API process
+executor = ProcessingExecutor()
+job_manager = JobManager(create_job_store(), executor)
+result_index = ResultIndex()
 
-# Initialize processors
-vocal_separator = VocalSeparator()
-pitch_tempo_processor = PitchTempoProcessor()
+SUPPORTED_FORMATS = ('.mp3', '.wav', '.flac', '.m4a')
+MAX_PREVIEW_SECONDS = 30
 
 # Create necessary directories
 UPLOAD_DIR = "uploads"
@@ -31,47 +62,256 @@ OUTPUT_DIR = "outputs"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+manifests = ManifestStore(OUTPUT_DIR)
+batches = BatchStore()
+# Tag edits are small I/O-bound rewrites; they run in the API's threadpool, not the worker pool
+tag_editor = MetadataEditorService()
+# Format conversion streams through ffmpeg subprocesses, also outside the worker pool
+converter = ConverterService()
+
+def forget_evicted(storage_id: str):
+    result_index.evict(storage_id)
+    manifests.forget(storage_id)
+
+def prune_jobs(cutoff: float):
+    # Job records expire with their outputs, so a job is never reported with dead download links
+    job_manager.store.prune(datetime.utcfromtimestamp(cutoff))
+
+# Removes old outputs, leaked uploads and expired job records in the background (see StorageJanitor)
+janitor = StorageJanitor(OUTPUT_DIR, UPLOAD_DIR, is_active=job_manager.is_running, on_evict=forget_evicted,
+                         on_sweep=prune_jobs)
+
+# Workers warm up in the background so the server answers liveness probes
+# meanwhile; /health/ready turns 200 once they are done
+warm_up_task: Optional[asyncio.Task] = None
+
+async def warm_up_workers():
+    await executor.warm_up()
+    startup_monitor.mark("ready")
+
+@app.on_event("startup")
+async def start_executor():
+    global warm_up_task
+    executor.start()
+    janitor.start()
+    startup_monitor.mark("started")
+    warm_up_task = asyncio.create_task(warm_up_workers())
+
+@app.on_event("shutdown")
+async def stop_executor():
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    await janitor.stop()
+    executor.shutdown()
+
+def upload_path(session_id: str, filename: str) -> str:
+    return os.path.join(UPLOAD_DIR, f"{session_id}_{filename}")
+
+async def receive_upload(file: UploadFile, session_id: str, **limits) -> IngestedUpload:
+    """Read, hash and size-check an upload once (see ingest_upload); too large is a 413"""
+    try:
+        return await run_in_threadpool(ingest_upload, file, upload_path(session_id, file.filename), **limits)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+def pitch_tempo_parameters(pitch_semitones: float, tempo_percent: float, quality: str) -> dict:
+    return {"pitch_semitones": float(pitch_semitones), "tempo_percent": float(tempo_percent), "quality": quality}
+
+def encoding_parameters(output_format: str, bitrate: Optional[int]) -> dict:
+    """Validated output format and bitrate (kbps, lossy formats only); bad values are a 400"""
+    try:
+        fmt = get_output_format(output_format)
+        return {"output_format": fmt.name, "bitrate": fmt.resolve_bitrate(bitrate)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def separation_response(session_id: str, result: dict, deduplicated: bool = False) -> dict:
+    return {
+        "session_id": session_id,
+        "success": True,
+        "vocals_url": f"/api/download/{session_id}/vocals",
+        "instrumental_url": f"/api/download/{session_id}/instrumental",
+        "duration": result["duration"],
+        "sample_rate": result["sample_rate"],
+        "output_format": result.get("output_format", "wav"),
+        "bitrate": result.get("bitrate"),
+        "timings": {} if deduplicated else result.get("timings", {}),
+        "deduplicated": deduplicated
+    }
+
+def pitch_tempo_response(session_id: str, result: dict, deduplicated: bool = False) -> dict:
+    return {
+        "session_id": session_id,
+        "success": True,
+        "download_url": f"/api/download/{session_id}/processed",
+        "original_duration": result["original_duration"],
+        "new_duration": result["new_duration"],
+        "pitch_change": result["pitch_change"],
+        "tempo_change": result["tempo_change"],
+        "sample_rate": result["sample_rate"],
+        "output_format": result.get("output_format", "wav"),
+        "bitrate": result.get("bitrate"),
+        "timings": {} if deduplicated else result.get("timings", {}),
+        "deduplicated": deduplicated
+    }
+
+def pipeline_steps(steps: str) -> list:
+    """Validated, canonical steps from a JSON list of {"tool": ..., **parameters}; bad ones are a 400"""
+    try:
+        return [stage.spec() for stage in parse_steps(json.loads(steps))]
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"steps is not valid JSON: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def pipeline_response(session_id: str, result: dict, deduplicated: bool = False) -> dict:
+    return {
+        "session_id": session_id,
+        "success": True,
+        "download_url": f"/api/download/{session_id}/processed",
+        "steps": result["steps"],
+        "cached_steps": result["cached_steps"],
+        "original_duration": result["original_duration"],
+        "new_duration": result["new_duration"],
+        "sample_rate": result["sample_rate"],
+        "output_format": result["output_format"],
+        "bitrate": result["bitrate"],
+        "timings": {} if deduplicated else result.get("timings", {}),
+        "deduplicated": deduplicated
+    }
+
+def record_result(content_hash: str, tool_name: str, parameters: dict, session_id: str, result: dict):
+    """Index a finished result for deduplication and keep its manifest for downloads"""
+    result_index.register(content_hash, tool_name, parameters, session_id, result)
+    if "manifest" in result:
+        manifests.put(session_id, result["manifest"])
+        janitor.track(session_id, result["manifest"])
+
+def job_accepted_response(job) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status.value,
+        "status_url": f"/api/jobs/{job.id}"
+    }
+
+def queue_vocal_separation(job_id: str, upload: IngestedUpload, quality: str, encoding: dict):
+    """Create a job for an ingested upload and queue it, or complete it from a stored result"""
+    parameters = {"quality": quality, **encoding}
+    job = job_manager.store.create("vocal-separator", upload.filename, parameters, job_id=job_id)
+    stored = result_index.lookup(upload.content_hash, "vocal-separator", parameters, job_id)
+    if stored:
+        upload.release()
+        return job_manager.complete(job_id, separation_response(job_id, stored, deduplicated=True))
+    
+    def on_result(result: dict) -> dict:
+        record_result(upload.content_hash, "vocal-separator", parameters, job_id, result)
+        return separation_response(job_id, result)
+    
+    session_dir = os.path.join(OUTPUT_DIR, job_id)
+    os.makedirs(session_dir, exist_ok=True)
+    return job_manager.submit(
+        job, separate_vocals_task, upload.source, session_dir, quality,
+        content_key=upload.content_hash, filename=upload.filename, **encoding,
+        on_result=on_result,
+        on_finish=upload.release
+    )
+
+def queue_pitch_tempo(job_id: str, upload: IngestedUpload, pitch_semitones: float, tempo_percent: float,
+                      quality: str, encoding: dict):
+    """Create a job for an ingested upload and queue it, or complete it from a stored result"""
+    parameters = {**pitch_tempo_parameters(pitch_semitones, tempo_percent, quality), **encoding}
+    job = job_manager.store.create("pitch-tempo", upload.filename, parameters, job_id=job_id)
+    stored = result_index.lookup(upload.content_hash, "pitch-tempo", parameters, job_id)
+    if stored:
+        upload.release()
+        return job_manager.complete(job_id, pitch_tempo_response(job_id, stored, deduplicated=True))
+    
+    def on_result(result: dict) -> dict:
+        record_result(upload.content_hash, "pitch-tempo", parameters, job_id, result)
+        return pitch_tempo_response(job_id, result)
+    
+    session_dir = os.path.join(OUTPUT_DIR, job_id)
+    os.makedirs(session_dir, exist_ok=True)
+    output_path = os.path.join(session_dir, f"processed_{upload.filename}")
+    return job_manager.submit(
+        job, pitch_tempo_task, upload.source, output_path, pitch_semitones, tempo_percent, quality,
+        content_key=upload.content_hash, filename=upload.filename, **encoding,
+        on_result=on_result,
+        on_finish=upload.release
+    )
+
 @app.get("/")
 async def root():
     return {"message": "ODOREMOVER API - Professional Audio Processing"}
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "services": ["vocal-separator", "pitch-tempo"]}
+    return {
+        "status": "healthy",
+        "ready": executor.ready,
+        "services": ["vocal-separator", "pitch-tempo"],
+        "workers": executor.max_workers,
+        "warm_up": executor.warm_up_status(),
+        "cold_start": startup_monitor.report()
+    }
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness: the API process is up and its event loop answers"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness: every worker has started and warmed up; 503 until then"""
+    if not executor.ready:
+        raise HTTPException(status_code=503, detail="Workers are warming up")
+    return {"status": "ready", "cold_start": startup_monitor.report()}
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the decoded-audio and spectrogram cache"""
+    return executor.cache_stats()
+
+@app.get("/api/storage/stats")
+async def storage_stats():
+    """Bytes used by session outputs and what the janitor has evicted so far"""
+    return janitor.stats()
 
 # Vocal Separator Endpoints
 @app.post("/api/vocal-separator/process")
 async def separate_vocals(
     file: UploadFile = File(...),
-    quality: str = Form("high")
+    quality: str = Form("high"),
+    output_format: str = Form("wav"),
+    bitrate: Optional[int] = Form(None)
 ):
     """Separate vocals from instrumental track"""
-    if not file.filename.lower().endswith(('.mp3', '.wav', '.flac', '.m4a')):
+    if not file.filename.lower().endswith(SUPPORTED_FORMATS):
         raise HTTPException(status_code=400, detail="Unsupported audio format")
     
     # Generate unique session ID
     session_id = str(uuid.uuid4())
     session_dir = os.path.join(OUTPUT_DIR, session_id)
-    os.makedirs(session_dir, exist_ok=True)
+    encoding = encoding_parameters(output_format, bitrate)
+    parameters = {"quality": quality, **encoding}
     
+    upload = await receive_upload(file, session_id)
     try:
-        # Save uploaded file
-        input_path = os.path.join(UPLOAD_DIR, f"{session_id}_{file.filename}")
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Serve the stored outputs if this exact request was processed before
+        stored = result_index.lookup(upload.content_hash, "vocal-separator", parameters, session_id)
+        if stored:
+            return separation_response(session_id, stored, deduplicated=True)
         
         # Process the file
-        result = vocal_separator.process_file(input_path, session_dir, quality)
+        os.makedirs(session_dir, exist_ok=True)
+        result = await executor.run(
+            separate_vocals_task, upload.source, session_dir, quality,
+            content_key=upload.content_hash, filename=upload.filename, **encoding
+        )
         
         if result["success"]:
-            return {
-                "session_id": session_id,
-                "success": True,
-                "vocals_url": f"/api/download/{session_id}/vocals",
-                "instrumental_url": f"/api/download/{session_id}/instrumental",
-                "duration": result["duration"],
-                "sample_rate": result["sample_rate"]
-            }
+            record_result(upload.content_hash, "vocal-separator", parameters, session_id, result)
+            return separation_response(session_id, result)
         else:
             raise HTTPException(status_code=500, detail=result["error"])
             
@@ -79,136 +319,667 @@ async def separate_vocals(
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         # Clean up uploaded file
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        upload.release()
+
+def probe_upload(file: UploadFile) -> dict:
+    """Header-only probe of an upload, straight from its spooled file"""
+    started = time.perf_counter()
+    info = probe_audio(file.file, file.filename)
+    info["probe_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return info
 
-@app.get("/api/vocal-separator/info")
+# GET is kept for older clients; file bodies belong on POST
+@app.api_route("/api/vocal-separator/info", methods=["POST", "GET"])
 async def get_audio_info(file: UploadFile = File(...)):
-    """Get audio file information"""
+    """Get audio file information from its headers, without decoding"""
     try:
-        # Save temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            shutil.copyfileobj(file.file, tmp)
-            info = vocal_separator.get_audio_info(tmp.name)
-        
-        os.unlink(tmp.name)
-        return info
-        
+        # Runs beside the event loop, not in the worker pool, so it never
+        # queues behind long separations
+        return await run_in_threadpool(probe_upload, file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/vocal-separator/info/batch")
+async def get_audio_info_batch(files: List[UploadFile] = File(...)):
+    """Get information for many audio files; failures are reported per file"""
+    async def probe_one(file: UploadFile) -> dict:
+        try:
+            info = await run_in_threadpool(probe_upload, file)
+            return {"filename": file.filename, "success": True, **info}
+        except Exception as e:
+            return {"filename": file.filename, "success": False, "error": str(e)}
+    
+    return {"files": await asyncio.gather(*(probe_one(file) for file in files))}
+
 # Pitch & Tempo Endpoints
 @app.post("/api/pitch-tempo/process")
 async def process_pitch_tempo(
     file: UploadFile = File(...),
     pitch_semitones: float = Form(0),
     tempo_percent: float = Form(0),
-    quality: str = Form("high")
+    quality: str = Form("high"),
+    output_format: Optional[str] = Form(None),
+    bitrate: Optional[int] = Form(None)
 ):
-    """Change pitch and tempo of audio file"""
-    if not file.filename.lower().endswith(('.mp3', '.wav', '.flac', '.m4a')):
+    """Change pitch and tempo of audio file
+
+    output_format defaults to the upload's own format where it is one of
+    the supported outputs, WAV otherwise.
+    """
+    if not file.filename.lower().endswith(SUPPORTED_FORMATS):
         raise HTTPException(status_code=400, detail="Unsupported audio format")
     
     session_id = str(uuid.uuid4())
     session_dir = os.path.join(OUTPUT_DIR, session_id)
-    os.makedirs(session_dir, exist_ok=True)
+    encoding = encoding_parameters(output_format or format_for_path(file.filename), bitrate)
+    parameters = {**pitch_tempo_parameters(pitch_semitones, tempo_percent, quality), **encoding}
     
+    upload = await receive_upload(file, session_id)
     try:
-        # Save uploaded file
-        input_path = os.path.join(UPLOAD_DIR, f"{session_id}_{file.filename}")
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        stored = result_index.lookup(upload.content_hash, "pitch-tempo", parameters, session_id)
+        if stored:
+            return pitch_tempo_response(session_id, stored, deduplicated=True)
         
         # Generate output path
+        os.makedirs(session_dir, exist_ok=True)
         output_filename = f"processed_{file.filename}"
         output_path = os.path.join(session_dir, output_filename)
         
         # Process the file
-        result = pitch_tempo_processor.process_file(
-            input_path, output_path, pitch_semitones, tempo_percent, quality
+        result = await executor.run(
+            pitch_tempo_task, upload.source, output_path, pitch_semitones, tempo_percent, quality,
+            content_key=upload.content_hash, filename=upload.filename, **encoding
         )
         
         if result["success"]:
-            return {
-                "session_id": session_id,
-                "success": True,
-                "download_url": f"/api/download/{session_id}/processed",
-                "original_duration": result["original_duration"],
-                "new_duration": result["new_duration"],
-                "pitch_change": result["pitch_change"],
-                "tempo_change": result["tempo_change"]
-            }
+            record_result(upload.content_hash, "pitch-tempo", parameters, session_id, result)
+            return pitch_tempo_response(session_id, result)
         else:
             raise HTTPException(status_code=500, detail=result["error"])
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        upload.release()
+
+@app.post("/api/pitch-tempo/preview")
+async def preview_pitch_tempo(
+    file: Optional[UploadFile] = File(None),
+    preview_id: Optional[str] = Form(None),
+    pitch_semitones: float = Form(0),
+    tempo_percent: float = Form(0),
+    start_time: float = Form(30),
+    duration: float = Form(10),
+    quality: str = Form("fast")
+):
+    """Render a short processed window of a file and return it as WAV
+
+    Nothing is written to a session directory. The response carries an
+    X-Preview-Id header; later requests for the same file send it as
+    preview_id instead of re-uploading, and reuse the decoded window as long
+    as start_time and duration are unchanged.
+    """
+    if file is None and not preview_id:
+        raise HTTPException(status_code=400, detail="Send a file or a preview_id")
+    if file is not None and not file.filename.lower().endswith(SUPPORTED_FORMATS):
+        raise HTTPException(status_code=400, detail="Unsupported audio format")
+    if not 0 < duration <= MAX_PREVIEW_SECONDS or start_time < 0:
+        raise HTTPException(status_code=400, detail=f"Preview window must be 0-{MAX_PREVIEW_SECONDS} seconds")
+    
+    started = time.perf_counter()
+    source = None
+    filename = None
+    if file is not None:
+        # Always held in memory: previews never touch the upload directory
+        upload = await receive_upload(file, "preview", memory_bytes=MAX_UPLOAD_BYTES)
+        source, filename, preview_id = upload.data, upload.filename, upload.content_hash
+    
+    try:
+        result = await executor.run(
+            pitch_tempo_preview_task, source, preview_id, filename,
+            pitch_semitones, tempo_percent, start_time, duration, quality
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not result["success"]:
+        raise HTTPException(status_code=404 if result.get("expired") else 500, detail=result["error"])
+    
+    return Response(
+        content=result["preview_wav"],
+        media_type="audio/wav",
+        headers={
+            "X-Preview-Id": preview_id,
+            "X-Preview-Engine": result["engine"],
+            "X-Preview-Ms": str(round((time.perf_counter() - started) * 1000, 1)),
+            "Cache-Control": "no-store",
+        }
+    )
 
 @app.post("/api/pitch-tempo/analyze")
 async def analyze_audio_file(file: UploadFile = File(...)):
     """Analyze audio file properties"""
+    upload = await receive_upload(file, str(uuid.uuid4()))
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            shutil.copyfileobj(file.file, tmp)
-            analysis = pitch_tempo_processor.analyze_audio(tmp.name)
+        return await executor.run(analyze_audio_task, upload.source, upload.content_hash, upload.filename)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        upload.release()
+
+# Pipeline Endpoints
+# Chains tools on one decoded buffer: steps is a JSON list such as
+# [{"tool": "vocal-separator", "stem": "vocals"}, {"tool": "pitch-tempo",
+# "pitch_semitones": 2}, {"tool": "fade", "fade_out": 3}, {"tool": "normalize"}]
+@app.post("/api/pipeline/process")
+async def process_pipeline(
+    file: UploadFile = File(...),
+    steps: str = Form(...),
+    output_format: Optional[str] = Form(None),
+    bitrate: Optional[int] = Form(None)
+):
+    """Run a chain of tools; output_format defaults as for /api/pitch-tempo/process"""
+    if not file.filename.lower().endswith(SUPPORTED_FORMATS):
+        raise HTTPException(status_code=400, detail="Unsupported audio format")
+    
+    session_id = str(uuid.uuid4())
+    session_dir = os.path.join(OUTPUT_DIR, session_id)
+    encoding = encoding_parameters(output_format or format_for_path(file.filename), bitrate)
+    parameters = {"steps": pipeline_steps(steps), **encoding}
+    
+    upload = await receive_upload(file, session_id)
+    try:
+        stored = result_index.lookup(upload.content_hash, "pipeline", parameters, session_id)
+        if stored:
+            return pipeline_response(session_id, stored, deduplicated=True)
         
-        os.unlink(tmp.name)
-        return analysis
+        os.makedirs(session_dir, exist_ok=True)
+        output_path = os.path.join(session_dir, f"processed_{file.filename}")
+        result = await executor.run(
+            pipeline_task, upload.source, output_path, parameters["steps"],
+            content_key=upload.content_hash, filename=upload.filename, **encoding
+        )
         
+        if result["success"]:
+            record_result(upload.content_hash, "pipeline", parameters, session_id, result)
+            return pipeline_response(session_id, result)
+        else:
+            raise HTTPException(status_code=500, detail=result["error"])
+            
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        upload.release()
+
+# Job Endpoints
+# Submit endpoints return 202 straight away; clients poll /api/jobs/{job_id}.
+# The job id doubles as the session id for the download endpoints.
+@app.post("/api/jobs/vocal-separator", status_code=202)
+async def submit_vocal_separation(
+    file: UploadFile = File(...),
+    quality: str = Form("high"),
+    output_format: str = Form("wav"),
+    bitrate: Optional[int] = Form(None)
+):
+    """Queue a vocal separation job"""
+    if not file.filename.lower().endswith(SUPPORTED_FORMATS):
+        raise HTTPException(status_code=400, detail="Unsupported audio format")
+    
+    job_id = str(uuid.uuid4())
+    encoding = encoding_parameters(output_format, bitrate)
+    upload = await receive_upload(file, job_id)
+    return job_accepted_response(queue_vocal_separation(job_id, upload, quality, encoding))
+
+@app.post("/api/jobs/pitch-tempo", status_code=202)
+async def submit_pitch_tempo(
+    file: UploadFile = File(...),
+    pitch_semitones: float = Form(0),
+    tempo_percent: float = Form(0),
+    quality: str = Form("high"),
+    output_format: Optional[str] = Form(None),
+    bitrate: Optional[int] = Form(None)
+):
+    """Queue a pitch/tempo job (output_format defaults as for /api/pitch-tempo/process)"""
+    if not file.filename.lower().endswith(SUPPORTED_FORMATS):
+        raise HTTPException(status_code=400, detail="Unsupported audio format")
+    
+    job_id = str(uuid.uuid4())
+    encoding = encoding_parameters(output_format or format_for_path(file.filename), bitrate)
+    upload = await receive_upload(file, job_id)
+    job = queue_pitch_tempo(job_id, upload, pitch_semitones, tempo_percent, quality, encoding)
+    return job_accepted_response(job)
+
+@app.post("/api/jobs/pipeline", status_code=202)
+async def submit_pipeline(
+    file: UploadFile = File(...),
+    steps: str = Form(...),
+    output_format: Optional[str] = Form(None),
+    bitrate: Optional[int] = Form(None)
+):
+    """Queue a chain of tools (see /api/pipeline/process)"""
+    if not file.filename.lower().endswith(SUPPORTED_FORMATS):
+        raise HTTPException(status_code=400, detail="Unsupported audio format")
+    
+    job_id = str(uuid.uuid4())
+    encoding = encoding_parameters(output_format or format_for_path(file.filename), bitrate)
+    parameters = {"steps": pipeline_steps(steps), **encoding}
+    upload = await receive_upload(file, job_id)
+    
+    job = job_manager.store.create("pipeline", upload.filename, parameters, job_id=job_id)
+    stored = result_index.lookup(upload.content_hash, "pipeline", parameters, job_id)
+    if stored:
+        upload.release()
+        job = job_manager.complete(job_id, pipeline_response(job_id, stored, deduplicated=True))
+        return job_accepted_response(job)
+    
+    def on_result(result: dict) -> dict:
+        record_result(upload.content_hash, "pipeline", parameters, job_id, result)
+        return pipeline_response(job_id, result)
+    
+    session_dir = os.path.join(OUTPUT_DIR, job_id)
+    os.makedirs(session_dir, exist_ok=True)
+    job_manager.submit(
+        job, pipeline_task, upload.source, os.path.join(session_dir, f"processed_{upload.filename}"),
+        parameters["steps"], content_key=upload.content_hash, filename=upload.filename, **encoding,
+        on_result=on_result,
+        on_finish=upload.release
+    )
+    return job_accepted_response(job)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get job status, progress and, once completed, the download URLs"""
+    job = job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.model_dump(mode="json")
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a pending or running job"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.model_dump(mode="json")
+
+# Format Converter Endpoints
+@app.post("/api/converter/convert")
+async def convert_format(
+    file: UploadFile = File(...),
+    output_format: str = Form("mp3"),
+    bitrate: Optional[int] = Form(None)
+):
+    """Transcode an upload with ffmpeg, streaming the encoded audio back as it is produced
+    
+    The request waits for a free transcoder; a full queue is a 503. The
+    X-Transcode-Id header names the job in /api/converter/stats, which
+    reports its encode speed once it finishes.
+    """
+    if not file.filename.lower().endswith(SUPPORTED_FORMATS):
+        raise HTTPException(status_code=400, detail="Unsupported audio format")
+    encoding = encoding_parameters(output_format, bitrate)
+    if not converter.available:
+        raise HTTPException(status_code=503, detail="Format conversion is unavailable: ffmpeg is not installed")
+    
+    # ffmpeg cannot seek in a pipe, so containers that may need it are always spooled
+    seekable = os.path.splitext(file.filename)[1].lower() in SEEKABLE_INPUTS
+    upload = await receive_upload(file, str(uuid.uuid4()), **({"memory_bytes": 0} if seekable else {}))
+    
+    try:
+        job = await converter.job(upload.source, encoding["output_format"], encoding["bitrate"], upload.filename)
+        stream = converter.stream(job)
+        try:
+            # Wait for the first bytes so a full queue or unreadable input is still an HTTP error
+            first = await anext(stream, b"")
+        except TranscoderBusy as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        except TranscodeTimeout as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except TranscodeError as e:
+            raise HTTPException(status_code=422, detail=f"Format conversion failed: {e}")
+    except BaseException:
+        # Errors, and cancellation while queued for a transcoder, still free the spooled upload
+        upload.release()
+        raise
+    
+    async def body():
+        try:
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            upload.release()
+            await stream.aclose()
+    
+    stem = os.path.splitext(upload.filename)[0]
+    return StreamingResponse(
+        body(),
+        media_type=job.output_format.media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{stem}.{job.output_format.extension}"',
+            "X-Transcode-Id": job.id,
+        }
+    )
+
+@app.get("/api/converter/stats")
+async def converter_stats():
+    """Transcoder pool size, queue depth and recent jobs with their speed relative to real time"""
+    return converter.pool.stats()
+
+# Batch Endpoints
+# A batch is one job per file (archives are expanded), fanned out over the
+# worker pool. Poll /api/batch/{batch_id} for per-item progress; the ZIP
+# download streams each item's outputs as soon as its job finishes.
+BATCH_ARTIFACTS = {
+    "vocal-separator": ("vocals", "instrumental"),
+    "pitch-tempo": ("processed",),
+}
+
+async def receive_batch(files: List[UploadFile], batch_id: str, supported: tuple = SUPPORTED_FORMATS) -> list:
+    """Ingest a batch request's files (see ingest_batch); an empty or oversized batch is a 400"""
+    def spool_path(index: int, filename: str) -> str:
+        return upload_path(f"{batch_id}_{index}", filename)
+    try:
+        return await run_in_threadpool(ingest_batch, files, spool_path, supported)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def queue_batch(batch_id: str, tool_name: str, ingested: list, queue) -> Batch:
+    """Queue a job per ingested item with queue(job_id, upload); items that cannot be queued keep their error"""
+    items = []
+    for index, (filename, upload, error) in enumerate(ingested):
+        job_id = None
+        if upload is not None:
+            try:
+                job_id = queue(str(uuid.uuid4()), upload).id
+            except HTTPException as e:
+                upload.release()
+                error = e.detail
+        items.append(BatchItem(index, filename, job_id, error))
+    return batches.add(Batch(batch_id, tool_name, items))
+
+def batch_status(batch: Batch) -> dict:
+    items = []
+    counts = {}
+    for item in batch.items:
+        job = job_manager.store.get(item.job_id) if item.job_id else None
+        # A queued item whose job record is gone has expired along with its outputs
+        status = job.status.value if job else "expired" if item.job_id else "rejected"
+        counts[status] = counts.get(status, 0) + 1
+        items.append({
+            "index": item.index,
+            "filename": item.filename,
+            "job_id": item.job_id,
+            "status": status,
+            "progress": job.progress if job else 100,
+            "error": job.error_message if job else item.error,
+            "result": job.result_metadata if job else {},
+        })
+    unfinished = counts.get("pending", 0) + counts.get("processing", 0)
+    return {
+        "batch_id": batch.id,
+        "tool_name": batch.tool_name,
+        "created_at": batch.created_at.isoformat(),
+        "total": len(items),
+        "counts": counts,
+        "progress": round(sum(item["progress"] for item in items) / len(items)),
+        "finished": unfinished == 0,
+        "download_url": f"/api/batch/{batch.id}/download",
+        "items": items,
+    }
+
+def get_batch_or_404(batch_id: str) -> Batch:
+    batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+@app.post("/api/batch/vocal-separator", status_code=202)
+async def submit_vocal_separation_batch(
+    files: List[UploadFile] = File(...),
+    quality: str = Form("high"),
+    output_format: str = Form("wav"),
+    bitrate: Optional[int] = Form(None)
+):
+    """Queue vocal separation for many files, or the audio files inside ZIP archives"""
+    encoding = encoding_parameters(output_format, bitrate)
+    batch_id = str(uuid.uuid4())
+    ingested = await receive_batch(files, batch_id)
+    batch = queue_batch(batch_id, "vocal-separator", ingested,
+                        lambda job_id, upload: queue_vocal_separation(job_id, upload, quality, encoding))
+    return batch_status(batch)
+
+@app.post("/api/batch/pitch-tempo", status_code=202)
+async def submit_pitch_tempo_batch(
+    files: List[UploadFile] = File(...),
+    pitch_semitones: float = Form(0),
+    tempo_percent: float = Form(0),
+    quality: str = Form("high"),
+    output_format: Optional[str] = Form(None),
+    bitrate: Optional[int] = Form(None)
+):
+    """Queue a pitch/tempo change for many files (output_format defaults per file, as for single files)"""
+    if output_format is not None:
+        encoding_parameters(output_format, bitrate)
+    batch_id = str(uuid.uuid4())
+    ingested = await receive_batch(files, batch_id)
+    
+    def queue(job_id: str, upload: IngestedUpload):
+        encoding = encoding_parameters(output_format or format_for_path(upload.filename), bitrate)
+        return queue_pitch_tempo(job_id, upload, pitch_semitones, tempo_percent, quality, encoding)
+    
+    return batch_status(queue_batch(batch_id, "pitch-tempo", ingested, queue))
+
+def tag_map(tags: str, name: str = "tags") -> dict:
+    """Tag updates from a JSON object of TAG_FIELDS; anything else is a 400"""
+    try:
+        fields = json.loads(tags)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"{name} is not valid JSON: {e}")
+    if not isinstance(fields, dict):
+        raise HTTPException(status_code=400, detail=f"{name} must be a JSON object")
+    unknown = set(fields) - set(TAG_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown tag fields: {', '.join(sorted(unknown))} "
+                                                    f"(choose from {', '.join(TAG_FIELDS)})")
+    return tag_updates(fields)
+
+@app.post("/api/batch/metadata-editor")
+async def edit_metadata_batch(
+    files: List[UploadFile] = File(...),
+    tags: str = Form(...),
+    file_tags: Optional[str] = Form(None)
+):
+    """Apply a tag map to many files, or the audio files inside ZIP archives, and stream them back as a ZIP
+    
+    tags is a JSON object of tag fields for every file (an empty value
+    deletes the tag); file_tags optionally maps filenames to fields for
+    that file alone. Files are edited in place where they were spooled,
+    concurrently, and tags.json closes the archive with each file's status,
+    changed fields and timings.
+    """
+    updates = tag_map(tags)
+    overrides = {}
+    if file_tags:
+        try:
+            per_file = json.loads(file_tags)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"file_tags is not valid JSON: {e}")
+        if not isinstance(per_file, dict):
+            raise HTTPException(status_code=400, detail="file_tags must be a JSON object")
+        overrides = {filename: tag_map(json.dumps(fields), f"file_tags[{filename}]")
+                     for filename, fields in per_file.items()}
+    
+    started = time.perf_counter()
+    batch_id = str(uuid.uuid4())
+    ingested = await receive_batch(files, batch_id, TAGGABLE_FORMATS)
+    edited = []
+    for index, (filename, upload, error) in enumerate(ingested):
+        # Uploads held in memory are edited as file objects, spooled ones in place on disk
+        target = None if upload is None else upload.open() if upload.in_memory else upload.path
+        edited.append((BatchItem(index, filename, error=error), upload, target))
+    results = await tag_editor.edit_many(
+        (target, {**updates, **overrides.get(item.filename, {})})
+        for item, upload, target in edited if upload is not None
+    )
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+    
+    async def archive():
+        zip_stream = ZipStream()
+        summary = []
+        remaining = iter(results)
+        try:
+            for item, upload, target in edited:
+                if upload is None:
+                    summary.append({"index": item.index, "filename": item.filename, "success": False,
+                                    "error": item.error})
+                    continue
+                result = next(remaining)
+                summary.append({"index": item.index, "filename": item.filename, **result})
+                if not result["success"]:
+                    continue
+                arcname = f"{item.index + 1:03d}_{item.filename}"
+                if upload.in_memory:
+                    yield zip_stream.add_bytes(arcname, target.getvalue())
+                else:
+                    async for chunk in zip_stream.add_file(arcname, target):
+                        if chunk:
+                            yield chunk
+            yield zip_stream.add_bytes("tags.json", json.dumps(
+                {"batch_id": batch_id, "elapsed_ms": elapsed_ms, "items": summary}, indent=2).encode())
+            yield zip_stream.close()
+        finally:
+            for _, upload, _ in edited:
+                if upload is not None:
+                    upload.release()
+    
+    return StreamingResponse(
+        archive(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="tags_{batch_id}.zip"'}
+    )
+
+@app.get("/api/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    """Per-item status, progress and errors of a batch"""
+    return batch_status(get_batch_or_404(batch_id))
+
+@app.delete("/api/batch/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """Cancel every unfinished item of a batch"""
+    batch = get_batch_or_404(batch_id)
+    for item in batch.items:
+        if item.job_id:
+            job_manager.cancel(item.job_id)
+    return batch_status(batch)
+
+@app.get("/api/batch/{batch_id}/download")
+async def download_batch(batch_id: str):
+    """ZIP of every item's outputs, streamed in the order items finish, closed by batch.json"""
+    batch = get_batch_or_404(batch_id)
+    
+    def collect(item: BatchItem):
+        job = job_manager.store.get(item.job_id)
+        if job is None:
+            # The job record was pruned along with its outputs (see batch_status)
+            return [], {"job_id": item.job_id, "status": "expired", "error": "Output no longer available"}
+        entry = {"job_id": item.job_id, "status": job.status.value, "error": job.error_message}
+        if job.status.value != "completed":
+            return [], entry
+        storage_id = result_index.storage_id(item.job_id)
+        manifest = manifests.get(storage_id)
+        if manifest is None:
+            entry.update(status="failed", error="Output no longer available")
+            return [], entry
+        janitor.touch(storage_id)
+        session_dir = manifests.session_dir(storage_id)
+        artifacts = manifest["artifacts"]
+        return [os.path.join(session_dir, artifacts[name]["file"]) for name in BATCH_ARTIFACTS[batch.tool_name]], entry
+    
+    return StreamingResponse(
+        batch_archive(batch, job_manager.wait, collect),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="batch_{batch_id}.zip"'}
+    )
 
 # Download Endpoints
-@app.get("/api/download/{session_id}/vocals")
-async def download_vocals(session_id: str):
-    """Download separated vocals"""
-    session_dir = os.path.join(OUTPUT_DIR, session_id)
-    vocals_files = [f for f in os.listdir(session_dir) if f.endswith('_vocals.wav')]
+# Files are found through the session manifest; responses carry an ETag and
+# long-lived cache headers and honour Range for seeking in the player.
+# ?format= (and &bitrate= for lossy formats) asks for another encoding; it is
+# streamed from the session's float master as it is encoded.
+def serve_artifact(request: Request, session_id: str, artifact: str, label: str,
+                   output_format: Optional[str], bitrate: Optional[int]) -> Response:
+    storage_id = result_index.storage_id(session_id)
+    manifest = manifests.get(storage_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    artifacts = manifest["artifacts"]
+    entry = artifacts.get(artifact)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"{label} file not found")
+    session_dir = manifests.session_dir(storage_id)
+    janitor.touch(storage_id)
     
-    if not vocals_files:
-        raise HTTPException(status_code=404, detail="Vocals file not found")
+    if output_format is None:
+        return artifact_response(request, session_dir, entry)
+    try:
+        fmt = get_output_format(output_format)
+        bitrate = fmt.resolve_bitrate(bitrate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if entry["format"] == fmt.extension and entry.get("bitrate") == bitrate:
+        return artifact_response(request, session_dir, entry)
     
-    file_path = os.path.join(session_dir, vocals_files[0])
-    return FileResponse(file_path, filename=vocals_files[0], media_type='audio/wav')
+    master = artifacts.get(f"{artifact}_master")
+    if master is None:
+        raise HTTPException(status_code=404, detail=f"{label} master not available for conversion")
+    if not fmt.streamable:
+        # The master itself is a (float) WAV and keeps Range support
+        return artifact_response(request, session_dir, master)
+    return transcoded_response(request, session_dir, master, fmt, bitrate)
+
+@app.get("/api/download/{session_id}/vocals")
+async def download_vocals(session_id: str, request: Request,
+                          output_format: Optional[str] = Query(None, alias="format"),
+                          bitrate: Optional[int] = None):
+    """Download separated vocals"""
+    return serve_artifact(request, session_id, "vocals", "Vocals", output_format, bitrate)
 
 @app.get("/api/download/{session_id}/instrumental")
-async def download_instrumental(session_id: str):
+async def download_instrumental(session_id: str, request: Request,
+                                output_format: Optional[str] = Query(None, alias="format"),
+                                bitrate: Optional[int] = None):
     """Download separated instrumental"""
-    session_dir = os.path.join(OUTPUT_DIR, session_id)
-    instrumental_files = [f for f in os.listdir(session_dir) if f.endswith('_instrumental.wav')]
-    
-    if not instrumental_files:
-        raise HTTPException(status_code=404, detail="Instrumental file not found")
-    
-    file_path = os.path.join(session_dir, instrumental_files[0])
-    return FileResponse(file_path, filename=instrumental_files[0], media_type='audio/wav')
+    return serve_artifact(request, session_id, "instrumental", "Instrumental", output_format, bitrate)
 
 @app.get("/api/download/{session_id}/processed")
-async def download_processed(session_id: str):
+async def download_processed(session_id: str, request: Request,
+                             output_format: Optional[str] = Query(None, alias="format"),
+                             bitrate: Optional[int] = None):
     """Download processed audio file"""
-    session_dir = os.path.join(OUTPUT_DIR, session_id)
-    processed_files = [f for f in os.listdir(session_dir) if f.startswith('processed_')]
-    
-    if not processed_files:
-        raise HTTPException(status_code=404, detail="Processed file not found")
-    
-    file_path = os.path.join(session_dir, processed_files[0])
-    return FileResponse(file_path, filename=processed_files[0], media_type='audio/wav')
+    return serve_artifact(request, session_id, "processed", "Processed", output_format, bitrate)
 
 # Cleanup endpoint
 @app.delete("/api/cleanup/{session_id}")
 async def cleanup_session(session_id: str):
     """Clean up session files"""
     session_dir = os.path.join(OUTPUT_DIR, session_id)
-    if os.path.exists(session_dir):
-        shutil.rmtree(session_dir)
-        return {"message": "Session cleaned up successfully"}
-    else:
+    if not result_index.knows(session_id) and not os.path.exists(session_dir):
         raise HTTPException(status_code=404, detail="Session not found")
+    
+    # Deduplicated outputs are shared; only the last reference deletes them
+    storage_id = result_index.release(session_id)
+    if storage_id is not None:
+        manifests.forget(storage_id)
+        janitor.forget(storage_id)
+        await run_in_threadpool(shutil.rmtree, os.path.join(OUTPUT_DIR, storage_id), ignore_errors=True)
+    return {"message": "Session cleaned up successfully"}
+
+# Every route is registered; what is left of a cold start is server startup and warm-up
+startup_monitor.mark("imported")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
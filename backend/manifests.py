@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from services.audio_cache import file_digest
+from services.audio_probe import probe_audio
+
+MANIFEST_NAME = "manifest.json"
+
+MEDIA_TYPES = {
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "mp3": "audio/mpeg",
+    "ogg": "audio/ogg",
+    "opus": "audio/ogg",
+    "m4a": "audio/mp4",
+    "npy": "application/octet-stream",
+}
+
+
+def describe_artifact(path: str) -> dict:
+    """Manifest entry for one output file"""
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    entry = {
+        "file": os.path.basename(path),
+        "size": os.path.getsize(path),
+        "hash": file_digest(path),
+        "format": extension,
+        "media_type": MEDIA_TYPES.get(extension, "application/octet-stream"),
+    }
+    try:
+        info = probe_audio(path)
+        entry.update(duration=info["duration"], sample_rate=info["sample_rate"], channels=info["channels"])
+    except ValueError:
+        pass
+    return entry
+
+
+def write_manifest(output_dir: str, artifacts: Dict[str, str],
+                   details: Optional[Dict[str, dict]] = None) -> dict:
+    """Describe a job's outputs, keyed by artifact name, in output_dir/manifest.json
+
+    details adds fields (e.g. the encoding bitrate) to individual entries.
+    Runs in the worker that produced the files, while they are still in the
+    page cache. The manifest is written atomically, so readers never see a
+    partial one.
+    """
+    manifest = {
+        "created_at": datetime.utcnow().isoformat(),
+        "artifacts": {name: describe_artifact(path) for name, path in artifacts.items()},
+    }
+    for name, fields in (details or {}).items():
+        manifest["artifacts"][name].update(fields)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+class ManifestStore:
+    """Session manifests by storage session id, memoised in a bounded LRU
+
+    A download costs one dictionary lookup, or a single small file read the
+    first time a session is seen by this process; directories are never
+    listed.
+    """
+
+    def __init__(self, output_root: str, max_entries: int = 4096):
+        self.output_root = output_root
+        self.max_entries = max_entries
+        self._manifests: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def session_dir(self, storage_id: str) -> str:
+        return os.path.join(self.output_root, storage_id)
+
+    def get(self, storage_id: str) -> Optional[dict]:
+        with self._lock:
+            manifest = self._manifests.get(storage_id)
+            if manifest is not None:
+                self._manifests.move_to_end(storage_id)
+                return manifest
+        try:
+            with open(os.path.join(self.session_dir(storage_id), MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.put(storage_id, manifest)
+        return manifest
+
+    def put(self, storage_id: str, manifest: dict):
+        with self._lock:
+            self._manifests[storage_id] = manifest
+            self._manifests.move_to_end(storage_id)
+            while len(self._manifests) > self.max_entries:
+                self._manifests.popitem(last=False)
+
+    def forget(self, storage_id: str):
+        with self._lock:
+            self._manifests.pop(storage_id, None)
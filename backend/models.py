@@ -8,6 +8,7 @@ class ProcessingStatus(Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 class AudioFileModel(BaseModel):
     id: str
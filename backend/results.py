@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Set
+
+# Keys of a processor result that point at output files
+OUTPUT_PATH_KEYS = (
+    "vocals_path", "instrumentals_path", "output_path",
+    "vocals_master_path", "instrumentals_master_path", "master_path",
+)
+
+
+class ResultEntry:
+    def __init__(self, storage_id: str, result: Dict[str, Any]):
+        # Session whose output directory holds the files
+        self.storage_id = storage_id
+        self.result = result
+        # Every session currently pointing at these files, owner included
+        self.refs: Set[str] = {storage_id}
+
+
+class ResultIndex:
+    """Index of finished results by (content hash, tool, parameters)
+
+    A repeat upload of the same content with the same parameters gets a new
+    session that aliases the stored outputs instead of reprocessing. Output
+    directories are reference counted so cleaning up one session never
+    deletes files another session still points to.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, ResultEntry] = {}
+        self._by_session: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(content_hash: str, tool_name: str, parameters: Dict[str, Any]) -> str:
+        return json.dumps([content_hash, tool_name, parameters], sort_keys=True)
+
+    def lookup(self, content_hash: str, tool_name: str, parameters: Dict[str, Any],
+               session_id: str) -> Optional[Dict[str, Any]]:
+        """Return the stored result and register session_id as a reference, or None"""
+        key = self.key(content_hash, tool_name, parameters)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not all(os.path.exists(entry.result[k]) for k in OUTPUT_PATH_KEYS if k in entry.result):
+                # Outputs were removed behind our back; forget the entry
+                self._drop(key, entry)
+                return None
+            entry.refs.add(session_id)
+            self._by_session[session_id] = key
+            return entry.result
+
+    def register(self, content_hash: str, tool_name: str, parameters: Dict[str, Any],
+                 session_id: str, result: Dict[str, Any]):
+        """Record the result a session just produced"""
+        key = self.key(content_hash, tool_name, parameters)
+        with self._lock:
+            if key in self._entries:
+                # An identical request finished first; keep serving that one
+                return
+            self._entries[key] = ResultEntry(session_id, result)
+            self._by_session[session_id] = key
+
+    def storage_id(self, session_id: str) -> str:
+        """Session whose output directory holds session_id's files"""
+        with self._lock:
+            key = self._by_session.get(session_id)
+            return self._entries[key].storage_id if key else session_id
+
+    def knows(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._by_session
+
+    def release(self, session_id: str) -> Optional[str]:
+        """Drop a session's reference.
+
+        Returns the storage session whose directory may now be deleted, or
+        None while other sessions still reference the files.
+        """
+        with self._lock:
+            key = self._by_session.pop(session_id, None)
+            if key is None:
+                return session_id
+            entry = self._entries[key]
+            entry.refs.discard(session_id)
+            if entry.refs:
+                return None
+            del self._entries[key]
+            return entry.storage_id
+
+    def evict(self, storage_id: str):
+        """Forget the result stored in storage_id, e.g. after the janitor deleted it"""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry.storage_id == storage_id:
+                    self._drop(key, entry)
+                    return
+
+    def _drop(self, key: str, entry: ResultEntry):
+        del self._entries[key]
+        for session_id in entry.refs:
+            self._by_session.pop(session_id, None)
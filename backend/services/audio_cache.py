@@ -0,0 +1,317 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, MutableMapping, Optional, Tuple, Union
+
+import numpy as np
+
+Arrays = Tuple[np.ndarray, ...]
+
+# A file path, or the bytes of an upload small enough to be decoded from memory
+AudioSource = Union[str, bytes]
+
+# Quality tier -> librosa res_type; unlisted tiers use soxr_hq. The cheap
+# soxr settings are several times faster and inaudibly different for
+# previews and fast-tier jobs.
+QUALITY_RESAMPLERS = {"fast": "soxr_qq", "medium": "soxr_mq", "high": "soxr_hq", "studio": "soxr_vhq"}
+
+
+def resampler_for_quality(quality: str) -> str:
+    return QUALITY_RESAMPLERS.get(quality, "soxr_hq")
+
+
+def record_time(timings: Optional[Dict[str, float]], name: str, started: float):
+    """Add the milliseconds since started (a perf_counter value) to timings[name]"""
+    if timings is not None:
+        timings[name] = round(timings.get(name, 0.0) + (time.perf_counter() - started) * 1000, 3)
+
+
+def content_hasher():
+    """Hash object used for every content digest (files, uploads, cache keys)"""
+    return hashlib.blake2b(digest_size=20)
+
+
+def file_digest(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """Content hash of a file, read in chunks"""
+    digest = content_hasher()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def as_file(source: AudioSource):
+    """A path as is, or in-memory upload bytes wrapped in a seekable file object"""
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+
+def decode_audio(source: AudioSource, filename: Optional[str] = None, **kwargs) -> Tuple[np.ndarray, int]:
+    """librosa.load(source, **kwargs) for a path or for upload bytes held in memory
+
+    filename supplies the extension for bytes that libsndfile cannot read.
+    """
+    import librosa
+
+    if not isinstance(source, (bytes, bytearray)):
+        return librosa.load(source, **kwargs)
+    try:
+        return librosa.load(io.BytesIO(source), **kwargs)
+    except Exception:
+        # audioread backends (m4a, aac) only open real paths
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename or "")[1]) as tmp:
+            tmp.write(source)
+            tmp.flush()
+            return librosa.load(tmp.name, **kwargs)
+
+
+class AudioCache:
+    """Content-addressed cache for decoded audio and spectral intermediates
+
+    Entries are tuples of NumPy arrays keyed by the source file's content
+    hash plus the parameters that produced them. A byte-bounded in-memory
+    LRU tier sits in front of a byte-bounded on-disk tier. Entries are
+    written through to disk so every worker process sharing cache_dir can
+    reuse them, and disk hits are memory-mapped rather than read.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_memory_bytes: int = 512 << 20,
+                 max_disk_bytes: int = 4 << 30):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        # Optional shared mapping (e.g. a multiprocessing.Manager dict) that
+        # receives this process's counters, keyed by pid
+        self.stats_sink: Optional[MutableMapping] = None
+        self._memory: "OrderedDict[str, Arrays]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None
+        self._digests: Dict[tuple, str] = {}
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._lock = threading.RLock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def digest(self, file_path: str) -> str:
+        """Content hash of file_path, memoised on its identity and mtime"""
+        st = os.stat(file_path)
+        identity = (os.path.abspath(file_path), st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._digests.get(identity)
+        if cached is None:
+            cached = file_digest(file_path)
+            with self._lock:
+                self._digests[identity] = cached
+        return cached
+
+    @staticmethod
+    def key(content_digest: str, kind: str, **params) -> str:
+        """Cache key for one kind of result derived from some content"""
+        payload = json.dumps({"content": content_digest, "kind": kind, "params": params}, sort_keys=True)
+        hasher = content_hasher()
+        hasher.update(payload.encode())
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> Optional[Arrays]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._count("memory_hits")
+                return value
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self._count("misses")
+                return None
+            self._count("disk_hits")
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: Arrays, persist: bool = True):
+        """Store value; with persist=False it stays in this process's memory tier"""
+        value = tuple(value)
+        with self._lock:
+            self._remember(key, value)
+        if persist:
+            self._write_disk(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Arrays]) -> Arrays:
+        value = self.get(key)
+        if value is None:
+            value = tuple(compute())
+            self.put(key, value)
+        return value
+
+    def cached(self, content_digest: Optional[str], kind: str, compute: Callable[[], Arrays],
+               **params) -> Arrays:
+        """get_or_compute under key(content_digest, kind, **params); no caching without a digest"""
+        if content_digest is None:
+            return tuple(compute())
+        return self.get_or_compute(self.key(content_digest, kind, **params), compute)
+
+    def load_audio(self, source: AudioSource, sr: Optional[int] = None, res_type: str = "soxr_hq",
+                   timings: Optional[Dict[str, float]] = None, content_key: Optional[str] = None,
+                   filename: Optional[str] = None) -> Tuple[np.ndarray, int]:
+        """librosa.load(source, sr=sr, mono=False, res_type=res_type), cached on the file's content
+
+        The file is decoded and cached once at its native rate; sr=None
+        returns that decode as is. Any other rate is resampled from it and
+        cached separately per (sr, res_type). timings, if given, accumulates
+        the decode_ms and resample_ms spent here (cache hits included).
+        source may be upload bytes, in which case content_key (the upload's
+        content hash) is required; for paths it saves rehashing the file.
+        """
+        # Imported here so the API process can hash uploads without loading librosa
+        import librosa
+
+        digest = content_key or self.digest(source)
+
+        def decode():
+            audio, native_sr = decode_audio(source, filename, sr=None, mono=False)
+            return audio, np.array([native_sr])
+
+        started = time.perf_counter()
+        audio, native_sr = self.cached(digest, "pcm", decode, sr=None)
+        native_sr = int(native_sr[0])
+        record_time(timings, "decode_ms", started)
+        if sr is None or sr == native_sr:
+            return audio, native_sr
+
+        def resample():
+            return (librosa.resample(audio, orig_sr=native_sr, target_sr=sr, res_type=res_type),)
+
+        started = time.perf_counter()
+        resampled, = self.cached(digest, "pcm", resample, sr=sr, res_type=res_type)
+        record_time(timings, "resample_ms", started)
+        return resampled, sr
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(
+                self._stats,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+            )
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self.cache_dir and os.path.isdir(self.cache_dir):
+                for name in os.listdir(self.cache_dir):
+                    shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            self._disk_bytes = 0
+
+    def _count(self, counter: str):
+        self._stats[counter] += 1
+        if self.stats_sink is not None:
+            try:
+                self.stats_sink[os.getpid()] = dict(self._stats)
+            except Exception:
+                # Stats are best effort; a dead manager must not fail processing
+                self.stats_sink = None
+
+    def _remember(self, key: str, value: Arrays):
+        size = sum(array.nbytes for array in value)
+        if size > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= sum(array.nbytes for array in previous)
+        self._memory[key] = value
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= sum(array.nbytes for array in evicted)
+
+    # Disk tier: one directory per entry holding 0.npy, 1.npy, ...
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _read_disk(self, key: str) -> Optional[Arrays]:
+        if not self.cache_dir:
+            return None
+        entry_dir = self._entry_dir(key)
+        try:
+            count = len(os.listdir(entry_dir))
+            value = tuple(
+                np.load(os.path.join(entry_dir, f"{i}.npy"), mmap_mode="r") for i in range(count)
+            )
+            os.utime(entry_dir)  # LRU order for disk eviction
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, value: Arrays):
+        if not self.cache_dir:
+            return
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+        size = sum(array.nbytes for array in value)
+        if size > self.max_disk_bytes:
+            return
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            for i, array in enumerate(value):
+                np.save(os.path.join(tmp_dir, f"{i}.npy"), np.ascontiguousarray(array))
+            # Publish atomically; another worker may have written the same entry
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_usage()[0]
+            else:
+                self._disk_bytes += size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _scan_disk_usage(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("."):
+                continue
+            entry_dir = os.path.join(self.cache_dir, name)
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+                total += size
+            except OSError:
+                continue
+        return total, entries
+
+    def _evict_disk(self):
+        """Delete least recently used entries until the disk tier is at 90% of budget"""
+        total, entries = self._scan_disk_usage()
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+        self._disk_bytes = total
+
+
+_default_cache: Optional[AudioCache] = None
+
+
+def default_cache() -> AudioCache:
+    """Process-wide cache configured from ODOREMOVER_CACHE_* environment variables"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = AudioCache(
+            cache_dir=os.environ.get("ODOREMOVER_CACHE_DIR", "cache"),
+            max_memory_bytes=int(os.environ.get("ODOREMOVER_CACHE_MEMORY_MB", 512)) << 20,
+            max_disk_bytes=int(os.environ.get("ODOREMOVER_CACHE_DISK_MB", 4096)) << 20,
+        )
+    return _default_cache
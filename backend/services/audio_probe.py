@@ -0,0 +1,392 @@
+import io
+import mmap
+import os
+import math
+import shutil
+import struct
+import tempfile
+from typing import BinaryIO, Optional, Union
+
+import numpy as np
+import soundfile as sf
+
+# MPEG audio header tables, keyed by (1 for MPEG-1 or 2 for MPEG-2/2.5, layer)
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+
+def probe_audio(source: Union[str, BinaryIO], filename: Optional[str] = None) -> dict:
+    """Duration, native sample rate and channel count without decoding the audio
+
+    source is a path or a seekable binary file object (e.g. an upload's
+    spooled file); filename supplies the extension when source is a file
+    object. Reads container headers through libsndfile, counts MPEG frame
+    headers for MP3 (whose headers are unreliable), and falls back to
+    mutagen or audioread for containers libsndfile cannot open.
+    """
+    name = filename or (source if isinstance(source, str) else "")
+    extension = os.path.splitext(name)[1].lower()
+
+    info = _probe_mp3(source) if extension == ".mp3" else None
+    if info is None:
+        info = _probe_soundfile(source) or _probe_fallback(source, extension)
+    if info is None:
+        raise ValueError("Unrecognised audio file")
+
+    info["format"] = "stereo" if info["channels"] >= 2 else "mono"
+    return info
+
+
+def _rewind(source):
+    if not isinstance(source, str):
+        source.seek(0)
+
+
+def _probe_soundfile(source) -> Optional[dict]:
+    _rewind(source)
+    try:
+        info = sf.info(source)
+    except (RuntimeError, TypeError):
+        return None
+    return {
+        "duration": info.frames / info.samplerate,
+        "sample_rate": info.samplerate,
+        "channels": info.channels,
+        "frames": info.frames,
+        "container": info.format,
+        "subtype": info.subtype,
+        "probe": "header",
+    }
+
+
+def _probe_fallback(source, extension: str) -> Optional[dict]:
+    """Header probe for containers libsndfile cannot read (m4a, aac, ...)"""
+    _rewind(source)
+    try:
+        import mutagen
+        tags = mutagen.File(source)
+        if tags is not None and getattr(tags.info, "sample_rate", None):
+            return {
+                "duration": float(tags.info.length),
+                "sample_rate": int(tags.info.sample_rate),
+                "channels": int(tags.info.channels),
+                "container": extension.lstrip(".").upper(),
+                "probe": "header",
+            }
+    except ImportError:
+        pass
+    except Exception:
+        return None
+
+    # audioread asks its backend (ffmpeg, gstreamer) for stream properties
+    # without decoding, but it needs a real path
+    import audioread
+    tmp_path = None
+    try:
+        if isinstance(source, str):
+            path = source
+        else:
+            _rewind(source)
+            with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp:
+                shutil.copyfileobj(source, tmp)
+            path = tmp_path = tmp.name
+        with audioread.audio_open(path) as f:
+            return {
+                "duration": float(f.duration),
+                "sample_rate": int(f.samplerate),
+                "channels": int(f.channels),
+                "container": extension.lstrip(".").upper(),
+                "probe": "audioread",
+            }
+    except Exception:
+        return None
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
+
+
+def _parse_mp3_header(header: int) -> Optional[dict]:
+    """Decode a 32-bit MPEG audio frame header, or None if it is not one"""
+    if header >> 21 != 0x7FF:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}.get((header >> 19) & 0x3)
+    layer = {1: 3, 2: 2, 3: 1}.get((header >> 17) & 0x3)
+    bitrate_index = (header >> 12) & 0xF
+    rate_index = (header >> 10) & 0x3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (header >> 9) & 0x1
+    channels = 1 if (header >> 6) & 0x3 == 3 else 2
+    if layer == 1:
+        samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version != 1:
+        samples, length = 576, 72 * bitrate // sample_rate + padding
+    else:
+        samples, length = 1152, 144 * bitrate // sample_rate + padding
+    return {
+        "version": version,
+        "layer": layer,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "samples": samples,
+        "length": length,
+    }
+
+
+def _read_buffer(source):
+    """Memory-map the file when possible so frame scanning costs no copy"""
+    try:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # Empty files cannot be mapped, and in-memory spools have no fileno
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                return f.read()
+        source.seek(0)
+        return source.read()
+
+
+def _probe_mp3(source) -> Optional[dict]:
+    data = _read_buffer(source)
+    try:
+        return _scan_mp3(data)
+    except (struct.error, IndexError):
+        # Truncated file; let the generic probes have a go
+        return None
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def _scan_mp3(data) -> Optional[dict]:
+    size = len(data)
+    offset = 0
+    # Skip an ID3v2 tag (syncsafe size, optional 10-byte footer)
+    if data[:3] == b"ID3" and size >= 10:
+        tag_size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        offset = 10 + tag_size + (10 if data[5] & 0x10 else 0)
+
+    # Find the first frame
+    first = None
+    while offset + 4 <= size:
+        first = _parse_mp3_header(struct.unpack(">I", data[offset:offset + 4])[0])
+        if first:
+            break
+        offset = data.find(b"\xff", offset + 1)
+        if offset < 0:
+            return None
+    if first is None:
+        return None
+
+    info = {
+        "sample_rate": first["sample_rate"],
+        "channels": first["channels"],
+        "container": "MP3",
+    }
+
+    # VBR encoders store the frame count in a Xing/Info or VBRI header
+    side_info = (32 if first["channels"] == 2 else 17) if first["version"] == 1 else \
+        (17 if first["channels"] == 2 else 9)
+    xing = offset + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+        if flags & 0x1:
+            frames = struct.unpack(">I", data[xing + 8:xing + 12])[0]
+            info.update(frames=frames * first["samples"], probe="header")
+    elif data[offset + 36:offset + 40] == b"VBRI":
+        frames = struct.unpack(">I", data[offset + 50:offset + 54])[0]
+        info.update(frames=frames * first["samples"], probe="header")
+
+    if "frames" not in info:
+        # No usable header: walk the frame headers without decoding anything
+        samples = 0
+        while offset + 4 <= size:
+            frame = _parse_mp3_header(struct.unpack(">I", data[offset:offset + 4])[0])
+            if frame is None or frame["length"] <= 0:
+                break
+            samples += frame["samples"]
+            offset += frame["length"]
+        info.update(frames=samples, probe="frame-scan")
+
+    info["duration"] = info["frames"] / info["sample_rate"]
+    return info
+
+
+class PcmLayout:
+    """Where and how the samples of an uncompressed WAV/RF64/AIFF file sit on disk
+
+    Frames are fixed-size records from data_offset on, so any range of
+    them can be addressed in a memory map without decoding.
+    """
+
+    def __init__(self, container: str, sample_rate: int, channels: int, frames: int, data_offset: int,
+                 sample_width: int, byte_order: str, kind: str):
+        # "WAV", "RF64" or "AIFF"
+        self.container = container
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = frames
+        self.data_offset = data_offset
+        self.sample_width = sample_width
+        # "<" or ">"
+        self.byte_order = byte_order
+        # "int", "uint" (8-bit WAV) or "float"
+        self.kind = kind
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.channels * self.sample_width
+
+    @property
+    def subtype(self) -> str:
+        """libsndfile WAV subtype that stores these samples without loss"""
+        if self.kind == "float":
+            return "FLOAT" if self.sample_width == 4 else "DOUBLE"
+        if self.sample_width == 1:
+            # WAV's only 8-bit format; signed AIFF samples are offset into it exactly
+            return "PCM_U8"
+        return f"PCM_{self.sample_width * 8}"
+
+    def decode(self, records: np.ndarray) -> np.ndarray:
+        """(frames, channels) samples of (frames, frame_bytes) uint8 records, in a dtype libsndfile writes
+
+        8-bit samples become int16 and 24-bit ones int32, scaled to full range.
+        """
+        frames = len(records)
+        if self.sample_width == 3:
+            # Place the three bytes in the top of a little-endian int32
+            samples = np.zeros((frames, self.channels, 4), dtype=np.uint8)
+            packed = records.reshape(frames, self.channels, 3)
+            samples[:, :, 1:] = packed if self.byte_order == "<" else packed[:, :, ::-1]
+            return samples.view("<i4").reshape(frames, self.channels)
+        code = {"int": "i", "uint": "u", "float": "f"}[self.kind]
+        samples = np.ascontiguousarray(records).view(f"{self.byte_order}{code}{self.sample_width}")
+        if self.sample_width == 1:
+            offset = 128 if self.kind == "uint" else 0
+            return (samples.astype(np.int16) - offset) << 8
+        return samples.astype(samples.dtype.newbyteorder("="), copy=False)
+
+    def encode(self, samples: np.ndarray) -> bytes:
+        """Inverse of decode(): the records of (frames, channels) samples"""
+        if self.sample_width == 3:
+            packed = samples.astype("<i4").view(np.uint8).reshape(len(samples), self.channels, 4)[:, :, 1:]
+            return (packed if self.byte_order == "<" else packed[:, :, ::-1]).tobytes()
+        if self.sample_width == 1:
+            return ((samples >> 8) + (128 if self.kind == "uint" else 0)).astype(
+                np.uint8 if self.kind == "uint" else np.int8).tobytes()
+        code = {"int": "i", "float": "f"}[self.kind]
+        return samples.astype(f"{self.byte_order}{code}{self.sample_width}").tobytes()
+
+    def apply_gain(self, samples: np.ndarray, gains: np.ndarray) -> np.ndarray:
+        """decode() output times per-frame gains, rounded to the stored sample resolution"""
+        if samples.dtype.kind == "f":
+            return (samples * gains[:, None]).astype(samples.dtype)
+        # 8- and 24-bit samples sit in the top bits of their wider dtype
+        step = 256 if self.sample_width in (1, 3) else 1
+        return (np.rint(samples // step * gains[:, None]).astype(np.int64) * step).astype(samples.dtype)
+
+    def to_float(self, samples: np.ndarray) -> np.ndarray:
+        """decode() output as float32 in [-1, 1)"""
+        if samples.dtype.kind == "f":
+            return samples.astype(np.float32, copy=False)
+        return samples.astype(np.float32) * np.float32(1.0 / -np.iinfo(samples.dtype).min)
+
+
+# WAVE_FORMAT_PCM and WAVE_FORMAT_IEEE_FLOAT, directly or as the WAVE_FORMAT_EXTENSIBLE subformat
+_WAV_FORMATS = {1: "int", 3: "float"}
+# AIFF-C compression types stored as plain samples
+_AIFC_FORMATS = {b"NONE": (">", "int"), b"twos": (">", "int"), b"sowt": ("<", "int"),
+                 b"fl32": (">", "float"), b"FL32": (">", "float"),
+                 b"fl64": (">", "float"), b"FL64": (">", "float")}
+
+
+def pcm_layout(path: str) -> Optional[PcmLayout]:
+    """Sample layout of an uncompressed WAV, RF64 or AIFF file, or None for anything else
+
+    Reads chunk headers only. The frame count is clamped to what the file
+    actually holds, so truncated recordings map safely.
+    """
+    try:
+        with open(path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            magic = f.read(12)
+            if magic[:4] in (b"RIFF", b"RF64") and magic[8:12] == b"WAVE":
+                layout = _wav_layout(f, magic[:4] == b"RF64")
+            elif magic[:4] == b"FORM" and magic[8:12] in (b"AIFF", b"AIFC"):
+                layout = _aiff_layout(f, magic[8:12] == b"AIFC")
+            else:
+                return None
+    except (OSError, struct.error, KeyError, ValueError):
+        return None
+    if layout is None or layout.frame_bytes <= 0 or layout.sample_width not in (1, 2, 3, 4, 8):
+        return None
+    layout.frames = max(0, min(layout.frames, (file_size - layout.data_offset) // layout.frame_bytes))
+    return layout
+
+
+def _chunks(f, byte_order: str):
+    """(id, size, data offset) of each chunk after the 12-byte container header"""
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        chunk_id, size = header[:4], struct.unpack(f"{byte_order}I", header[4:])[0]
+        offset = f.tell()
+        yield chunk_id, size, offset
+        f.seek(offset + size + (size & 1))
+
+
+def _wav_layout(f, rf64: bool) -> Optional[PcmLayout]:
+    fmt = None
+    data_size = None
+    for chunk_id, size, offset in _chunks(f, "<"):
+        if chunk_id == b"ds64":
+            data_size = struct.unpack("<Q", f.read(16)[8:16])[0]
+        elif chunk_id == b"fmt ":
+            fmt = f.read(min(size, 40))
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            tag, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+            if tag == 0xFFFE and len(fmt) >= 26:
+                tag = struct.unpack("<H", fmt[24:26])[0]
+            kind = _WAV_FORMATS.get(tag)
+            if kind is None or bits % 8 or block_align != channels * bits // 8:
+                return None
+            if kind == "int" and bits == 8:
+                kind = "uint"
+            if not rf64 or data_size is None:
+                data_size = size
+            return PcmLayout("RF64" if rf64 else "WAV", sample_rate, channels, data_size // block_align, offset,
+                             bits // 8, "<", kind)
+    return None
+
+
+def _aiff_layout(f, aifc: bool) -> Optional[PcmLayout]:
+    comm = None
+    for chunk_id, size, offset in _chunks(f, ">"):
+        if chunk_id == b"COMM":
+            comm = f.read(min(size, 22))
+        elif chunk_id == b"SSND":
+            if comm is None:
+                return None
+            channels, frames, bits = struct.unpack(">hIh", comm[:8])
+            exponent, mantissa = struct.unpack(">HQ", comm[8:18])
+            sample_rate = int(round(math.ldexp(mantissa, (exponent & 0x7FFF) - 16383 - 63)))
+            byte_order, kind = _AIFC_FORMATS[comm[18:22]] if aifc else (">", "int")
+            data_offset = struct.unpack(">I", f.read(4))[0]
+            return PcmLayout("AIFF", sample_rate, channels, frames, offset + 8 + data_offset, (bits + 7) // 8,
+                             byte_order, kind)
+    return None
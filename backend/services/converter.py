@@ -1,48 +1,370 @@
-import os
 import asyncio
+import collections
+import os
 import shutil
-from typing import Dict, Any
+import time
+import uuid
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Optional, Union
+
+from .audio_cache import as_file
+from .audio_probe import probe_audio
+from .encoders import OutputFormat, get_output_format
+
+PIPE_CHUNK_BYTES = 64 * 1024
+# Containers whose index may sit at the end of the file; ffmpeg reads these
+# itself, since it cannot seek back in a pipe
+SEEKABLE_INPUTS = (".m4a", ".mp4", ".mov", ".3gp")
+# stderr kept from a failed run for its error message
+STDERR_TAIL_BYTES = 4096
+RECENT_JOBS = 50
+
+Source = Union[str, bytes, BinaryIO]
+
+
+class TranscodeError(RuntimeError):
+    """ffmpeg is missing, failed, or was stopped"""
+
+
+class TranscoderBusy(TranscodeError):
+    """Every transcoder is running and the queue is full"""
+
+
+class TranscodeTimeout(TranscodeError):
+    """A transcode ran past the pool's per-job timeout"""
+
+
+def ffmpeg_arguments(output_format: OutputFormat, bitrate: Optional[int]) -> List[str]:
+    """ffmpeg codec and muxer options that write output_format to stdout"""
+    if output_format.name == "mp3":
+        return ["-c:a", "libmp3lame", "-b:a", f"{bitrate}k", "-f", "mp3"]
+    if output_format.name == "opus":
+        return ["-c:a", "libopus", "-b:a", f"{bitrate}k", "-f", "ogg"]
+    if output_format.name == "flac":
+        return ["-c:a", "flac", "-f", "flac"]
+    # WAV on a pipe keeps open-ended sizes; readers play it to the end of the stream
+    return ["-c:a", "pcm_s24le", "-f", "wav"]
+
+
+class TranscodeJob:
+    """One ffmpeg run: what it encodes and, once done, how long it waited and how fast it went"""
+
+    def __init__(self, source: Source, output_format: OutputFormat, bitrate: Optional[int],
+                 duration: Optional[float] = None, filename: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.output_format = output_format
+        self.bitrate = bitrate
+        # Seconds of audio, when known up front; speed needs it
+        self.duration = duration
+        self.filename = filename or (source if isinstance(source, str) else "")
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.output_bytes = 0
+        self.queued_seconds = 0.0
+        self.encode_seconds = 0.0
+
+    @property
+    def piped(self) -> bool:
+        """Whether the input goes to ffmpeg over stdin rather than as a path it opens"""
+        return not (isinstance(self.source, str)
+                    and os.path.splitext(self.source)[1].lower() in SEEKABLE_INPUTS)
+
+    @property
+    def speed(self) -> Optional[float]:
+        """Seconds of audio encoded per second of wall time"""
+        if not self.duration or not self.encode_seconds:
+            return None
+        return round(self.duration / self.encode_seconds, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "output_format": self.output_format.name,
+            "bitrate": self.bitrate,
+            "duration": self.duration,
+            "output_bytes": self.output_bytes,
+            "queued_ms": round(self.queued_seconds * 1000, 1),
+            "encode_ms": round(self.encode_seconds * 1000, 1),
+            "realtime_factor": self.speed,
+            "error": self.error,
+        }
+
+
+class TranscoderPool:
+    """A bounded pool of ffmpeg processes streaming stdin to stdout
+
+    At most max_workers ffmpeg processes run at once (one per CPU unless
+    ODOREMOVER_TRANSCODERS says otherwise), each single-threaded; further
+    jobs wait in FIFO order, and past max_queue waiting jobs a new one is
+    refused with TranscoderBusy rather than queued without bound. Input is
+    written to ffmpeg's stdin while its stdout is read, so encoded bytes
+    reach the caller as ffmpeg produces them and nothing is spooled to
+    disk; a slow reader stalls ffmpeg through the pipe instead of buffering.
+    A job running past timeout seconds, or abandoned by its reader, has its
+    process killed.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: Optional[int] = None,
+                 timeout: Optional[float] = None, binary: Optional[str] = None):
+        self.max_workers = max_workers or int(os.environ.get("ODOREMOVER_TRANSCODERS", 0)) or os.cpu_count() or 1
+        self.max_queue = max_queue if max_queue is not None else int(
+            os.environ.get("ODOREMOVER_TRANSCODE_QUEUE", 4 * self.max_workers))
+        self.timeout = timeout or float(os.environ.get("ODOREMOVER_TRANSCODE_TIMEOUT", 600))
+        self.binary = binary or os.environ.get("ODOREMOVER_FFMPEG", "ffmpeg")
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._running = 0
+        self._waiting = 0
+        self._counts = collections.Counter()
+        self._audio_seconds = 0.0
+        self._encode_seconds = 0.0
+        self._recent = collections.deque(maxlen=RECENT_JOBS)
+
+    @property
+    def available(self) -> bool:
+        return shutil.which(self.binary) is not None
+
+    def job(self, source: Source, output_format: str, bitrate: Optional[int] = None,
+            duration: Optional[float] = None, filename: Optional[str] = None) -> TranscodeJob:
+        """A job encoding source (a path, bytes or a binary file object); raises ValueError for bad options"""
+        fmt = get_output_format(output_format)
+        return TranscodeJob(source, fmt, fmt.resolve_bitrate(bitrate), duration, filename)
+
+    async def stream(self, job: TranscodeJob) -> AsyncIterator[bytes]:
+        """Run job once a transcoder is free, yielding ffmpeg's output as it arrives
+
+        Raises TranscoderBusy without waiting when the queue is full,
+        TranscodeTimeout past the pool's timeout, and TranscodeError when
+        ffmpeg is missing or exits with an error.
+        """
+        if not self.available:
+            raise TranscodeError(f"{self.binary} is not installed")
+        if self._waiting >= self.max_queue and self._slots.locked():
+            self._finish(job, "rejected", "transcoder queue is full")
+            raise TranscoderBusy(f"All {self.max_workers} transcoders are busy and {self._waiting} jobs are waiting")
+
+        queued = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        job.queued_seconds = time.perf_counter() - queued
+
+        self._running += 1
+        job.status = "running"
+        process = feeder = None
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        deadline = loop.time() + self.timeout
+
+        def remaining() -> float:
+            left = deadline - loop.time()
+            if left <= 0:
+                raise TimeoutError
+            return left
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.binary, "-hide_banner", "-nostats", "-loglevel", "error", *([] if job.piped else ["-nostdin"]),
+                "-threads", "1", "-i", "pipe:0" if job.piped else job.source, "-vn", "-map_metadata", "0",
+                *ffmpeg_arguments(job.output_format, job.bitrate), "pipe:1",
+                stdin=asyncio.subprocess.PIPE if job.piped else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            if job.piped:
+                feeder = asyncio.create_task(self._feed(process.stdin, job.source))
+            errors = asyncio.create_task(self._tail(process.stderr))
+            # Deadlines per read rather than an asyncio.timeout() block, which
+            # must not span a yield: the reader runs in between
+            while True:
+                chunk = await asyncio.wait_for(process.stdout.read(PIPE_CHUNK_BYTES), remaining())
+                if not chunk:
+                    break
+                job.output_bytes += len(chunk)
+                yield chunk
+            if feeder is not None:
+                await asyncio.wait_for(feeder, remaining())
+            returncode = await asyncio.wait_for(process.wait(), remaining())
+            stderr = (await errors).decode("utf-8", "replace").strip()
+            if returncode != 0:
+                raise TranscodeError(stderr.splitlines()[-1] if stderr else f"ffmpeg exited with {returncode}")
+            job.encode_seconds = time.perf_counter() - started
+            self._finish(job, "completed")
+        except TimeoutError:
+            job.encode_seconds = time.perf_counter() - started
+            self._finish(job, "timed_out", f"timed out after {self.timeout:g}s")
+            raise TranscodeTimeout(f"Transcode timed out after {self.timeout:g}s")
+        except TranscodeError as e:
+            job.encode_seconds = time.perf_counter() - started
+            self._finish(job, "failed", str(e))
+            raise
+        except BaseException:
+            # The reader went away (cancelled, or the generator was closed)
+            job.encode_seconds = time.perf_counter() - started
+            self._finish(job, "cancelled")
+            raise
+        finally:
+            # Kill before any await: a cancelled task may not get to run another
+            if process is not None and process.returncode is None:
+                process.kill()
+            if feeder is not None:
+                feeder.cancel()
+            self._running -= 1
+            self._slots.release()
+            if process is not None:
+                # Output the reader left behind keeps stdout paused, and wait()
+                # only returns once every pipe is closed; drain it to EOF first
+                if not process.stdout.at_eof():
+                    await process.stdout.read()
+                await process.wait()
+
+    async def _feed(self, stdin: asyncio.StreamWriter, source: Source):
+        """Write source to ffmpeg's stdin and close it; ffmpeg exiting early just ends the feed"""
+        try:
+            if isinstance(source, bytes):
+                stdin.write(source)
+                await stdin.drain()
+            else:
+                handle = open(source, "rb") if isinstance(source, str) else source
+                try:
+                    while True:
+                        chunk = await asyncio.to_thread(handle.read, PIPE_CHUNK_BYTES * 16)
+                        if not chunk:
+                            break
+                        stdin.write(chunk)
+                        await stdin.drain()
+                finally:
+                    if handle is not source:
+                        handle.close()
+            stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg stopped reading; its exit status says why
+            pass
+
+    @staticmethod
+    async def _tail(stderr: asyncio.StreamReader) -> bytes:
+        """Drain stderr so ffmpeg never blocks on it, keeping the last few KB"""
+        tail = b""
+        while True:
+            chunk = await stderr.read(PIPE_CHUNK_BYTES)
+            if not chunk:
+                return tail
+            tail = (tail + chunk)[-STDERR_TAIL_BYTES:]
+
+    def _finish(self, job: TranscodeJob, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        self._counts[status] += 1
+        if status == "completed" and job.duration:
+            self._audio_seconds += job.duration
+            self._encode_seconds += job.encode_seconds
+        self._recent.append(job)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool size, queue depth, outcome counts and encode speed relative to real time"""
+        return {
+            "available": self.available,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "timeout": self.timeout,
+            "running": self._running,
+            "queued": self._waiting,
+            **{status: self._counts[status]
+               for status in ("completed", "failed", "timed_out", "cancelled", "rejected")},
+            "audio_seconds": round(self._audio_seconds, 1),
+            "realtime_factor": round(self._audio_seconds / self._encode_seconds, 1) if self._encode_seconds else None,
+            "recent": [job.to_dict() for job in reversed(self._recent)],
+        }
+
 
 class ConverterService:
-    """Audio format conversion using PyDub"""
-    
+    """Audio format conversion through a TranscoderPool of ffmpeg processes
+
+    job() describes a conversion, with the input's duration probed from its
+    headers for the pool's speed figures; stream() yields its encoded bytes
+    as ffmpeg produces them and process() writes them to a file.
+    """
+
+    def __init__(self, pool: Optional[TranscoderPool] = None):
+        self.pool = pool or TranscoderPool()
+
+    @property
+    def available(self) -> bool:
+        return self.pool.available
+
+    async def job(self, source: Union[str, bytes], output_format: str, bitrate: Optional[int] = None,
+                  filename: Optional[str] = None) -> TranscodeJob:
+        """A job converting source (a path or upload bytes); raises ValueError for bad options"""
+        duration = await asyncio.to_thread(_duration, source, filename)
+        return self.pool.job(source, output_format, bitrate, duration, filename)
+
+    def stream(self, job: TranscodeJob) -> AsyncIterator[bytes]:
+        """Run job on the pool, yielding its output (see TranscoderPool.stream)"""
+        return self.pool.stream(job)
+
     async def process(self, input_path: str, output_path: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
         try:
             output_format = parameters.get("output_format", ".mp3").lstrip(".")
             bitrate = parameters.get("bitrate", 128)
-            
-            # Simulate processing time
-            await asyncio.sleep(1.0)
-            
-            # In production, you would use PyDub for actual format conversion
-            # For now, copy the input file as a placeholder
-            shutil.copy2(input_path, output_path)
-            
+
+            started = time.perf_counter()
+            job = await self.job(input_path, output_format, bitrate)
+            with open(output_path, "wb") as output:
+                async for chunk in self.stream(job):
+                    output.write(chunk)
+            if job.output_format.name == "wav":
+                _seal_wav(output_path)
+            elapsed = time.perf_counter() - started
+
             return {
                 "success": True,
                 "output_path": output_path,
                 "metadata": {
+                    **job.to_dict(),
                     "output_format": output_format,
-                    "bitrate": f"{bitrate}kbps",
-                    "processing_time": "1.0s"
+                    "bitrate": f"{job.bitrate}kbps" if job.bitrate else None,
+                    "processing_time": f"{elapsed:.1f}s",
                 }
             }
-            
+
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Format conversion failed: {str(e)}"
             }
-    
-    def _convert_format(self, input_path: str, output_path: str, output_format: str, bitrate: int) -> bool:
-        """Convert audio format using PyDub (placeholder)"""
-        try:
-            # This would be the actual PyDub implementation
-            # from pydub import AudioSegment
-            # 
-            # audio = AudioSegment.from_file(input_path)
-            # audio.export(output_path, format=output_format, bitrate=f"{bitrate}k")
-            
-            return True
-        except Exception:
-            return False
+
+
+def _duration(source: Union[str, bytes], filename: Optional[str] = None) -> Optional[float]:
+    """Seconds of audio in source from its headers, or None when they do not say"""
+    try:
+        return probe_audio(as_file(source), filename)["duration"]
+    except ValueError:
+        return None
+
+
+def _seal_wav(path: str):
+    """Fill in the RIFF and data sizes ffmpeg leaves open when it writes WAV to a pipe"""
+    size = os.path.getsize(path)
+    if size - 8 > 0xFFFFFFFF:
+        return
+    with open(path, "r+b") as f:
+        riff = f.read(12)
+        if riff[:4] != b"RIFF" or riff[8:] != b"WAVE":
+            return
+        # Walk the chunks up to data: tag chunks (LIST/INFO) come first and
+        # their text may well contain the bytes "data"
+        position = 12
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return
+            if header[:4] == b"data":
+                break
+            length = int.from_bytes(header[4:], "little")
+            position += 8 + length + (length & 1)
+            f.seek(position)
+        f.seek(4)
+        f.write((size - 8).to_bytes(4, "little"))
+        f.seek(position + 4)
+        f.write((size - position - 8).to_bytes(4, "little"))
@@ -0,0 +1,237 @@
+import io
+import os
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+import soundfile as sf
+
+# Frames read from the master and encoded per step
+BLOCK_FRAMES = 1 << 16
+
+
+class OutputFormat:
+    """A deliverable audio format and how to drive libsndfile for it"""
+
+    def __init__(self, name: str, container: str, subtype: str, extension: str, media_type: str,
+                 sample_rates: Optional[Tuple[int, ...]] = None, default_bitrate: Optional[int] = None,
+                 bitrate_range: Optional[Tuple[int, int]] = None, streamable: bool = True):
+        self.name = name
+        self.container = container
+        self.subtype = subtype
+        self.extension = extension
+        self.media_type = media_type
+        # Rates the codec accepts; None means any
+        self.sample_rates = sample_rates
+        # kbps for lossy formats; None for lossless ones
+        self.default_bitrate = default_bitrate
+        self.bitrate_range = bitrate_range
+        # Whether encode_stream output is playable; WAV needs its final sizes up front
+        self.streamable = streamable
+
+    @property
+    def lossy(self) -> bool:
+        return self.default_bitrate is not None
+
+    def resolve_bitrate(self, bitrate: Optional[int]) -> Optional[int]:
+        """The bitrate to encode at, raising ValueError when it is out of range"""
+        if not self.lossy:
+            return None
+        if bitrate is None:
+            return self.default_bitrate
+        low, high = self.bitrate_range
+        if not low <= bitrate <= high:
+            raise ValueError(f"{self.name} bitrate must be between {low} and {high} kbps")
+        return int(bitrate)
+
+    def target_rate(self, sample_rate: int) -> int:
+        """Closest rate the codec accepts, preferring not to downsample"""
+        if self.sample_rates is None or sample_rate in self.sample_rates:
+            return sample_rate
+        higher = [rate for rate in self.sample_rates if rate > sample_rate]
+        return min(higher) if higher else max(self.sample_rates)
+
+    def sound_file_args(self, bitrate: Optional[int], channels: int) -> dict:
+        args = {"format": self.container, "subtype": self.subtype}
+        if self.subtype == "OPUS":
+            # libsndfile gives Opus about 6 + 250 * (1 - level) kbps per channel
+            per_channel = bitrate / channels
+            args["compression_level"] = float(np.clip(1 - (per_channel - 6) / 250, 0.0, 1.0))
+        elif self.subtype == "MPEG_LAYER_III":
+            # and constant-bitrate MP3 about 320 - 288 * level kbps (level 1.0 is rejected)
+            args["compression_level"] = float(np.clip((320 - bitrate) / 288, 0.0, 0.99))
+            args["bitrate_mode"] = "CONSTANT"
+        return args
+
+
+OUTPUT_FORMATS: Dict[str, OutputFormat] = {
+    fmt.name: fmt for fmt in (
+        OutputFormat("wav", "WAV", "PCM_24", "wav", "audio/wav", streamable=False),
+        OutputFormat("flac", "FLAC", "PCM_24", "flac", "audio/flac"),
+        OutputFormat("opus", "OGG", "OPUS", "opus", "audio/ogg",
+                     sample_rates=(48000, 24000, 16000, 12000, 8000),
+                     default_bitrate=128, bitrate_range=(16, 510)),
+        OutputFormat("mp3", "MP3", "MPEG_LAYER_III", "mp3", "audio/mpeg",
+                     sample_rates=(48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000),
+                     default_bitrate=192, bitrate_range=(32, 320)),
+    )
+}
+
+
+def get_output_format(name: str) -> OutputFormat:
+    """Look up an output format by name, raising ValueError for unknown ones"""
+    try:
+        return OUTPUT_FORMATS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unsupported output format: {name} (choose from {', '.join(OUTPUT_FORMATS)})")
+
+
+def format_for_path(path: str, default: str = "wav") -> str:
+    """Output format named by a path's extension, or default when it names none"""
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    return extension if extension in OUTPUT_FORMATS else default
+
+
+def read_blocks(input_path: str, block_frames: int = BLOCK_FRAMES, start: int = 0,
+                frames: Optional[int] = None) -> Tuple[int, int, Iterator[np.ndarray]]:
+    """Sample rate, channel count and a generator of (channels, frames) float32 blocks
+
+    Reads frames frames (all when None) from frame start on, seeking rather
+    than decoding up to it. Raises ValueError for files libsndfile cannot
+    stream; callers fall back to decoding those whole.
+    """
+    try:
+        audio_file = sf.SoundFile(input_path)
+    except sf.LibsndfileError as e:
+        raise ValueError(f"Cannot stream {os.path.basename(input_path)}: {e}")
+    if start:
+        audio_file.seek(start)
+    remaining = frames if frames is not None else -1
+
+    def blocks():
+        nonlocal remaining
+        with audio_file:
+            while remaining:
+                count = block_frames if remaining < 0 else min(block_frames, remaining)
+                block = audio_file.read(count, dtype="float32", always_2d=True)
+                if not len(block):
+                    return
+                if remaining > 0:
+                    remaining -= len(block)
+                yield np.ascontiguousarray(block.T)
+
+    return audio_file.samplerate, audio_file.channels, blocks()
+
+
+class _StreamSink:
+    """Forward-only file object that hands out encoded bytes as soon as they are written
+
+    At close libsndfile seeks back to finalise the FLAC STREAMINFO block and
+    the MP3 Xing frame. Those bytes have already been sent, so the rewrites
+    are dropped; the placeholder headers it wrote first are valid (sizes
+    marked unknown), which is what streamed FLAC and MP3 look like anyway.
+    """
+
+    def __init__(self):
+        self._pending = bytearray()
+        self._sent = 0
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        written = len(data)
+        start = self._position - self._sent
+        if start < 0:
+            # Rewrite of bytes already sent; keep whatever lies past them
+            data = data[-start:]
+            start = 0
+        if start > len(self._pending):
+            self._pending.extend(b"\0" * (start - len(self._pending)))
+        self._pending[start:start + len(data)] = data
+        self._position = self._sent + start + len(data)
+        return written
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        end = self._sent + len(self._pending)
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: end}[whence]
+        self._position = base + offset
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        return b""
+
+    def drain(self) -> bytes:
+        data = bytes(self._pending)
+        self._sent += len(data)
+        self._pending.clear()
+        return data
+
+
+class BlockEncoder:
+    """Encodes float audio handed over block by block, resampling to a rate the codec accepts
+
+    Blocks are (frames, channels) and may exceed full scale; they are
+    clipped, since integer and lossy codecs would wrap.
+    """
+
+    def __init__(self, target: Union[str, _StreamSink], output_format: OutputFormat, bitrate: Optional[int],
+                 samplerate: int, channels: int):
+        rate = output_format.target_rate(samplerate)
+        self._resampler = None
+        if rate != samplerate:
+            import soxr
+            self._resampler = soxr.ResampleStream(samplerate, rate, channels, dtype="float32")
+        args = output_format.sound_file_args(bitrate, channels)
+        self._file = sf.SoundFile(target, "w", samplerate=rate, channels=channels, **args)
+
+    def write(self, block: np.ndarray, last: bool = False):
+        block = np.asarray(block, dtype=np.float32)
+        if self._resampler is not None:
+            block = self._resampler.resample_chunk(block, last=last)
+        if len(block):
+            self._file.write(np.clip(block, -1.0, 1.0))
+
+    def close(self):
+        if self._resampler is not None:
+            self.write(np.zeros((0, self._file.channels), dtype=np.float32), last=True)
+            self._resampler = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _encode_blocks(master_path: str, target: Union[str, _StreamSink], output_format: OutputFormat,
+                   bitrate: Optional[int]) -> Iterator[None]:
+    """Encode master_path into target one block at a time, yielding after each block"""
+    with sf.SoundFile(master_path) as master:
+        with BlockEncoder(target, output_format, bitrate, master.samplerate, master.channels) as encoder:
+            while True:
+                block = master.read(BLOCK_FRAMES, dtype="float32", always_2d=True)
+                encoder.write(block)
+                yield
+                if len(block) < BLOCK_FRAMES:
+                    break
+    yield
+
+
+def encode_file(master_path: str, output_path: str, output_format: OutputFormat,
+                bitrate: Optional[int] = None):
+    """Encode a float master into output_path, block by block at constant memory"""
+    for _ in _encode_blocks(master_path, output_path, output_format, output_format.resolve_bitrate(bitrate)):
+        pass
+
+
+def encode_stream(master_path: str, output_format: OutputFormat,
+                  bitrate: Optional[int] = None) -> Iterator[bytes]:
+    """Encode a float master block by block, yielding encoded bytes as they are produced"""
+    sink = _StreamSink()
+    for _ in _encode_blocks(master_path, sink, output_format, output_format.resolve_bitrate(bitrate)):
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
@@ -0,0 +1,229 @@
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import minimum_filter1d
+from scipy.signal import firwin, sosfilt
+
+# ITU-R BS.1770-4 gating
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+# Block loudness histogram resolution; the relative gate is placed to within one bin
+HISTOGRAM_STEP_LU = 0.01
+HISTOGRAM_MAX_LUFS = 10.0
+
+
+def k_weighting_sos(sample_rate: int) -> np.ndarray:
+    """The BS.1770 K-weighting pre-filter and RLB high-pass as second-order sections
+
+    Coefficients are derived for any rate as in libebur128; at 48 kHz they
+    match the tables in the recommendation.
+    """
+    # High shelf
+    k = math.tan(math.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    # High pass
+    k = math.tan(math.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    high_pass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, high_pass])
+
+
+def channel_weights(channels: int) -> np.ndarray:
+    """BS.1770 channel weights, assuming the usual 5.0/5.1 channel order (LFE excluded)"""
+    if channels == 6:
+        return np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+    if channels == 5:
+        return np.array([1.0, 1.0, 1.0, 1.41, 1.41])
+    return np.ones(channels)
+
+
+def oversampling_factor(sample_rate: int) -> int:
+    """True-peak oversampling per BS.1770-4 Annex 2: 4x below 96 kHz, 2x below 192 kHz"""
+    return 4 if sample_rate < 96000 else 2 if sample_rate < 192000 else 1
+
+
+def interpolation_phases(factor: int, taps: int = 12) -> np.ndarray:
+    """(factor, taps) polyphase interpolator, 12 taps per phase as in the Annex 2 example filter
+
+    Row r, time-reversed, gives the r-th interpolated point from the last
+    taps input samples, so a whole block interpolates as one matrix product.
+    """
+    prototype = firwin(taps * factor, 1 / factor) * factor
+    return np.stack([prototype[phase::factor][::-1] for phase in range(factor)]).astype(np.float32)
+
+
+class LoudnessMeter:
+    """Streaming integrated loudness (LUFS) and true peak (dBTP) per ITU-R BS.1770-4
+
+    Feed (channels, frames) float blocks of any size to add(). Filter state
+    carries across blocks, so results do not depend on the block size.
+    Gating blocks (400 ms, 75% overlap) are built from 100 ms mean squares
+    and kept only as a fixed-size loudness histogram, so memory is constant
+    however long the input is.
+    """
+
+    def __init__(self, sample_rate: int, channels: int, true_peak: bool = True):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._sos = k_weighting_sos(sample_rate)
+        self._zi = np.zeros((self._sos.shape[0], channels, 2))
+        self._weights = channel_weights(channels)
+        self._step = int(round(sample_rate * 0.1))
+        # Filtered samples not yet making up a whole 100 ms step
+        self._partial = np.zeros((channels, 0))
+        # Weighted mean squares of the last three steps, to form 400 ms blocks
+        self._recent = []
+        bins = int((HISTOGRAM_MAX_LUFS - ABSOLUTE_GATE_LUFS) / HISTOGRAM_STEP_LU) + 1
+        self._counts = np.zeros(bins, dtype=np.int64)
+        self._energies = np.zeros(bins)
+        self.frames = 0
+
+        self.true_peak = true_peak
+        factor = oversampling_factor(sample_rate)
+        self._phases = interpolation_phases(factor) if factor > 1 else None
+        self._peak = 0.0
+        # Input samples before the current block that the interpolator still needs
+        taps = self._phases.shape[1] if self._phases is not None else 1
+        self._peak_history = np.zeros((channels, taps - 1), dtype=np.float32)
+
+    def add(self, block: np.ndarray):
+        self.frames += block.shape[1]
+        if self.true_peak:
+            self._track_peak(block)
+        filtered, self._zi = sosfilt(self._sos, block, axis=-1, zi=self._zi)
+        pending = np.concatenate([self._partial, filtered], axis=1)
+        whole = pending.shape[1] // self._step * self._step
+        self._partial = pending[:, whole:]
+        if not whole:
+            return
+        steps = pending[:, :whole].reshape(self.channels, -1, self._step)
+        energies = np.concatenate([self._recent, self._weights @ np.mean(steps ** 2, axis=-1)])
+        if len(energies) >= 4:
+            # Mean of each run of four consecutive steps
+            sums = np.convolve(energies, np.ones(4), mode="valid") / 4
+            self._record_blocks(sums)
+        self._recent = energies[-3:].tolist()
+
+    def _record_blocks(self, energies: np.ndarray):
+        with np.errstate(divide="ignore"):
+            loudness = -0.691 + 10 * np.log10(energies)
+        kept = loudness >= ABSOLUTE_GATE_LUFS
+        bins = np.minimum(((loudness[kept] - ABSOLUTE_GATE_LUFS) / HISTOGRAM_STEP_LU).astype(np.int64),
+                          len(self._counts) - 1)
+        np.add.at(self._counts, bins, 1)
+        np.add.at(self._energies, bins, energies[kept])
+
+    def _track_peak(self, block: np.ndarray):
+        """Max of the block interpolated by the oversampling factor, continuous across blocks"""
+        chunk = np.concatenate([self._peak_history, block.astype(np.float32, copy=False)], axis=1)
+        if self._phases is not None:
+            # One row per input sample of the block: every interpolated point between it and
+            # the sample before, computed from real samples only
+            windows = sliding_window_view(chunk, self._phases.shape[1], axis=-1)
+            interpolated = windows @ self._phases.T
+        else:
+            interpolated = chunk
+        if interpolated.size:
+            self._peak = max(self._peak, float(np.max(np.abs(interpolated))))
+        self._peak_history = chunk[:, chunk.shape[1] - self._peak_history.shape[1]:]
+
+    def integrated_loudness(self) -> float:
+        """Gated integrated loudness in LUFS; -inf for silence"""
+        counts = self._counts
+        total = counts.sum()
+        if not total:
+            return float("-inf")
+        ungated = self._energies.sum() / total
+        threshold = -0.691 + 10 * math.log10(ungated) + RELATIVE_GATE_LU
+        first = max(0, int(math.ceil((threshold - ABSOLUTE_GATE_LUFS) / HISTOGRAM_STEP_LU)))
+        gated = counts[first:].sum()
+        if not gated:
+            return float("-inf")
+        return -0.691 + 10 * math.log10(self._energies[first:].sum() / gated)
+
+    def true_peak_db(self) -> float:
+        """Highest true peak in dBTP (sample peak when true_peak is off), once all blocks are added"""
+        if self.true_peak:
+            # The points after the last sample are interpolated towards silence
+            self._track_peak(np.zeros_like(self._peak_history))
+        return 20 * math.log10(self._peak) if self._peak > 0 else float("-inf")
+
+
+class LookaheadLimiter:
+    """Brick-wall true-peak limiter with look-ahead, vectorised per block
+
+    Each sample's level is the larger of its own magnitude and the
+    interpolated points next to it (as LoudnessMeter measures true peak),
+    unless true_peak is off. The gain at each sample is the smallest gain any sample in the last
+    release window needs (a sliding minimum), averaged over the look-ahead
+    window ahead of it. Averaging a trailing minimum at least as long as the
+    average guarantees every sample ends up at or below the ceiling, while
+    the gain ramps down over the look-ahead time before a peak and back up
+    over it after the hold. Output is delayed internally by the look-ahead
+    and realigned, so process() plus flush() returns exactly as many frames
+    as went in.
+    """
+
+    def __init__(self, ceiling: float, sample_rate: int, channels: int,
+                 lookahead_ms: float = 5.0, release_ms: float = 50.0, true_peak: bool = True):
+        self.ceiling = ceiling
+        factor = oversampling_factor(sample_rate)
+        self._phases = interpolation_phases(factor) if true_peak and factor > 1 else None
+        self._lookahead = max(1, int(sample_rate * lookahead_ms / 1000))
+        self._window = self._lookahead + max(1, int(sample_rate * release_ms / 1000))
+        # Input needed before the first frame of a block to compute its gain
+        self._history = np.zeros((channels, self._window), dtype=np.float32)
+        self.engaged_frames = 0
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        chunk = np.concatenate([self._history, block.astype(np.float32, copy=False)], axis=1)
+        output = self._limit(chunk)
+        self._history = chunk[:, -(self._window + self._lookahead):]
+        return output
+
+    def flush(self) -> np.ndarray:
+        # Trailing silence never needs gain reduction; it only releases the held-back frames
+        return self._limit(np.concatenate(
+            [self._history, np.zeros((self._history.shape[0], self._lookahead), dtype=np.float32)], axis=1))
+
+    def _limit(self, chunk: np.ndarray) -> np.ndarray:
+        """Limited chunk[:, window:-lookahead]; everything else in chunk is context"""
+        start, end = self._window, chunk.shape[1] - self._lookahead
+        if end <= start:
+            return chunk[:, :0]
+        peaks = self._levels(chunk)
+        with np.errstate(divide="ignore"):
+            required = np.minimum(1.0, self.ceiling / peaks)
+        if required.min() >= 1.0:
+            return chunk[:, start:end]
+        # Minimum over the trailing window [n - window + 1, n]
+        held = minimum_filter1d(required, self._window, origin=(self._window - 1) // 2)
+        # Mean over the look-ahead window [n, n + lookahead)
+        sums = np.concatenate([[0.0], np.cumsum(held, dtype=np.float64)])
+        gain = (sums[start + self._lookahead:end + self._lookahead] - sums[start:end]) / self._lookahead
+        self.engaged_frames += int(np.count_nonzero(gain < 1.0))
+        return chunk[:, start:end] * gain.astype(np.float32)
+
+    def _levels(self, chunk: np.ndarray) -> np.ndarray:
+        """Per-frame peak over channels, including the interpolated points either side"""
+        peaks = np.max(np.abs(chunk), axis=0)
+        if self._phases is None:
+            return peaks
+        taps = self._phases.shape[1]
+        interpolated = np.abs(sliding_window_view(chunk, taps, axis=-1) @ self._phases.T)
+        # Phases first: that axis is contiguous, which makes the reduction several times faster
+        interpolated = interpolated.max(axis=2).max(axis=0)
+        # The row for the window ending at frame s interpolates between frames
+        # s - taps // 2 and s - taps // 2 + 1; both are charged with it
+        first = taps - 1 - taps // 2
+        np.maximum(peaks[first:first + len(interpolated)], interpolated, out=peaks[first:first + len(interpolated)])
+        np.maximum(peaks[first + 1:first + 1 + len(interpolated)], interpolated[:len(peaks) - first - 1],
+                   out=peaks[first + 1:first + 1 + len(interpolated)])
+        return peaks
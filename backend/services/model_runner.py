@@ -0,0 +1,388 @@
+import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from scipy.ndimage import uniform_filter1d
+from scipy.signal import istft, stft
+
+# Stems each model size separates into, in the order models return them
+STEMS: Dict[str, Tuple[str, ...]] = {
+    "2stems": ("vocals", "accompaniment"),
+    "4stems": ("vocals", "drums", "bass", "other"),
+}
+
+
+def model_stems(model: str) -> Tuple[str, ...]:
+    """Stem names for a model name such as "2stems", "4stems-16kHz" or "spleeter:2stems" """
+    size = model.split(":")[-1].split("-")[0]
+    try:
+        return STEMS[size]
+    except KeyError:
+        raise ValueError(f"Unknown separation model: {model} (choose from {', '.join(STEMS)})")
+
+
+class SeparationModel:
+    """Interface for source-separation backends run by ModelRunner workers
+
+    load() does the expensive part (weights, graph building) once per
+    worker. separate() takes a batch of segments shaped (batch, channels,
+    frames) at sample_rate and returns (batch, stems, channels, frames).
+    """
+    backend = "base"
+    sample_rate = 44100
+    channels = 2
+    # Length of the fixed segments inputs are cut into, and how much
+    # neighbouring segments overlap to hide their edges
+    segment_seconds = 10.0
+    overlap_seconds = 0.5
+
+    def __init__(self, name: str):
+        self.name = name.split(":")[-1]
+        self.stems = model_stems(name)
+
+    def load(self):
+        pass
+
+    def separate(self, segments: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class SpleeterModel(SeparationModel):
+    """Deezer's Spleeter U-Nets (spleeter:2stems, spleeter:4stems, and their -16kHz variants)
+
+    A batch is handed to TensorFlow as one waveform, segment after segment,
+    so the graph runs once per batch; the overlap between segments keeps
+    the joins out of the audio that is kept.
+    """
+    backend = "spleeter"
+    segment_seconds = 11.0
+
+    def load(self):
+        from spleeter.separator import Separator
+
+        self._separator = Separator(f"spleeter:{self.name}", multiprocess=False)
+        # Spleeter builds its graph and reads the weights on first use
+        self._separator.separate(np.zeros((self.sample_rate, self.channels), dtype=np.float32))
+
+    def separate(self, segments: np.ndarray) -> np.ndarray:
+        batch, channels, frames = segments.shape
+        waveform = segments.transpose(0, 2, 1).reshape(batch * frames, channels)
+        prediction = self._separator.separate(waveform)
+        stems = np.stack([_fit(prediction[stem], batch * frames) for stem in self.stems])
+        return stems.reshape(len(self.stems), batch, frames, channels).transpose(1, 0, 3, 2)
+
+
+class SpectralMaskModel(SeparationModel):
+    """Tiny stand-in model: soft time-frequency masks from fixed band weights
+
+    Vocals are the centre-panned part of the vocal band, bass the rest of
+    the low band and drums the rest of what is more transient than tonal;
+    accompaniment/other take what is left, so the stems always sum back to
+    the mix. Weights come from {name}.npz in ODOREMOVER_MODEL_DIR when it
+    has one, else from built-in band edges. A whole batch is one STFT, one
+    mask computation and one inverse STFT.
+    """
+    backend = "spectral"
+    segment_seconds = 4.0
+    overlap_seconds = 0.25
+    n_fft = 1024
+    hop_length = 256
+
+    def load(self):
+        frequencies = np.fft.rfftfreq(self.n_fft, 1 / self.sample_rate)
+        self.weights = {
+            "vocal_band": _band(frequencies, 150, 8000),
+            "bass_band": _band(frequencies, 0, 250),
+        }
+        path = os.path.join(os.environ.get("ODOREMOVER_MODEL_DIR", "models"), f"{self.name}.npz")
+        if os.path.exists(path):
+            with np.load(path) as stored:
+                self.weights.update({key: stored[key].astype(np.float32) for key in stored.files})
+
+    def separate(self, segments: np.ndarray) -> np.ndarray:
+        frames = segments.shape[-1]
+        _, _, spectrum = stft(segments, nperseg=self.n_fft, noverlap=self.n_fft - self.hop_length, axis=-1)
+        # spectrum: (batch, channels, bins, stft frames)
+
+        def band(name: str) -> np.ndarray:
+            return self.weights[name][:, None]
+
+        mid = np.abs(spectrum.mean(axis=1)) ** 2
+        side = np.abs(spectrum[:, 0] - spectrum[:, -1]) ** 2 / 4
+        vocals = band("vocal_band") * mid / (mid + side + 1e-12)
+        rest = 1 - vocals
+        if len(self.stems) == 2:
+            masks = [vocals, rest]
+        else:
+            magnitude = np.abs(spectrum).mean(axis=1)
+            tonal = uniform_filter1d(magnitude, 17, axis=-1) ** 2
+            transient = uniform_filter1d(magnitude, 17, axis=-2) ** 2
+            bass = rest * band("bass_band")
+            drums = (rest - bass) * transient / (tonal + transient + 1e-12)
+            masks = [vocals, drums, bass, rest - bass - drums]
+        masked = np.stack([spectrum * mask[:, None] for mask in masks], axis=1)
+        _, stems = istft(masked, nperseg=self.n_fft, noverlap=self.n_fft - self.hop_length)
+        return _fit(np.moveaxis(stems, -1, 0), frames).transpose(1, 2, 3, 0).astype(np.float32)
+
+
+MODEL_BACKENDS = {model.backend: model for model in (SpleeterModel, SpectralMaskModel)}
+
+
+def default_backend() -> str:
+    """Backend from ODOREMOVER_SEPARATION_BACKEND; by default Spleeter when it is installed"""
+    configured = os.environ.get("ODOREMOVER_SEPARATION_BACKEND", "auto")
+    if configured != "auto":
+        return configured
+    try:
+        import importlib.util
+        return "spleeter" if importlib.util.find_spec("spleeter") else "spectral"
+    except ValueError:
+        return "spectral"
+
+
+def create_model(name: str, backend: Optional[str] = None) -> SeparationModel:
+    backend = backend or default_backend()
+    try:
+        return MODEL_BACKENDS[backend](name)
+    except KeyError:
+        raise ValueError(f"Unknown separation backend: {backend} (choose from {', '.join(MODEL_BACKENDS)})")
+
+
+def _band(frequencies: np.ndarray, low: float, high: float) -> np.ndarray:
+    """1 inside [low, high] Hz, rolling off over half an octave outside"""
+    octaves = np.maximum(np.log2(np.maximum(low, 1) / np.maximum(frequencies, 1)),
+                         np.log2(np.maximum(frequencies, 1) / high))
+    return np.clip(1 - 2 * octaves, 0, 1).astype(np.float32)
+
+
+def _fit(audio: np.ndarray, frames: int) -> np.ndarray:
+    """audio trimmed or zero-padded to frames along its first axis"""
+    if len(audio) >= frames:
+        return audio[:frames]
+    return np.concatenate([audio, np.zeros((frames - len(audio),) + audio.shape[1:], dtype=audio.dtype)])
+
+
+def _runner_main(requests, responses, backend: str, max_batch: int, batch_wait: float, preload: List[str]):
+    """Worker loop: keep models resident and run queued segments in batches
+
+    Requests are (request_id, index, model, segment); each gets back
+    (request_id, index, stems or None, error or None, batch size). After
+    the first segment arrives, a worker waits up to batch_wait seconds to
+    fill a batch of max_batch, so segments of concurrent requests share
+    inference calls.
+    """
+    models: Dict[str, SeparationModel] = {}
+
+    def model_for(name: str) -> SeparationModel:
+        if name not in models:
+            started = time.perf_counter()
+            model = create_model(name, backend)
+            model.load()
+            models[name] = model
+            responses.put((None, name, None, None, time.perf_counter() - started))
+        return models[name]
+
+    for name in preload:
+        try:
+            model_for(name)
+        except Exception as e:
+            responses.put((None, name, None, str(e), 0.0))
+
+    stopping = False
+    while not stopping:
+        item = requests.get()
+        if item is None:
+            break
+        batch = [item]
+        deadline = time.monotonic() + batch_wait
+        while len(batch) < max_batch:
+            try:
+                item = requests.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+
+        for name, group in itertools.groupby(sorted(batch, key=lambda entry: entry[2]), key=lambda entry: entry[2]):
+            group = list(group)
+            try:
+                stems = model_for(name).separate(np.stack([segment for _, _, _, segment in group]))
+            except Exception as e:
+                for request_id, index, _, _ in group:
+                    responses.put((request_id, index, None, f"{type(e).__name__}: {e}", len(group)))
+                continue
+            for (request_id, index, _, _), separated in zip(group, stems):
+                responses.put((request_id, index, separated, None, len(group)))
+
+
+class ModelRunner:
+    """Long-lived worker processes that keep separation models loaded
+
+    Each worker loads a model the first time it sees it (or at start, for
+    the preload list) and keeps it for its lifetime, so a request pays for
+    inference only, not for an interpreter start and a weights load.
+    Segments from every request go through one local queue; workers take
+    them in batches, so concurrent requests share inference calls. Each
+    request keeps at most max_inflight segments queued, which bounds its
+    memory and lets requests interleave.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_batch: Optional[int] = None,
+                 batch_wait_ms: Optional[float] = None, backend: Optional[str] = None,
+                 preload: Iterable[str] = ()):
+        # Models are large and use every core for one batch; one worker is the usual choice
+        self.workers = workers or int(os.environ.get("ODOREMOVER_MODEL_WORKERS", 1))
+        self.max_batch = max_batch or int(os.environ.get("ODOREMOVER_MODEL_BATCH", 8))
+        self.batch_wait = (batch_wait_ms if batch_wait_ms is not None
+                           else float(os.environ.get("ODOREMOVER_MODEL_BATCH_WAIT_MS", 20))) / 1000
+        self.backend = backend or default_backend()
+        self.preload = list(preload)
+        self.max_inflight = 2 * self.max_batch
+        self._context = multiprocessing.get_context("spawn")
+        self._requests = None
+        self._responses = None
+        self._processes: List = []
+        self._listener: Optional[threading.Thread] = None
+        self._pending: Dict[str, queue.Queue] = {}
+        self._lock = threading.Lock()
+        self._stats = {"segments": 0, "batches": 0, "failed_segments": 0, "worker_restarts": 0}
+        self._load_seconds: Dict[str, float] = {}
+
+    def model(self, name: str) -> SeparationModel:
+        """An unloaded instance of the model the workers run for name, for its rate and segment sizes"""
+        return create_model(name, self.backend)
+
+    def start(self):
+        """Start the worker processes (idempotent)"""
+        with self._lock:
+            if self._requests is None:
+                self._requests = self._context.Queue()
+                self._responses = self._context.Queue()
+                self._listener = threading.Thread(target=self._route_responses, daemon=True)
+                self._listener.start()
+            self._processes = [process for process in self._processes if process.is_alive()]
+            while len(self._processes) < self.workers:
+                process = self._context.Process(
+                    target=_runner_main, daemon=True,
+                    args=(self._requests, self._responses, self.backend, self.max_batch, self.batch_wait,
+                          self.preload)
+                )
+                process.start()
+                self._processes.append(process)
+
+    def separate(self, model: str, segments: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """Separate (channels, frames) segments with model, yielding (stems, channels, frames) in order"""
+        self.start()
+        request_id = uuid.uuid4().hex
+        results: queue.Queue = queue.Queue()
+        self._pending[request_id] = results
+        workers = list(self._processes)
+        ready: Dict[int, np.ndarray] = {}
+        submitted = received = 0
+        upcoming = iter(segments)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and submitted - received < self.max_inflight:
+                    segment = next(upcoming, None)
+                    if segment is None:
+                        exhausted = True
+                        break
+                    self._requests.put((request_id, submitted, model, np.ascontiguousarray(segment, np.float32)))
+                    submitted += 1
+                if exhausted and received == submitted:
+                    return
+                while received not in ready:
+                    try:
+                        index, stems, error = results.get(timeout=1.0)
+                    except queue.Empty:
+                        if any(not process.is_alive() for process in workers):
+                            self._stats["worker_restarts"] += 1
+                            self.start()
+                            raise RuntimeError("A separation worker died while running this request")
+                        continue
+                    if error is not None:
+                        raise RuntimeError(f"Separation model {model} failed: {error}")
+                    ready[index] = stems
+                yield ready.pop(received)
+                received += 1
+        finally:
+            self._pending.pop(request_id, None)
+
+    def _route_responses(self):
+        """Hand worker results to the request waiting for them until shutdown"""
+        responses = self._responses
+        while True:
+            try:
+                message = responses.get()
+            except (EOFError, OSError, ValueError):
+                return
+            if message is None:
+                return
+            request_id, index, stems, error, extra = message
+            if request_id is None:
+                # A worker finished loading a model: index is its name, extra the seconds it took
+                if error is None:
+                    self._load_seconds[index] = round(extra, 3)
+                continue
+            # Every segment of a batch of extra segments reports back, so each counts for 1 / extra batches
+            self._stats["segments"] += 1
+            self._stats["batches"] += 1 / extra
+            if error is not None:
+                self._stats["failed_segments"] += 1
+            results = self._pending.get(request_id)
+            if results is not None:
+                results.put((index, stems, error))
+
+    def stats(self) -> dict:
+        """Workers, segments run, average batch size and each model's load time"""
+        batches = round(self._stats["batches"])
+        return {
+            "backend": self.backend,
+            "workers": self.workers,
+            "alive": sum(process.is_alive() for process in self._processes),
+            "max_batch": self.max_batch,
+            "segments": self._stats["segments"],
+            "batches": batches,
+            "mean_batch_size": round(self._stats["segments"] / batches, 2) if batches else None,
+            "failed_segments": self._stats["failed_segments"],
+            "worker_restarts": self._stats["worker_restarts"],
+            "model_load_seconds": dict(self._load_seconds),
+        }
+
+    def shutdown(self, timeout: float = 5):
+        """Stop the workers after the segments already queued"""
+        with self._lock:
+            if self._requests is None:
+                return
+            for _ in self._processes:
+                self._requests.put(None)
+            for process in self._processes:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+            self._processes = []
+            self._responses.put(None)
+            self._listener.join(timeout)
+            self._requests = self._responses = self._listener = None
+
+
+_default_runner: Optional[ModelRunner] = None
+
+
+def default_runner() -> ModelRunner:
+    """Process-wide runner configured from ODOREMOVER_MODEL_* environment variables"""
+    global _default_runner
+    if _default_runner is None:
+        _default_runner = ModelRunner()
+        atexit.register(_default_runner.shutdown)
+    return _default_runner
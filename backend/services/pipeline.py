@@ -0,0 +1,334 @@
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from .audio_cache import AudioCache, AudioSource, default_cache, record_time
+from .encoders import BLOCK_FRAMES, BlockEncoder, format_for_path, get_output_format
+from .fade import fade_gains
+
+
+class Stage:
+    """One step of a processing pipeline, working on float32 (channels, frames) arrays
+
+    Whole-buffer stages implement apply(). Blockwise stages implement
+    process_block() instead and keep the length unchanged; consecutive
+    blockwise stages are fused into one pass over the audio. A blockwise
+    stage that first needs to see its whole input (e.g. to measure a peak)
+    sets needs_analysis and implements analyze(); it starts a new pass.
+    """
+    tool = "base"
+    blockwise = False
+    needs_analysis = False
+
+    def spec(self) -> Dict[str, Any]:
+        """Canonical parameters, used for validation echoes and cache keys"""
+        return {"tool": self.tool}
+
+    def apply(self, audio: np.ndarray, sr: int, context: "PipelineContext") -> Tuple[np.ndarray, int]:
+        raise NotImplementedError
+
+    def analyze(self, audio: np.ndarray, sr: int):
+        pass
+
+    def process_block(self, block: np.ndarray, offset: int, total_frames: int, sr: int) -> np.ndarray:
+        """Process frames [offset, offset + block.shape[1]) of total_frames; may work in place"""
+        raise NotImplementedError
+
+
+class SeparationStage(Stage):
+    """Keep one stem of the vocal separator's output"""
+    tool = "vocal-separator"
+
+    def __init__(self, stem: str = "vocals", quality: str = "high"):
+        if stem not in ("vocals", "instrumental"):
+            raise ValueError("stem must be 'vocals' or 'instrumental'")
+        self.stem = stem
+        self.quality = quality
+
+    def spec(self):
+        return {"tool": self.tool, "stem": self.stem, "quality": self.quality}
+
+    def apply(self, audio, sr, context):
+        separator = context.vocal_separator
+        stereo = np.repeat(audio, 2, axis=0) if audio.shape[0] == 1 else audio[:2]
+        if self.quality == "fast":
+            vocals, instrumental = separator.separate_vocals_basic(stereo)
+        else:
+            vocals, instrumental = separator.separate_vocals_advanced(stereo, sr, content_key=context.input_key)
+        stem = vocals if self.stem == "vocals" else instrumental
+        return np.asarray(stem, dtype=np.float32)[np.newaxis], sr
+
+
+class PitchTempoStage(Stage):
+    tool = "pitch-tempo"
+
+    def __init__(self, pitch_semitones: float = 0, tempo_percent: float = 0, quality: str = "high"):
+        if tempo_percent <= -100:
+            raise ValueError("tempo_percent must be greater than -100")
+        self.pitch_semitones = float(pitch_semitones)
+        self.tempo_percent = float(tempo_percent)
+        self.quality = quality
+
+    def spec(self):
+        return {"tool": self.tool, "pitch_semitones": self.pitch_semitones,
+                "tempo_percent": self.tempo_percent, "quality": self.quality}
+
+    def apply(self, audio, sr, context):
+        from .stretch_engines import engine_for_quality
+
+        tempo_factor = 1.0 + self.tempo_percent / 100.0
+        processed = engine_for_quality(self.quality).process(audio, sr, self.pitch_semitones, tempo_factor)
+        return np.asarray(processed, dtype=np.float32), sr
+
+
+class GainStage(Stage):
+    tool = "gain"
+    blockwise = True
+
+    def __init__(self, gain_db: float = 0):
+        self.gain_db = float(gain_db)
+
+    def spec(self):
+        return {"tool": self.tool, "gain_db": self.gain_db}
+
+    def process_block(self, block, offset, total_frames, sr):
+        block *= np.float32(10 ** (self.gain_db / 20))
+        return block
+
+
+class FadeStage(Stage):
+    """Linear fade in from the start and fade out to the end"""
+    tool = "fade"
+    blockwise = True
+
+    def __init__(self, fade_in: float = 0, fade_out: float = 0):
+        if fade_in < 0 or fade_out < 0:
+            raise ValueError("Fade durations must not be negative")
+        self.fade_in = float(fade_in)
+        self.fade_out = float(fade_out)
+
+    def spec(self):
+        return {"tool": self.tool, "fade_in": self.fade_in, "fade_out": self.fade_out}
+
+    def process_block(self, block, offset, total_frames, sr):
+        fade_in = int(self.fade_in * sr)
+        fade_out = int(self.fade_out * sr)
+        if (fade_in and offset < fade_in) or (fade_out and offset + block.shape[1] > total_frames - fade_out):
+            block *= fade_gains(offset, block.shape[1], total_frames, fade_in, fade_out)
+        return block
+
+
+class NormalizeStage(Stage):
+    """Scale so the sample peak lands on peak_db dBFS"""
+    tool = "normalize"
+    blockwise = True
+    needs_analysis = True
+
+    def __init__(self, peak_db: float = -1.0):
+        if peak_db > 0:
+            raise ValueError("peak_db must not be above 0 dBFS")
+        self.peak_db = float(peak_db)
+        self._gain = np.float32(1.0)
+
+    def spec(self):
+        return {"tool": self.tool, "peak_db": self.peak_db}
+
+    def analyze(self, audio, sr):
+        peak = float(np.max(np.abs(audio))) if audio.size else 0.0
+        self._gain = np.float32(10 ** (self.peak_db / 20) / peak if peak > 0 else 1.0)
+
+    def process_block(self, block, offset, total_frames, sr):
+        block *= self._gain
+        return block
+
+
+STAGES = {stage.tool: stage for stage in (SeparationStage, PitchTempoStage, GainStage, FadeStage, NormalizeStage)}
+
+# Longest pipeline accepted
+MAX_STEPS = 16
+
+
+def parse_steps(steps: List[Dict[str, Any]]) -> List[Stage]:
+    """Build stages from [{"tool": name, **parameters}, ...], raising ValueError on bad input"""
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("steps must be a non-empty list")
+    if len(steps) > MAX_STEPS:
+        raise ValueError(f"A pipeline may have at most {MAX_STEPS} steps")
+    stages = []
+    for index, step in enumerate(steps):
+        if not isinstance(step, dict) or step.get("tool") not in STAGES:
+            raise ValueError(f"Step {index + 1}: tool must be one of {', '.join(STAGES)}")
+        parameters = {name: value for name, value in step.items() if name != "tool"}
+        try:
+            stages.append(STAGES[step["tool"]](**parameters))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Step {index + 1}: {e}")
+    return stages
+
+
+def plan_segments(stages: List[Stage]) -> List[List[Stage]]:
+    """Split stages into passes: each whole-buffer stage alone, runs of blockwise stages fused"""
+    segments: List[List[Stage]] = []
+    for stage in stages:
+        fusable = (stage.blockwise and not stage.needs_analysis and segments
+                   and all(previous.blockwise for previous in segments[-1]))
+        if fusable:
+            segments[-1].append(stage)
+        else:
+            segments.append([stage])
+    return segments
+
+
+class PipelineContext:
+    def __init__(self, vocal_separator=None, input_key: Optional[str] = None):
+        self.vocal_separator = vocal_separator
+        # Cache identity of the current stage input (see AudioCache.key)
+        self.input_key = input_key
+
+
+class Pipeline:
+    """Runs a chain of tools on one decoded buffer, with no intermediate files
+
+    The input is decoded once and the result encoded once; between stages
+    audio stays in memory. Blockwise stages are fused so each run of them is
+    a single pass, and the last pass is written straight to the master and
+    the encoder block by block. The output of every earlier pass is cached
+    in memory under the content hash and the steps that produced it, so a
+    pipeline that only changes its tail restarts from the longest cached
+    prefix. Prefixes are not written to the disk tier: the decode and the
+    final encode stay the only file I/O, at the cost of prefixes not being
+    shared between workers.
+    """
+
+    def __init__(self, vocal_separator=None, cache: Optional[AudioCache] = None):
+        self.vocal_separator = vocal_separator
+        self.cache = cache or default_cache()
+
+    def prefix_key(self, content_key: str, stages: List[Stage]) -> str:
+        return self.cache.key(content_key, "pipeline", steps=[stage.spec() for stage in stages])
+
+    def process_file(self, input_path: AudioSource, output_path: str, steps: List[Dict[str, Any]],
+                     progress_callback: Optional[Callable[[int], None]] = None,
+                     content_key: Optional[str] = None, filename: Optional[str] = None,
+                     output_format: Optional[str] = None, bitrate: Optional[int] = None) -> dict:
+        """Run steps on input_path and deliver the result like PitchTempoProcessor.process_file
+
+        The result's timings include decode_ms, one <tool>_ms per pass that
+        ran (fused passes join their tools with "+") and encode_ms for
+        writing the output, which overlaps the last pass when it is fused.
+        cached_steps counts the leading steps served from the cache.
+        """
+        try:
+            stages = parse_steps(steps)
+            segments = plan_segments(stages)
+            stem = os.path.splitext(output_path)[0]
+            fmt = get_output_format(output_format or format_for_path(output_path))
+            bitrate = fmt.resolve_bitrate(bitrate)
+            master_path = f"{stem}_master.wav"
+            output_path = f"{stem}.{fmt.extension}"
+            timings = {"decode_ms": 0.0, "resample_ms": 0.0}
+            content_key = content_key or self.cache.digest(input_path)
+
+            # Ends of every pass but the last, in stage counts; the last pass is never cached
+            boundaries = np.cumsum([len(segment) for segment in segments])[:-1].tolist()
+            audio, sr, done = None, None, 0
+            for boundary in reversed(boundaries):
+                cached = self.cache.get(self.prefix_key(content_key, stages[:boundary]))
+                if cached is not None:
+                    audio, done = cached[0], boundary
+                    sr, original_duration = int(cached[1][0]), float(cached[1][1])
+                    break
+            if audio is None:
+                audio, sr = self.cache.load_audio(input_path, None, timings=timings,
+                                                  content_key=content_key, filename=filename)
+                audio = np.atleast_2d(audio).astype(np.float32, copy=False)
+                original_duration = audio.shape[1] / sr
+            if progress_callback:
+                progress_callback(10)
+
+            context = PipelineContext(self.vocal_separator)
+            position = 0
+            for number, segment in enumerate(segments):
+                start = position
+                position += len(segment)
+                if position <= done:
+                    continue
+                context.input_key = self.prefix_key(content_key, stages[:start])
+                if number == len(segments) - 1:
+                    duration, channels = self._finish(segment, audio, sr, context, master_path,
+                                                      output_path, fmt, bitrate, timings)
+                    break
+                audio, sr = self._run_segment(segment, audio, sr, context, timings)
+                self.cache.put(self.prefix_key(content_key, stages[:position]),
+                               (audio, np.array([sr, original_duration])), persist=False)
+                if progress_callback:
+                    progress_callback(10 + 85 * position // len(stages))
+            if progress_callback:
+                progress_callback(100)
+
+            return {
+                "success": True,
+                "output_path": output_path,
+                "master_path": master_path,
+                "output_format": fmt.name,
+                "bitrate": bitrate,
+                "steps": [stage.spec() for stage in stages],
+                "cached_steps": done,
+                "original_duration": original_duration,
+                "new_duration": duration,
+                "sample_rate": sr,
+                "channels": channels,
+                "timings": timings,
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    def _run_segment(self, segment: List[Stage], audio: np.ndarray, sr: int, context: PipelineContext,
+                     timings: dict) -> Tuple[np.ndarray, int]:
+        if not segment[0].blockwise:
+            started = time.perf_counter()
+            audio, sr = segment[0].apply(audio, sr, context)
+            record_time(timings, f"{segment[0].tool}_ms", started)
+            return np.atleast_2d(audio), sr
+        output = np.empty(audio.shape, dtype=np.float32)
+        for offset, block in self._fused_blocks(segment, audio, sr, timings):
+            output[:, offset:offset + block.shape[1]] = block
+        return output, sr
+
+    def _fused_blocks(self, segment: List[Stage], audio: np.ndarray, sr: int, timings: dict):
+        """(offset, block) after every stage of a blockwise segment, one pass over audio"""
+        started = time.perf_counter()
+        segment[0].analyze(audio, sr)
+        total = audio.shape[1]
+        for offset in range(0, total, BLOCK_FRAMES):
+            # The copy lets stages work in place without touching cached input
+            block = np.array(audio[:, offset:offset + BLOCK_FRAMES], dtype=np.float32)
+            for stage in segment:
+                block = stage.process_block(block, offset, total, sr)
+            yield offset, block
+        record_time(timings, "+".join(stage.tool for stage in segment) + "_ms", started)
+
+    def _finish(self, segment: List[Stage], audio: np.ndarray, sr: int, context: PipelineContext,
+                master_path: str, output_path: str, fmt, bitrate: Optional[int], timings: dict):
+        """Run the last pass straight into the float master and the delivered encoding"""
+        if segment[0].blockwise:
+            blocks = self._fused_blocks(segment, audio, sr, timings)
+        else:
+            audio, sr = self._run_segment(segment, audio, sr, context, timings)
+            blocks = ((offset, audio[:, offset:offset + BLOCK_FRAMES])
+                      for offset in range(0, audio.shape[1], BLOCK_FRAMES))
+        channels = audio.shape[0]
+        started = time.perf_counter()
+        with sf.SoundFile(master_path, "w", samplerate=sr, channels=channels, subtype="FLOAT") as master, \
+                BlockEncoder(output_path, fmt, bitrate, sr, channels) as encoder:
+            for _, block in blocks:
+                master.write(block.T)
+                encoder.write(block.T)
+        record_time(timings, "encode_ms", started)
+        return audio.shape[1] / sr, channels
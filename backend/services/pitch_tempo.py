@@ -1,101 +1,139 @@
+import io
 import librosa
 import numpy as np
 import soundfile as sf
-import pyrubberband as pyrb
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Callable
 import os
 
+from services.audio_cache import (
+    AudioCache, AudioSource, as_file, decode_audio, default_cache, resampler_for_quality
+)
+from services.audio_probe import probe_audio
+from services.encoders import encode_file, format_for_path, get_output_format
+from services.stretch_engines import StretchEngine, RubberbandEngine, engine_for_quality
+
 class PitchTempoProcessor:
-    """Advanced pitch and tempo manipulation using RubberBand"""
+    """Advanced pitch and tempo manipulation using RubberBand or an in-process phase vocoder"""
     
-    def __init__(self, sample_rate: int = 44100):
+    def __init__(self, sample_rate: Optional[int] = None, cache: Optional[AudioCache] = None):
+        # None processes every file at its native rate; both engines work at any rate
         self.sample_rate = sample_rate
+        self.cache = cache or default_cache()
+        self.engine: StretchEngine = RubberbandEngine()
+        # Previews trade bandwidth for latency: half the samples to stretch
+        self.preview_sample_rate = 22050
+        # Tempo and key estimation only need the low band
+        self.analysis_sample_rate = 22050
         
-    def load_audio(self, file_path: str) -> Tuple[np.ndarray, int]:
-        """Load audio file"""
+    def load_audio(self, file_path: AudioSource, quality: str = "high", timings: Optional[dict] = None,
+                   content_key: Optional[str] = None, filename: Optional[str] = None) -> Tuple[np.ndarray, int]:
+        """Load audio file, resampling with the quality tier's resampler if sample_rate is set
+
+        file_path may be upload bytes; see AudioCache.load_audio.
+        """
         try:
-            audio, sr = librosa.load(file_path, sr=self.sample_rate, mono=False)
+            audio, sr = self.cache.load_audio(
+                file_path, self.sample_rate, resampler_for_quality(quality), timings, content_key, filename
+            )
             return audio, sr
         except Exception as e:
             raise ValueError(f"Error loading audio: {str(e)}")
     
-    def change_pitch(self, audio: np.ndarray, semitones: float) -> np.ndarray:
+    def _rate(self, sr: Optional[int]) -> int:
+        """Sample rate of audio handed to the change_* methods"""
+        return sr or self.sample_rate or 44100
+    
+    def change_pitch(self, audio: np.ndarray, semitones: float, sr: Optional[int] = None) -> np.ndarray:
         """Change pitch by semitones without affecting tempo"""
         try:
-            if audio.ndim == 1:
-                # Mono audio
-                shifted = pyrb.pitch_shift(audio, sr=self.sample_rate, n_steps=semitones)
-            else:
-                # Stereo audio - process each channel
-                shifted = np.array([
-                    pyrb.pitch_shift(audio[0], sr=self.sample_rate, n_steps=semitones),
-                    pyrb.pitch_shift(audio[1], sr=self.sample_rate, n_steps=semitones)
-                ])
-            return shifted
+            return self.engine.process(audio, self._rate(sr), semitones, 1.0)
         except Exception as e:
             raise ValueError(f"Error changing pitch: {str(e)}")
     
-    def change_tempo(self, audio: np.ndarray, tempo_factor: float) -> np.ndarray:
+    def change_tempo(self, audio: np.ndarray, tempo_factor: float, sr: Optional[int] = None) -> np.ndarray:
         """Change tempo without affecting pitch"""
         try:
-            if audio.ndim == 1:
-                # Mono audio
-                stretched = pyrb.time_stretch(audio, sr=self.sample_rate, rate=tempo_factor)
-            else:
-                # Stereo audio - process each channel
-                stretched = np.array([
-                    pyrb.time_stretch(audio[0], sr=self.sample_rate, rate=tempo_factor),
-                    pyrb.time_stretch(audio[1], sr=self.sample_rate, rate=tempo_factor)
-                ])
-            return stretched
+            return self.engine.process(audio, self._rate(sr), 0, tempo_factor)
         except Exception as e:
             raise ValueError(f"Error changing tempo: {str(e)}")
     
-    def change_pitch_and_tempo(self, audio: np.ndarray, semitones: float, tempo_factor: float) -> np.ndarray:
-        """Change both pitch and tempo independently"""
+    def change_pitch_and_tempo(self, audio: np.ndarray, semitones: float, tempo_factor: float,
+                               progress_callback: Optional[Callable[[int], None]] = None,
+                               engine: Optional[StretchEngine] = None,
+                               sr: Optional[int] = None) -> np.ndarray:
+        """Change both pitch and tempo independently, in a single engine pass over all channels"""
         try:
-            # First change tempo
-            if tempo_factor != 1.0:
-                audio = self.change_tempo(audio, tempo_factor)
-            
-            # Then change pitch
-            if semitones != 0:
-                audio = self.change_pitch(audio, semitones)
-            
+            audio = (engine or self.engine).process(audio, self._rate(sr), semitones, tempo_factor)
+            if progress_callback:
+                progress_callback(80)
             return audio
         except Exception as e:
             raise ValueError(f"Error processing audio: {str(e)}")
     
     def process_file(self, input_path: str, output_path: str, pitch_semitones: float = 0, 
-                    tempo_percent: float = 0, quality: str = "high") -> dict:
-        """Process audio file with pitch and tempo changes"""
+                    tempo_percent: float = 0, quality: str = "high",
+                    progress_callback: Optional[Callable[[int], None]] = None,
+                    content_key: Optional[str] = None, filename: Optional[str] = None,
+                    output_format: Optional[str] = None, bitrate: Optional[int] = None) -> dict:
+        """Process audio file with pitch and tempo changes
+
+        progress_callback, if given, is called with a percentage after each stage.
+        The result's timings report the time spent decoding and resampling.
+        input_path may be the bytes of an upload, together with its
+        content_key and filename.
+
+        The result is kept as a 32-bit float master WAV next to output_path
+        and delivered in output_format at bitrate kbps, encoded from the
+        master block by block. output_path's extension is replaced by the
+        format's; without output_format it picks the format, falling back to WAV.
+        """
         try:
+            stem = os.path.splitext(output_path)[0]
+            fmt = get_output_format(output_format or format_for_path(output_path))
+            bitrate = fmt.resolve_bitrate(bitrate)
+            master_path = f"{stem}_master.wav"
+            output_path = f"{stem}.{fmt.extension}"
+            
             # Load audio
-            audio, sr = self.load_audio(input_path)
+            timings = {"decode_ms": 0.0, "resample_ms": 0.0}
+            audio, sr = self.load_audio(input_path, quality, timings, content_key, filename)
+            if progress_callback:
+                progress_callback(20)
             
             # Convert tempo percentage to factor
             tempo_factor = 1.0 + (tempo_percent / 100.0)
+            engine = engine_for_quality(quality)
             
             # Apply changes if needed
             if pitch_semitones != 0 or tempo_factor != 1.0:
-                processed_audio = self.change_pitch_and_tempo(audio, pitch_semitones, tempo_factor)
+                processed_audio = self.change_pitch_and_tempo(
+                    audio, pitch_semitones, tempo_factor, progress_callback, engine, sr
+                )
             else:
                 processed_audio = audio
             
             # Save processed audio
             if processed_audio.ndim == 1:
-                sf.write(output_path, processed_audio, sr)
+                sf.write(master_path, processed_audio, sr, subtype='FLOAT')
             else:
-                sf.write(output_path, processed_audio.T, sr)  # Transpose for soundfile
+                sf.write(master_path, processed_audio.T, sr, subtype='FLOAT')  # Transpose for soundfile
+            encode_file(master_path, output_path, fmt, bitrate)
+            if progress_callback:
+                progress_callback(100)
             
             return {
                 "success": True,
                 "output_path": output_path,
+                "master_path": master_path,
+                "output_format": fmt.name,
+                "bitrate": bitrate,
                 "original_duration": len(audio[0]) / sr if audio.ndim == 2 else len(audio) / sr,
                 "new_duration": len(processed_audio[0]) / sr if processed_audio.ndim == 2 else len(processed_audio) / sr,
                 "pitch_change": pitch_semitones,
                 "tempo_change": tempo_percent,
-                "sample_rate": sr
+                "sample_rate": sr,
+                "engine": engine.name,
+                "timings": timings
             }
             
         except Exception as e:
@@ -104,20 +142,53 @@ class PitchTempoProcessor:
                 "error": str(e)
             }
     
-    def get_preview(self, input_path: str, pitch_semitones: float = 0, 
-                   tempo_percent: float = 0, start_time: float = 30, duration: float = 10) -> dict:
-        """Generate a preview of the processed audio"""
+    def load_preview_window(self, source: Optional[AudioSource], start_time: float, duration: float,
+                            content_key: Optional[str] = None, filename: Optional[str] = None,
+                            quality: str = "fast") -> Tuple[np.ndarray, int]:
+        """Decode only the preview window of source, cached on content and window
+
+        source is a path, the raw bytes of an upload, or None when the window
+        is expected to be cached under content_key already. Moving only the
+        pitch or tempo slider therefore never decodes the file again.
+        """
+        sr = self.preview_sample_rate
+        res_type = resampler_for_quality(quality)
+        if content_key is None and isinstance(source, str):
+            content_key = self.cache.digest(source)
+
+        def decode():
+            if source is None:
+                raise LookupError("Preview audio is no longer cached; send the file again")
+            # Keep the window inside short files instead of returning silence
+            total = probe_audio(as_file(source), filename)["duration"]
+            offset = max(0.0, min(start_time, total - duration))
+            audio, _ = decode_audio(source, filename, sr=sr, mono=False, offset=offset,
+                                    duration=duration, res_type=res_type)
+            return audio, np.array([sr])
+
+        audio, loaded_sr = self.cache.cached(content_key, "preview-window", decode,
+                                             start=start_time, duration=duration, sr=sr, res_type=res_type)
+        return audio, int(loaded_sr[0])
+
+    def get_preview(self, input_path: Optional[AudioSource], pitch_semitones: float = 0,
+                   tempo_percent: float = 0, start_time: float = 30, duration: float = 10,
+                   quality: str = "fast", content_key: Optional[str] = None,
+                   filename: Optional[str] = None) -> dict:
+        """Generate a preview of the processed audio
+
+        Only the requested window is decoded, at preview_sample_rate. See
+        load_preview_window for the accepted sources.
+        """
         try:
-            # Load audio segment
-            audio, sr = librosa.load(input_path, sr=self.sample_rate, 
-                                   offset=start_time, duration=duration, mono=False)
+            audio, sr = self.load_preview_window(input_path, start_time, duration, content_key, filename, quality)
             
             # Convert tempo percentage to factor
             tempo_factor = 1.0 + (tempo_percent / 100.0)
+            engine = engine_for_quality(quality)
             
             # Apply changes
             if pitch_semitones != 0 or tempo_factor != 1.0:
-                processed_audio = self.change_pitch_and_tempo(audio, pitch_semitones, tempo_factor)
+                processed_audio = engine.process(audio, sr, pitch_semitones, tempo_factor)
             else:
                 processed_audio = audio
             
@@ -125,39 +196,53 @@ class PitchTempoProcessor:
                 "success": True,
                 "preview_audio": processed_audio,
                 "sample_rate": sr,
-                "duration": len(processed_audio[0]) / sr if processed_audio.ndim == 2 else len(processed_audio) / sr
+                "duration": len(processed_audio[0]) / sr if processed_audio.ndim == 2 else len(processed_audio) / sr,
+                "engine": engine.name
             }
             
+        except LookupError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "expired": True
+            }
         except Exception as e:
             return {
                 "success": False,
                 "error": str(e)
             }
     
-    def analyze_audio(self, file_path: str) -> dict:
+    def warm_up(self, audio: np.ndarray, sr: int):
+        """Run a short clip through the preview engine and the analysis path, compiling their numba kernels
+        
+        The rubberband engine runs out of process and has nothing to warm.
+        """
+        self.change_pitch_and_tempo(audio, 1, 1.1, engine=engine_for_quality("fast"), sr=sr)
+        mono = librosa.resample(np.mean(audio, axis=0), orig_sr=sr, target_sr=self.analysis_sample_rate,
+                                res_type=resampler_for_quality("fast"))
+        librosa.beat.beat_track(y=mono, sr=self.analysis_sample_rate)
+        self._estimate_key(mono, self.analysis_sample_rate)
+    
+    def analyze_audio(self, file_path: AudioSource, content_key: Optional[str] = None,
+                      filename: Optional[str] = None) -> dict:
         """Analyze audio properties"""
         try:
-            audio, sr = self.load_audio(file_path)
-            
-            # Basic analysis
-            duration = len(audio[0]) / sr if audio.ndim == 2 else len(audio) / sr
+            # Basic properties come from the headers, at the file's real sample rate
+            info = probe_audio(as_file(file_path), filename)
+            audio, sr = self.cache.load_audio(
+                file_path, self.analysis_sample_rate, resampler_for_quality("fast"),
+                content_key=content_key, filename=filename
+            )
             
             # Tempo estimation
             tempo, beats = librosa.beat.beat_track(y=audio[0] if audio.ndim == 2 else audio, sr=sr)
             
-            # Pitch analysis (fundamental frequency)
-            f0, voiced_flag, voiced_probs = librosa.piecewise_aggregate(
-                np.abs(librosa.stft(audio[0] if audio.ndim == 2 else audio)), 
-                np.arange(0, len(audio[0]) if audio.ndim == 2 else len(audio), 512),
-                np.mean
-            )
-            
             return {
                 "success": True,
-                "duration": duration,
-                "tempo": float(tempo),
-                "sample_rate": sr,
-                "channels": audio.shape[0] if audio.ndim == 2 else 1,
+                "duration": info["duration"],
+                "tempo": float(np.atleast_1d(tempo)[0]),
+                "sample_rate": info["sample_rate"],
+                "channels": info["channels"],
                 "estimated_key": self._estimate_key(audio, sr)
             }
             
@@ -180,4 +265,13 @@ class PitchTempoProcessor:
             
             return keys[key_index]
         except:
-            return "Unknown"
\ No newline at end of file
+            return "Unknown"
+
+
+def encode_wav(audio: np.ndarray, sr: int, subtype: str = "PCM_16") -> bytes:
+    """Encode (channels, samples) or (samples,) audio as WAV bytes in memory"""
+    buffer = io.BytesIO()
+    # libsndfile wraps rather than clips out-of-range floats when writing PCM
+    audio = np.clip(audio, -1.0, 1.0)
+    sf.write(buffer, audio.T if audio.ndim == 2 else audio, sr, format="WAV", subtype=subtype)
+    return buffer.getvalue()
@@ -1,45 +1,134 @@
-import os
 import asyncio
-import shutil
-from typing import Dict, Any
+import mmap
+import os
+import time
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+import soundfile as sf
+
+from .audio_probe import PcmLayout, pcm_layout
+from .encoders import BLOCK_FRAMES, BlockEncoder, get_output_format
+
+# WAV data chunks are limited to 4 GB; longer lossless output is written as RF64
+WAV_MAX_DATA_BYTES = 0xFFFFFFFF - 1024
+
 
 class ReverseService:
-    """Audio reversal using PyDub"""
-    
+    """Audio reversal in bounded memory, reading fixed-size blocks from the end of the file
+
+    Each block is reversed with one slice and written forward, so memory
+    does not grow with the file. Uncompressed WAV/RF64/AIFF input is
+    memory-mapped and its pages released as soon as a block is done, so a
+    multi-GB recording costs a block of RAM; reversed to WAV it keeps its
+    sample format bit for bit. Other formats are read with backward seeks.
+    """
+
+    def __init__(self, block_frames: int = BLOCK_FRAMES):
+        self.block_frames = block_frames
+
     async def process(self, input_path: str, output_path: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            # Simulate processing time
-            await asyncio.sleep(1.0)
-            
-            # In production, you would use PyDub for actual audio reversal
-            # For now, copy the input file as a placeholder
-            shutil.copy2(input_path, output_path)
-            
+            started = time.perf_counter()
+            result = await asyncio.to_thread(self.reverse_file, input_path, output_path,
+                                             bitrate=parameters.get("bitrate"))
+            elapsed = time.perf_counter() - started
+
             return {
                 "success": True,
                 "output_path": output_path,
                 "metadata": {
                     "operation": "reverse",
-                    "processing_time": "1.0s"
+                    "processing_time": f"{elapsed:.1f}s",
+                    "realtime_factor": round(result["duration"] / elapsed, 1) if elapsed else None,
+                    **result
                 }
             }
-            
+
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Audio reversal failed: {str(e)}"
             }
-    
-    def _reverse_audio(self, input_path: str, output_path: str) -> bool:
-        """Reverse audio using PyDub (placeholder)"""
+
+    def reverse_file(self, input_path: str, output_path: str, bitrate: Optional[int] = None) -> Dict[str, Any]:
+        """Write input_path backwards to output_path, whose extension picks the output format"""
+        fmt = get_output_format(os.path.splitext(output_path)[1].lstrip(".") or "wav")
+        bitrate = fmt.resolve_bitrate(bitrate)
+        layout = pcm_layout(input_path)
+
+        if layout is not None:
+            sample_rate, channels, frames = layout.sample_rate, layout.channels, layout.frames
+            blocks = self._mapped_blocks(input_path, layout)
+        else:
+            sample_rate, channels, frames, blocks = self._seek_blocks(input_path)
+
+        lossless = layout is not None and fmt.name == "wav"
+        written = 0
+        if lossless:
+            container = "RF64" if frames * layout.frame_bytes > WAV_MAX_DATA_BYTES else "WAV"
+            with sf.SoundFile(output_path, "w", samplerate=sample_rate, channels=channels,
+                              format=container, subtype=layout.subtype) as output:
+                for block in blocks:
+                    output.write(block)
+                    written += len(block)
+        else:
+            with BlockEncoder(output_path, fmt, bitrate, sample_rate, channels) as encoder:
+                for block in blocks:
+                    encoder.write(layout.to_float(block) if layout is not None else block)
+                    written += len(block)
+
+        return {
+            "duration": written / sample_rate,
+            "sample_rate": sample_rate,
+            "channels": channels,
+            "read_mode": "mmap" if layout is not None else "seek",
+            "lossless": lossless,
+            "output_format": fmt.name,
+            "bitrate": bitrate,
+        }
+
+    def _mapped_blocks(self, input_path: str, layout: PcmLayout) -> Iterator[np.ndarray]:
+        """Reversed (frames, channels) blocks of a memory-mapped PCM file, last block first"""
+        if not layout.frames:
+            return
+        with open(input_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            records = np.frombuffer(mapped, dtype=np.uint8, count=layout.frames * layout.frame_bytes,
+                                    offset=layout.data_offset).reshape(layout.frames, layout.frame_bytes)
+            try:
+                for end in range(layout.frames, 0, -self.block_frames):
+                    start = max(0, end - self.block_frames)
+                    yield layout.decode(records[start:end][::-1])
+                    self._release(mapped, layout.data_offset + start * layout.frame_bytes,
+                                  layout.data_offset + end * layout.frame_bytes)
+            finally:
+                # The map cannot close while a view of it is alive
+                del records
+
+    @staticmethod
+    def _release(mapped: mmap.mmap, start: int, end: int):
+        """Drop the mapped pages of a finished block from this process's resident memory"""
+        if not hasattr(mapped, "madvise") or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        first = start // mmap.PAGESIZE * mmap.PAGESIZE
+        mapped.madvise(mmap.MADV_DONTNEED, first, end - first)
+
+    def _seek_blocks(self, input_path: str):
+        """Sample rate, channels, frames and reversed float32 (frames, channels) blocks read with seeks"""
         try:
-            # This would be the actual PyDub implementation
-            # from pydub import AudioSegment
-            # 
-            # audio = AudioSegment.from_file(input_path)
-            # reversed_audio = audio.reverse()
-            # reversed_audio.export(output_path, format="mp3")
-            
-            return True
-        except Exception:
-            return False
+            audio_file = sf.SoundFile(input_path)
+        except sf.LibsndfileError as e:
+            raise ValueError(f"Cannot stream {os.path.basename(input_path)}: {e}")
+        if not audio_file.seekable():
+            audio_file.close()
+            raise ValueError(f"Cannot seek in {os.path.basename(input_path)}")
+
+        def blocks():
+            with audio_file:
+                for end in range(audio_file.frames, 0, -self.block_frames):
+                    start = max(0, end - self.block_frames)
+                    audio_file.seek(start)
+                    block = audio_file.read(end - start, dtype="float32", always_2d=True)
+                    yield block[::-1]
+
+        return audio_file.samplerate, audio_file.channels, audio_file.frames, blocks()
@@ -0,0 +1,163 @@
+from fractions import Fraction
+from typing import Dict
+
+import librosa
+import numpy as np
+import pyrubberband as pyrb
+from scipy.signal import resample_poly
+
+
+class StretchEngine:
+    """Interface for pitch/tempo backends used by PitchTempoProcessor
+
+    process() takes audio shaped (samples,) or (channels, samples) and
+    returns the same layout with the tempo multiplied by tempo_factor and
+    the pitch moved by semitones.
+    """
+    name = "base"
+
+    def process(self, audio: np.ndarray, sr: int, semitones: float, tempo_factor: float) -> np.ndarray:
+        raise NotImplementedError
+
+
+class RubberbandEngine(StretchEngine):
+    """The rubberband CLI through pyrubberband (highest quality, one subprocess per call)"""
+    name = "rubberband"
+
+    def process(self, audio: np.ndarray, sr: int, semitones: float, tempo_factor: float) -> np.ndarray:
+        if semitones == 0 and tempo_factor == 1.0:
+            return audio
+
+        # Rubberband handles multichannel input natively and accepts --tempo
+        # and --pitch together, so every channel goes through one call.
+        # pyrubberband takes (samples, channels); we keep (channels, samples)
+        frames = audio.T if audio.ndim == 2 else audio
+        if tempo_factor != 1.0:
+            processed = pyrb.time_stretch(frames, sr, tempo_factor,
+                                          rbargs={"--pitch": semitones} if semitones else None)
+        else:
+            processed = pyrb.pitch_shift(frames, sr, semitones)
+        return processed.T if audio.ndim == 2 else processed
+
+
+class PhaseVocoderEngine(StretchEngine):
+    """In-process phase vocoder with identity phase locking
+
+    Stretches by pitch_ratio / tempo_factor and then resamples by
+    1 / pitch_ratio, so one stretch serves both changes. All channels are
+    processed as one array and the per-frame phase accumulation is a
+    cumulative sum, so nothing loops per channel or per frame in Python.
+    Transients smear more than with rubberband; it is meant for previews
+    and short clips where latency matters most.
+    """
+    name = "phase-vocoder"
+
+    def __init__(self, n_fft: int = 2048, hop_length: int = 512, chunk_frames: int = 2048):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        # Output frames synthesised per step; bounds memory on long inputs
+        self.chunk_frames = chunk_frames
+
+    def process(self, audio: np.ndarray, sr: int, semitones: float, tempo_factor: float) -> np.ndarray:
+        if semitones == 0 and tempo_factor == 1.0:
+            return audio
+
+        target_length = int(round(audio.shape[-1] / tempo_factor))
+        pitch_ratio = Fraction(2 ** (semitones / 12)).limit_denominator(1000)
+
+        # Stretch so that resampling by 1 / pitch_ratio lands on the target tempo
+        stretched = self.time_stretch(audio, float(pitch_ratio) / tempo_factor)
+        if pitch_ratio != 1:
+            stretched = resample_poly(stretched, pitch_ratio.denominator, pitch_ratio.numerator, axis=-1)
+
+        # Fix rounding differences so the output length is exact
+        if stretched.shape[-1] >= target_length:
+            return stretched[..., :target_length]
+        padding = [(0, 0)] * (stretched.ndim - 1) + [(0, target_length - stretched.shape[-1])]
+        return np.pad(stretched, padding)
+
+    def time_stretch(self, audio: np.ndarray, stretch: float) -> np.ndarray:
+        """Make audio stretch times longer without changing its pitch"""
+        if stretch == 1.0:
+            return audio
+        stft = librosa.stft(audio, n_fft=self.n_fft, hop_length=self.hop_length)
+        n_frames = stft.shape[-1]
+
+        # Two trailing silent frames so every interpolation step has a right neighbour
+        padding = [(0, 0)] * (stft.ndim - 1) + [(0, 2)]
+        stft = np.pad(stft, padding)
+
+        time_steps = np.arange(0, n_frames, 1.0 / stretch)
+        # Expected phase advance per hop; float32 to match the complex64 STFT
+        bin_advance = (2 * np.pi * self.hop_length / self.n_fft) * np.arange(stft.shape[-2], dtype=np.float32)
+        bin_advance = bin_advance[:, np.newaxis]
+
+        phase_acc = np.angle(stft[..., :1])
+        chunks = []
+        for start in range(0, len(time_steps), self.chunk_frames):
+            steps = time_steps[start:start + self.chunk_frames]
+            left = steps.astype(int)
+            alpha = (steps - left).astype(np.float32)
+            left_frames = stft[..., left]
+            right_frames = stft[..., left + 1]
+
+            magnitude = (1 - alpha) * np.abs(left_frames) + alpha * np.abs(right_frames)
+            analysis_phase = np.angle(left_frames)
+
+            # Instantaneous-frequency phase advance of each bin, wrapped to [-pi, pi]
+            delta = np.angle(right_frames) - analysis_phase - bin_advance
+            delta -= np.float32(2 * np.pi) * np.round(delta / np.float32(2 * np.pi))
+            advance = bin_advance + delta
+
+            # Accumulated phase at each output frame (exclusive cumulative sum)
+            cumulative = np.cumsum(advance, axis=-1)
+            phase = phase_acc + cumulative - advance
+            phase_acc = phase_acc + cumulative[..., -1:]
+
+            phase = self._lock_phase(magnitude, phase, analysis_phase)
+            chunks.append(magnitude * np.exp(1j * phase))
+
+        stretched = np.concatenate(chunks, axis=-1)
+        return librosa.istft(stretched, hop_length=self.hop_length,
+                             length=int(round(audio.shape[-1] * stretch)))
+
+    @staticmethod
+    def _lock_phase(magnitude: np.ndarray, phase: np.ndarray, analysis_phase: np.ndarray) -> np.ndarray:
+        """Identity phase locking (Laroche & Dolson)
+
+        Each bin keeps its analysis phase offset from the spectral peak whose
+        region it falls in, so the partial around a peak stays coherent
+        instead of each bin drifting on its own.
+        """
+        n_bins = magnitude.shape[-2]
+        bins = np.arange(n_bins)[:, np.newaxis]
+        is_peak = np.zeros(magnitude.shape, dtype=bool)
+        is_peak[..., 1:-1, :] = (magnitude[..., 1:-1, :] > magnitude[..., :-2, :]) & \
+                                (magnitude[..., 1:-1, :] >= magnitude[..., 2:, :])
+
+        # Nearest peak at or below, and at or above, every bin
+        below = np.where(is_peak, bins, -1)
+        below = np.maximum.accumulate(below, axis=-2)
+        above = np.where(is_peak, bins, n_bins)
+        above = np.flip(np.minimum.accumulate(np.flip(above, axis=-2), axis=-2), axis=-2)
+
+        use_above = (below < 0) | ((above < n_bins) & (above - bins < bins - below))
+        peak = np.where(use_above, above, below)
+        has_peak = (peak >= 0) & (peak < n_bins)
+        peak = np.clip(peak, 0, n_bins - 1)
+
+        peak_phase = np.take_along_axis(phase, peak, axis=-2)
+        peak_analysis = np.take_along_axis(analysis_phase, peak, axis=-2)
+        return np.where(has_peak, peak_phase + analysis_phase - peak_analysis, phase)
+
+
+ENGINES: Dict[str, StretchEngine] = {
+    engine.name: engine for engine in (RubberbandEngine(), PhaseVocoderEngine())
+}
+
+# Quality tier -> engine; unlisted tiers use rubberband
+QUALITY_ENGINES = {"fast": "phase-vocoder"}
+
+
+def engine_for_quality(quality: str) -> StretchEngine:
+    return ENGINES[QUALITY_ENGINES.get(quality, "rubberband")]
@@ -2,21 +2,43 @@ import os
 import librosa
 import numpy as np
 import soundfile as sf
-from typing import Tuple, Optional
+from scipy.ndimage import uniform_filter1d
+from typing import Tuple, Optional, Callable
 import tempfile
+import time
+
+from services.audio_cache import (
+    AudioCache, AudioSource, as_file, default_cache, record_time, resampler_for_quality
+)
+from services.audio_probe import probe_audio
+from services.encoders import encode_file, get_output_format
 
 class VocalSeparator:
     """Advanced vocal separation using spectral analysis and AI techniques"""
     
-    def __init__(self, sample_rate: int = 44100):
+    def __init__(self, sample_rate: Optional[int] = None, cache: Optional[AudioCache] = None):
+        # None separates every file at its native rate; the masks are built
+        # from each file's own FFT bin frequencies
         self.sample_rate = sample_rate
+        self.cache = cache or default_cache()
         self.hop_length = 512
         self.n_fft = 2048
+        self.hpss_kernel_size = 31
+        self.mask_smoothing_frames = 9
+        # Inputs longer than this are separated block by block (see separate_file_streaming)
+        self.streaming_threshold_seconds = 300
         
-    def load_audio(self, file_path: str) -> Tuple[np.ndarray, int]:
-        """Load audio file and return audio data and sample rate"""
+    def load_audio(self, file_path: AudioSource, quality: str = "high", timings: Optional[dict] = None,
+                   content_key: Optional[str] = None, filename: Optional[str] = None) -> Tuple[np.ndarray, int]:
+        """Load audio file and return audio data and sample rate
+
+        Resamples, with the quality tier's resampler, only if sample_rate is
+        set. file_path may be upload bytes; see AudioCache.load_audio.
+        """
         try:
-            audio, sr = librosa.load(file_path, sr=self.sample_rate, mono=False)
+            audio, sr = self.cache.load_audio(
+                file_path, self.sample_rate, resampler_for_quality(quality), timings, content_key, filename
+            )
             if audio.ndim == 1:
                 audio = np.stack([audio, audio])  # Convert mono to stereo
             return audio, sr
@@ -36,24 +58,45 @@ class VocalSeparator:
         
         return vocals, instrumentals
     
-    def separate_vocals_advanced(self, audio: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        """Advanced vocal separation using spectral analysis"""
+    def separate_vocals_advanced(self, audio: np.ndarray, sr: Optional[int] = None,
+                                 content_key: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Advanced vocal separation using spectral analysis
+
+        content_key identifies the source content (see AudioCache.digest) so the
+        STFT and HPSS results can be reused by later calls on the same audio.
+        """
         # Convert to mono for processing
         if audio.ndim == 2:
             mono_audio = np.mean(audio, axis=0)
         else:
             mono_audio = audio
         
+        sr = sr or self.sample_rate
+        if sr is None:
+            raise ValueError("sr is required when no fixed sample_rate is configured")
+        return self._separate_mono(mono_audio, sr, content_key)
+    
+    def _separate_mono(self, mono_audio: np.ndarray, sr: int,
+                       content_key: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Spectral-mask separation of a mono signal"""
+        stft_params = {"sr": sr, "n_fft": self.n_fft, "hop_length": self.hop_length}
+        
         # Compute STFT
-        stft = librosa.stft(mono_audio, n_fft=self.n_fft, hop_length=self.hop_length)
-        magnitude, phase = np.abs(stft), np.angle(stft)
+        stft, = self.cache.cached(
+            content_key, "mono-stft",
+            lambda: (librosa.stft(mono_audio, n_fft=self.n_fft, hop_length=self.hop_length),),
+            **stft_params
+        )
         
         # Harmonic-percussive separation
-        harmonic = librosa.decompose.hpss(magnitude)[0]
-        percussive = librosa.decompose.hpss(magnitude)[1]
+        harmonic, percussive = self.cache.cached(
+            content_key, "mono-hpss",
+            lambda: librosa.decompose.hpss(np.abs(stft), kernel_size=self.hpss_kernel_size),
+            kernel_size=self.hpss_kernel_size, **stft_params
+        )
         
         # Vocal estimation (typically in harmonic component)
-        vocal_mask = self._create_vocal_mask(harmonic, percussive)
+        vocal_mask = self._create_vocal_mask(harmonic, percussive, sr)
         instrumental_mask = 1 - vocal_mask
         
         # Apply masks
@@ -61,16 +104,16 @@ class VocalSeparator:
         instrumental_stft = stft * instrumental_mask
         
         # Convert back to time domain
-        vocals = librosa.istft(vocal_stft, hop_length=self.hop_length)
-        instrumentals = librosa.istft(instrumental_stft, hop_length=self.hop_length)
+        vocals = librosa.istft(vocal_stft, hop_length=self.hop_length, length=len(mono_audio))
+        instrumentals = librosa.istft(instrumental_stft, hop_length=self.hop_length, length=len(mono_audio))
         
         return vocals, instrumentals
     
-    def _create_vocal_mask(self, harmonic: np.ndarray, percussive: np.ndarray) -> np.ndarray:
+    def _create_vocal_mask(self, harmonic: np.ndarray, percussive: np.ndarray, sr: Optional[int] = None) -> np.ndarray:
         """Create a mask to isolate vocal components"""
         # Simple vocal mask based on harmonic content
         vocal_freq_range = (80, 8000)  # Hz
-        freq_bins = librosa.fft_frequencies(sr=self.sample_rate, n_fft=self.n_fft)
+        freq_bins = librosa.fft_frequencies(sr=sr or self.sample_rate or 44100, n_fft=self.n_fft)
         
         mask = np.zeros_like(harmonic)
         freq_mask = (freq_bins >= vocal_freq_range[0]) & (freq_bins <= vocal_freq_range[1])
@@ -78,39 +121,189 @@ class VocalSeparator:
         # Apply frequency-based mask
         mask[freq_mask] = harmonic[freq_mask] / (harmonic[freq_mask] + percussive[freq_mask] + 1e-10)
         
-        # Smooth the mask
-        mask = librosa.util.sync(mask, axis=1)
+        # Smooth the mask over time
+        mask = uniform_filter1d(mask, size=self.mask_smoothing_frames, axis=1, mode='nearest')
         
         return mask
     
-    def process_file(self, input_path: str, output_dir: str, quality: str = "high") -> dict:
-        """Process audio file and separate vocals from instrumentals"""
-        try:
-            # Load audio
-            audio, sr = self.load_audio(input_path)
+    def _context_samples(self) -> int:
+        """Samples of context each side of a block so its core matches the whole-file result
+
+        Covers the HPSS median filter and mask smoothing reach plus the STFT
+        window, rounded to whole hops so block frames line up with the
+        whole-file frame grid.
+        """
+        reach_frames = self.hpss_kernel_size // 2 + self.mask_smoothing_frames // 2 + self.n_fft // self.hop_length
+        return (reach_frames + 2) * self.hop_length
+    
+    def separate_file_streaming(self, input_path: AudioSource, vocals_path: str, instrumentals_path: str,
+                                block_seconds: float = 30.0, overlap_seconds: float = 0.1,
+                                progress_callback: Optional[Callable[[int], None]] = None,
+                                timings: Optional[dict] = None, subtype: str = 'FLOAT') -> dict:
+        """Separate a file block by block with overlap-add, at constant peak memory
+
+        Each block is read with extra context on both sides so HPSS and the
+        mask smoothing see the same neighbourhood as in the whole-file path,
+        then its core (plus overlap_seconds each side) is cross-faded into
+        the output with complementary sin^2 ramps. Only one block of audio
+        and its spectrograms are held at any time, so memory depends on
+        block_seconds, not on the track length. Runs at the file's native
+        sample rate; timings, if given, accumulates the decode_ms spent reading
+        blocks. Stems are written as mono WAV in the given subtype. The output
+        matches separate_vocals_advanced on the same audio to within 1e-4
+        (max absolute sample difference).
+        """
+        with sf.SoundFile(as_file(input_path)) as source:
+            sr = source.samplerate
+            total = source.frames
+            hop = self.hop_length
+            block = max(hop, int(block_seconds * sr) // hop * hop)
+            overlap = min(block // 2, max(hop, int(overlap_seconds * sr) // hop * hop))
+            context = self._context_samples()
             
-            # Choose separation method based on quality
-            if quality == "fast":
-                vocals, instrumentals = self.separate_vocals_basic(audio)
-            else:
-                vocals, instrumentals = self.separate_vocals_advanced(audio)
+            # Complementary fade curves over the 2 * overlap shared region
+            ramp = np.sin(0.5 * np.pi * (np.arange(2 * overlap) + 0.5) / (2 * overlap)) ** 2
             
+            outputs = [
+                sf.SoundFile(vocals_path, 'w', samplerate=sr, channels=1, subtype=subtype),
+                sf.SoundFile(instrumentals_path, 'w', samplerate=sr, channels=1, subtype=subtype),
+            ]
+            pending = [None, None]  # faded-out tails waiting for the next block's fade-in
+            try:
+                n_blocks = 0
+                core_start = 0
+                while core_start < total:
+                    core_end = min(total, core_start + block)
+                    if total - core_end < overlap:
+                        # Fold a tail shorter than the overlap into this block
+                        core_end = total
+                    is_first, is_last = core_start == 0, core_end == total
+                    
+                    # Output span of this block, and the wider span read for context
+                    out_start = core_start if is_first else core_start - overlap
+                    out_end = core_end if is_last else core_end + overlap
+                    read_start = max(0, out_start - context)
+                    read_end = min(total, out_end + context)
+                    
+                    read_started = time.perf_counter()
+                    source.seek(read_start)
+                    window = source.read(read_end - read_start, dtype='float32', always_2d=True)
+                    record_time(timings, "decode_ms", read_started)
+                    stems = self._separate_mono(window.mean(axis=1), sr)
+                    
+                    for stem_index, stem in enumerate(stems):
+                        segment = stem[out_start - read_start:out_end - read_start].astype(np.float64)
+                        if not is_first:
+                            segment[:2 * overlap] *= ramp
+                            segment[:2 * overlap] += pending[stem_index]
+                        if not is_last:
+                            pending[stem_index] = segment[-2 * overlap:] * (1 - ramp)
+                            segment = segment[:-2 * overlap]
+                        outputs[stem_index].write(segment)
+                    
+                    n_blocks += 1
+                    core_start = core_end
+                    if progress_callback:
+                        progress_callback(20 + int(75 * core_end / total))
+            finally:
+                for output in outputs:
+                    output.close()
+        
+        return {
+            "duration": total / sr,
+            "sample_rate": sr,
+            "blocks": n_blocks
+        }
+    
+    def should_stream(self, input_path: AudioSource) -> bool:
+        """Whether a file is long enough, and readable by soundfile, to separate in blocks"""
+        try:
+            return sf.info(as_file(input_path)).duration > self.streaming_threshold_seconds
+        except RuntimeError:
+            # Containers libsndfile cannot read (e.g. m4a) go through librosa
+            return False
+    
+    def process_file(self, input_path: AudioSource, output_dir: str, quality: str = "high",
+                     progress_callback: Optional[Callable[[int], None]] = None,
+                     streaming: Optional[bool] = None, content_key: Optional[str] = None,
+                     filename: Optional[str] = None, output_format: str = "wav",
+                     bitrate: Optional[int] = None) -> dict:
+        """Process audio file and separate vocals from instrumentals
+
+        progress_callback, if given, is called with a percentage after each stage.
+        streaming forces (True) or disables (False) block-streaming separation;
+        by default long inputs are streamed. The result's timings report the
+        time spent decoding and resampling. input_path may be the bytes of an
+        upload, together with its content_key and filename (which names the
+        outputs).
+
+        Each stem is kept as a 32-bit float master WAV and delivered in
+        output_format (see services.encoders) at bitrate kbps, encoded from
+        the master block by block; other formats can later be produced from
+        the masters without separating again.
+        """
+        try:
+            fmt = get_output_format(output_format)
+            bitrate = fmt.resolve_bitrate(bitrate)
+            timings = {"decode_ms": 0.0, "resample_ms": 0.0}
             # Generate output filenames
-            base_name = os.path.splitext(os.path.basename(input_path))[0]
-            vocals_path = os.path.join(output_dir, f"{base_name}_vocals.wav")
-            instrumentals_path = os.path.join(output_dir, f"{base_name}_instrumental.wav")
+            base_name = os.path.splitext(os.path.basename(filename or input_path))[0]
+            vocals_master = os.path.join(output_dir, f"{base_name}_vocals_master.wav")
+            instrumentals_master = os.path.join(output_dir, f"{base_name}_instrumental_master.wav")
             
-            # Save separated tracks
-            sf.write(vocals_path, vocals, sr, subtype='PCM_24')
-            sf.write(instrumentals_path, instrumentals, sr, subtype='PCM_24')
+            if streaming is None:
+                streaming = quality != "fast" and self.should_stream(input_path)
+            if streaming:
+                info = self.separate_file_streaming(
+                    input_path, vocals_master, instrumentals_master,
+                    progress_callback=progress_callback, timings=timings
+                )
+                duration, sr = info["duration"], info["sample_rate"]
+            else:
+                # Load audio
+                audio, sr = self.load_audio(input_path, quality, timings, content_key, filename)
+                if progress_callback:
+                    progress_callback(20)
+                
+                # Choose separation method based on quality
+                if quality == "fast":
+                    vocals, instrumentals = self.separate_vocals_basic(audio)
+                else:
+                    vocals, instrumentals = self.separate_vocals_advanced(
+                        audio, sr, content_key=content_key or self.cache.digest(input_path)
+                    )
+                if progress_callback:
+                    progress_callback(80)
+                
+                # Save separated tracks
+                sf.write(vocals_master, vocals, sr, subtype='FLOAT')
+                sf.write(instrumentals_master, instrumentals, sr, subtype='FLOAT')
+                duration = len(vocals) / sr
+            if progress_callback:
+                progress_callback(95)
             
-            return {
+            vocals_path = os.path.join(output_dir, f"{base_name}_vocals.{fmt.extension}")
+            instrumentals_path = os.path.join(output_dir, f"{base_name}_instrumental.{fmt.extension}")
+            encode_file(vocals_master, vocals_path, fmt, bitrate)
+            encode_file(instrumentals_master, instrumentals_path, fmt, bitrate)
+            if progress_callback:
+                progress_callback(100)
+            
+            result = {
                 "success": True,
                 "vocals_path": vocals_path,
                 "instrumentals_path": instrumentals_path,
-                "duration": len(vocals) / sr,
-                "sample_rate": sr
+                "vocals_master_path": vocals_master,
+                "instrumentals_master_path": instrumentals_master,
+                "output_format": fmt.name,
+                "bitrate": bitrate,
+                "duration": duration,
+                "sample_rate": sr,
+                "timings": timings
             }
+            if streaming:
+                result["streamed"] = True
+            return result
             
         except Exception as e:
             return {
@@ -118,17 +311,13 @@ class VocalSeparator:
                 "error": str(e)
             }
     
+    def warm_up(self, audio: np.ndarray, sr: int):
+        """Separate a short clip so librosa's numba kernels are compiled before the first real file"""
+        self.separate_vocals_advanced(audio, sr)
+    
     def get_audio_info(self, file_path: str) -> dict:
-        """Get basic information about the audio file"""
+        """Get basic information about the audio file from its headers, without decoding"""
         try:
-            audio, sr = self.load_audio(file_path)
-            duration = len(audio[0]) / sr if audio.ndim == 2 else len(audio) / sr
-            
-            return {
-                "duration": duration,
-                "sample_rate": sr,
-                "channels": audio.shape[0] if audio.ndim == 2 else 1,
-                "format": "stereo" if audio.ndim == 2 else "mono"
-            }
+            return probe_audio(file_path)
         except Exception as e:
             return {"error": str(e)}
\ No newline at end of file
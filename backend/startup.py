@@ -0,0 +1,92 @@
+import os
+import time
+from typing import Dict, Optional
+
+# Probe endpoints; polled from the moment the server listens, so they say
+# nothing about how long real work waits after a cold start
+PROBE_ENDPOINTS = ("health_check", "liveness", "readiness")
+
+
+def process_started() -> Optional[float]:
+    """perf_counter() reading at which this process started, from /proc; None where there is no /proc"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesised command name start at field 3; starttime is field 22
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+    return time.perf_counter() - age
+
+
+class StartupMonitor:
+    """Cold-start timings of the API process and the latency of its first requests
+
+    Phases are marked as they end ("imported", "started", "ready") and
+    reported in seconds since the process started, interpreter start
+    included where /proc says when that was. The first request to each
+    endpoint is timed to its response headers.
+    """
+
+    def __init__(self):
+        measured = process_started()
+        self.origin = measured if measured is not None else time.perf_counter()
+        self.origin_source = "process" if measured is not None else "monitor"
+        self.marks: Dict[str, float] = {}
+        self.first_requests: Dict[str, dict] = {}
+
+    def mark(self, phase: str):
+        self.marks[phase] = round(time.perf_counter() - self.origin, 3)
+
+    def record_request(self, endpoint: str, seconds: float):
+        """Keep the latency of endpoint's first request"""
+        if endpoint in self.first_requests:
+            return
+        self.first_requests[endpoint] = {
+            "latency_ms": round(seconds * 1000, 1),
+            "at_seconds": round(time.perf_counter() - self.origin, 3),
+            "before_ready": "ready" not in self.marks,
+        }
+
+    def report(self) -> dict:
+        work = {name: timing for name, timing in self.first_requests.items() if name not in PROBE_ENDPOINTS}
+        first = min(work.items(), key=lambda item: item[1]["at_seconds"], default=None)
+        return {
+            "measured_from": self.origin_source,
+            "uptime_seconds": round(time.perf_counter() - self.origin, 3),
+            **{f"{phase}_seconds": seconds for phase, seconds in self.marks.items()},
+            "first_request": {"endpoint": first[0], **first[1]} if first else None,
+            "first_requests": self.first_requests,
+        }
+
+
+class FirstRequestMiddleware:
+    """ASGI middleware timing each endpoint's first request into a StartupMonitor
+
+    Plain ASGI rather than BaseHTTPMiddleware, so streamed responses pass
+    through untouched; after the first request per endpoint it costs a
+    dict lookup.
+    """
+
+    def __init__(self, app, monitor: StartupMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                # The router has put the matched endpoint into the shared scope by now
+                endpoint = scope.get("endpoint")
+                if endpoint is not None:
+                    self.monitor.record_request(endpoint.__name__, time.perf_counter() - started)
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
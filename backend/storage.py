@@ -0,0 +1,241 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from manifests import MANIFEST_NAME
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+class SessionUsage:
+    def __init__(self, size: int, files: int, last_access: float):
+        self.size = size
+        self.files = files
+        self.last_access = last_access
+
+
+class StorageJanitor:
+    """Evicts session outputs by TTL and total-bytes quota, least recently downloaded first
+
+    Sessions are tracked in an in-memory index (sizes come from their
+    manifests) ordered by last access, so a sweep only looks at the index.
+    The output and upload directories are listed, one level deep, once at
+    startup and then every orphan_scan_every sweeps to catch directories
+    that never made it into the index: failed jobs, leaked uploads, and
+    outputs left over from before a restart. Sweeps run in the threadpool
+    so deletions never block request handling.
+    """
+
+    def __init__(self, output_dir: str, upload_dir: str,
+                 ttl_seconds: Optional[float] = None, max_bytes: Optional[int] = None,
+                 interval_seconds: Optional[float] = None, orphan_scan_every: int = 12,
+                 is_active: Optional[Callable[[str], bool]] = None,
+                 on_evict: Optional[Callable[[str], None]] = None,
+                 on_sweep: Optional[Callable[[float], None]] = None):
+        self.output_dir = output_dir
+        self.upload_dir = upload_dir
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else \
+            _env_float("ODOREMOVER_OUTPUT_TTL_HOURS", 24) * 3600
+        self.max_bytes = max_bytes if max_bytes is not None else \
+            int(_env_float("ODOREMOVER_OUTPUT_QUOTA_MB", 10240)) << 20
+        self.interval_seconds = interval_seconds if interval_seconds is not None else \
+            _env_float("ODOREMOVER_JANITOR_INTERVAL_S", 300)
+        self.orphan_scan_every = orphan_scan_every
+        # Sessions whose job is still running are never treated as orphans
+        self.is_active = is_active or (lambda session_id: False)
+        # Called with each evicted storage id, e.g. to drop cached manifests
+        self.on_evict = on_evict
+        # Called after each sweep with the TTL cutoff (a time.time() value),
+        # e.g. to drop records of results that have expired
+        self.on_sweep = on_sweep
+        self._sessions: "OrderedDict[str, SessionUsage]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._sweeps = 0
+        self._task: Optional[asyncio.Task] = None
+        self._metrics = {
+            "evicted_sessions": 0,
+            "evicted_files": 0,
+            "evicted_bytes": 0,
+            "orphans_removed": 0,
+            "leaked_uploads_removed": 0,
+            "sweeps": 0,
+            "last_sweep_ms": 0.0,
+            "last_sweep_at": None,
+        }
+
+    # Index maintenance, called from request handlers
+
+    def track(self, storage_id: str, manifest: dict):
+        """Add a finished session to the index, sized from its manifest"""
+        artifacts = manifest.get("artifacts", {})
+        size = sum(entry["size"] for entry in artifacts.values())
+        self._add(storage_id, SessionUsage(size, len(artifacts) + 1, time.time()))
+
+    def touch(self, storage_id: str):
+        """Record a download, moving the session to the back of the eviction order"""
+        with self._lock:
+            usage = self._sessions.get(storage_id)
+            if usage is not None:
+                usage.last_access = time.time()
+                self._sessions.move_to_end(storage_id)
+
+    def forget(self, storage_id: str):
+        """Drop a session removed by other means (e.g. an explicit cleanup)"""
+        with self._lock:
+            usage = self._sessions.pop(storage_id, None)
+            if usage is not None:
+                self._bytes -= usage.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                self._metrics,
+                bytes_used=self._bytes,
+                sessions=len(self._sessions),
+                quota_bytes=self.max_bytes,
+                ttl_seconds=self.ttl_seconds,
+            )
+
+    def _add(self, storage_id: str, usage: SessionUsage):
+        with self._lock:
+            previous = self._sessions.pop(storage_id, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._sessions[storage_id] = usage
+            self._bytes += usage.size
+
+    # Background task
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        await run_in_threadpool(self.scan)
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await run_in_threadpool(self.sweep)
+            except Exception:
+                # A failed sweep (e.g. a permission error) must not end the janitor
+                pass
+
+    # Blocking work, run in the threadpool
+
+    def scan(self):
+        """Index session directories that have a manifest and remove stale orphans
+
+        Reads one manifest per session directory; never walks deeper.
+        """
+        now = time.time()
+        try:
+            entries: List[os.DirEntry] = list(os.scandir(self.output_dir))
+        except FileNotFoundError:
+            entries = []
+        with self._lock:
+            known = set(self._sessions)
+        for entry in entries:
+            if not entry.is_dir() or entry.name in known or self.is_active(entry.name):
+                continue
+            manifest_path = os.path.join(entry.path, MANIFEST_NAME)
+            try:
+                stat = os.stat(manifest_path)
+                size, files = self._directory_usage(entry.path)
+                self._add(entry.name, SessionUsage(size, files, stat.st_mtime))
+            except FileNotFoundError:
+                # No manifest: a failed or abandoned job. Keep it while it may
+                # still be running, then remove it.
+                if now - entry.stat().st_mtime > self.ttl_seconds:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    self._count("orphans_removed")
+        self._remove_leaked_uploads(now)
+        with self._lock:
+            self._resort()
+
+    def sweep(self):
+        """Evict expired sessions, then least recently used ones until under quota"""
+        started = time.perf_counter()
+        self._sweeps += 1
+        if self._sweeps % self.orphan_scan_every == 0:
+            self.scan()
+
+        now = time.time()
+        victims: Dict[str, SessionUsage] = {}
+        with self._lock:
+            projected = self._bytes
+            for storage_id, usage in self._sessions.items():
+                if now - usage.last_access > self.ttl_seconds or projected > self.max_bytes:
+                    victims[storage_id] = usage
+                    projected -= usage.size
+                else:
+                    # Ordered by last access: everything after this is newer and fits
+                    break
+            for storage_id in victims:
+                self._bytes -= self._sessions.pop(storage_id).size
+
+        for storage_id, usage in victims.items():
+            shutil.rmtree(os.path.join(self.output_dir, storage_id), ignore_errors=True)
+            if self.on_evict:
+                self.on_evict(storage_id)
+            with self._lock:
+                self._metrics["evicted_sessions"] += 1
+                self._metrics["evicted_files"] += usage.files
+                self._metrics["evicted_bytes"] += usage.size
+
+        if self.on_sweep:
+            self.on_sweep(now - self.ttl_seconds)
+
+        with self._lock:
+            self._metrics["sweeps"] += 1
+            self._metrics["last_sweep_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self._metrics["last_sweep_at"] = now
+
+    def _remove_leaked_uploads(self, now: float):
+        """Delete spooled uploads no request has owned for longer than the TTL"""
+        try:
+            entries = list(os.scandir(self.upload_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_file() and now - entry.stat().st_mtime > self.ttl_seconds:
+                    os.remove(entry.path)
+                    self._count("leaked_uploads_removed")
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _directory_usage(path: str):
+        size = files = 0
+        for entry in os.scandir(path):
+            if entry.is_file():
+                size += entry.stat().st_size
+                files += 1
+        return size, files
+
+    def _resort(self):
+        """Restore last-access order after scan() added sessions with old timestamps"""
+        ordered = sorted(self._sessions.items(), key=lambda item: item[1].last_access)
+        self._sessions = OrderedDict(ordered)
+
+    def _count(self, metric: str):
+        with self._lock:
+            self._metrics[metric] += 1
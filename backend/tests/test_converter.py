@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+
+import numpy as np
+import soundfile as sf
+
+from services.converter import ConverterService, TranscoderPool
+
+# Stands in for ffmpeg: consumes stdin and writes 3 MB to stdout, far more
+# than the pipe and the stream reader buffer between them
+STAND_IN = f"""#!{sys.executable}
+import sys
+sys.stdin.buffer.read()
+for _ in range(48):
+    sys.stdout.buffer.write(bytes(65536))
+    sys.stdout.buffer.flush()
+"""
+
+
+# Stands in for ffmpeg writing WAV to a pipe: open-ended RIFF and data
+# sizes, and a LIST/INFO chunk (from -map_metadata) whose title says "data"
+PIPED_WAV = f"""#!{sys.executable}
+import struct, sys
+sys.stdin.buffer.read()
+title = b"Metadata\\0\\0"
+info = b"INFO" + b"INAM" + struct.pack("<I", len(title)) + title
+out = sys.stdout.buffer
+out.write(b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE")
+out.write(b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, 8000, 16000, 2, 16))
+out.write(b"LIST" + struct.pack("<I", len(info)) + info)
+out.write(b"data" + struct.pack("<I", 0xFFFFFFFF) + bytes(2 * 8000))
+"""
+
+
+def stand_in(tmp_path, script: str) -> str:
+    binary = tmp_path / "ffmpeg"
+    binary.write_text(script)
+    binary.chmod(0o755)
+    return str(binary)
+
+
+def open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_abandoned_stream_is_cleaned_up(tmp_path):
+    pool = TranscoderPool(max_workers=1, binary=stand_in(tmp_path, STAND_IN))
+
+    async def abandon():
+        before = open_fds()
+        stream = pool.stream(pool.job(b"RIFF" + bytes(1024), "wav"))
+        assert await anext(stream)
+        # Let the stand-in fill every buffer so stdout is paused
+        await asyncio.sleep(0.5)
+        await asyncio.wait_for(stream.aclose(), 5)
+        return before, open_fds()
+
+    before, after = asyncio.run(abandon())
+    stats = pool.stats()
+    assert stats["running"] == 0
+    assert stats["cancelled"] == 1
+    assert after <= before
+
+
+def test_converted_wav_is_sealed_past_its_tags(tmp_path):
+    source = tmp_path / "in.wav"
+    sf.write(str(source), np.zeros(8000, dtype=np.float32), 8000)
+    converter = ConverterService(TranscoderPool(max_workers=1, binary=stand_in(tmp_path, PIPED_WAV)))
+
+    result = asyncio.run(converter.process(str(source), str(tmp_path / "out.wav"), {"output_format": "wav"}))
+
+    assert result["success"], result
+    assert result["metadata"]["duration"] == 1.0
+    info = sf.info(str(tmp_path / "out.wav"))
+    assert info.frames == 8000
+    with open(tmp_path / "out.wav", "rb") as f:
+        assert b"Metadata" in f.read(128)
+
+
+def test_conversion_without_ffmpeg_fails(tmp_path):
+    source = tmp_path / "in.wav"
+    sf.write(str(source), np.zeros(800, dtype=np.float32), 8000)
+    converter = ConverterService(TranscoderPool(binary=str(tmp_path / "missing")))
+
+    result = asyncio.run(converter.process(str(source), str(tmp_path / "out.mp3"), {}))
+
+    assert not converter.available
+    assert not result["success"]
+    assert "not installed" in result["error"]
@@ -0,0 +1,75 @@
+import importlib
+import io
+import json
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from batches import Batch, BatchItem
+from jobs import JobStore, SQLiteJobStore
+from models import ProcessingStatus
+from storage import StorageJanitor
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return JobStore() if request.param == "memory" else SQLiteJobStore(str(tmp_path / "jobs.db"))
+
+
+def test_prune_drops_only_jobs_finished_before_the_cutoff(store):
+    now = datetime.utcnow()
+    old = store.create("vocal_remover", "a.wav", {})
+    recent = store.create("vocal_remover", "b.wav", {})
+    running = store.create("vocal_remover", "c.wav", {})
+    store.update(old.id, status=ProcessingStatus.COMPLETED, completed_at=now - timedelta(hours=25))
+    store.update(recent.id, status=ProcessingStatus.FAILED, completed_at=now - timedelta(hours=1))
+    store.update(running.id, status=ProcessingStatus.PROCESSING)
+
+    assert store.prune(now - timedelta(hours=24)) == 1
+    assert store.get(old.id) is None
+    assert store.get(recent.id) is not None
+    assert store.get(running.id) is not None
+
+
+def test_janitor_reports_the_ttl_cutoff_after_each_sweep(tmp_path):
+    cutoffs = []
+    janitor = StorageJanitor(str(tmp_path / "outputs"), str(tmp_path / "uploads"),
+                             ttl_seconds=3600, on_sweep=cutoffs.append)
+    (tmp_path / "outputs").mkdir()
+    (tmp_path / "uploads").mkdir()
+
+    janitor.sweep()
+
+    assert len(cutoffs) == 1
+    assert abs(cutoffs[0] - (time.time() - 3600)) < 60
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    # main creates its upload and output directories in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("ODOREMOVER_JOB_DB", raising=False)
+    import main
+    return importlib.reload(main)
+
+
+def test_batch_download_after_its_jobs_were_pruned(api):
+    store = api.job_manager.store
+    job = store.create("vocal_remover", "a.wav", {})
+    store.update(job.id, status=ProcessingStatus.COMPLETED, completed_at=datetime.utcnow() - timedelta(hours=25))
+    batch = api.batches.add(Batch("pruned", "vocal_remover", [
+        BatchItem(0, "a.wav", job_id=job.id),
+        BatchItem(1, "b.txt", error="Unsupported file format"),
+    ]))
+    api.prune_jobs(time.time() - 24 * 3600)
+
+    response = TestClient(api.app).get(f"/api/batch/{batch.id}/download")
+
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        summary = json.loads(archive.read("batch.json"))
+    assert [item["status"] for item in summary["items"]] == ["expired", "rejected"]
+    assert summary["items"][0]["files"] == []
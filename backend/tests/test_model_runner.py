@@ -0,0 +1,114 @@
+import threading
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from services.model_runner import ModelRunner, model_stems
+from services.vocal_remover import VocalRemoverService
+
+SAMPLE_RATE = 44100
+
+
+@pytest.fixture
+def make_runner():
+    runners = []
+
+    def make(**options) -> ModelRunner:
+        runner = ModelRunner(workers=2, backend="spectral", **options)
+        runners.append(runner)
+        return runner
+
+    yield make
+    for runner in runners:
+        runner.shutdown()
+
+
+def write_mix(path, seconds: float) -> np.ndarray:
+    """A stereo test signal: a centred tone over uncorrelated noise, (frames, channels)"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = 0.3 * np.sin(2 * np.pi * 440 * t)
+    mix = (tone[:, None] + 0.1 * rng.standard_normal((len(t), 2))).astype(np.float32)
+    sf.write(str(path), mix, SAMPLE_RATE, subtype="FLOAT")
+    return mix
+
+
+def run_in_thread(target, timeout: float = 60):
+    """target's result, failing the test if it has not returned within timeout seconds"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = target()
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"no result after {timeout}s"
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+@pytest.mark.parametrize("model", ["2stems", "4stems"])
+def test_stems_sum_back_to_the_mix_at_its_length(tmp_path, make_runner, model):
+    # Not a whole number of segments, so the last one is padded and trimmed
+    mix = write_mix(tmp_path / "mix.wav", 9.3)
+    output = tmp_path / "out.wav"
+
+    result = VocalRemoverService(make_runner()).separate_file(str(tmp_path / "mix.wav"), str(output), model)
+
+    stems = {stem: sf.read(path, always_2d=True)[0] for stem, path in result["stem_paths"].items()}
+    assert set(stems) == set(model_stems(model))
+    for audio in stems.values():
+        assert audio.shape == mix.shape
+    assert np.abs(sum(stems.values()) - mix).max() < 1e-3
+    # The output is everything but the vocals
+    instrumental = sf.read(str(output), always_2d=True)[0]
+    assert np.abs(instrumental + stems["vocals"] - mix).max() < 1e-3
+
+
+def test_concurrent_requests_share_batches(make_runner):
+    runner = make_runner(max_batch=8, batch_wait_ms=500)
+    segment = int(runner.model("2stems").segment_seconds * SAMPLE_RATE)
+    results = [None] * 6
+
+    def request(slot: int):
+        # One segment per request: a batch of more than one mixes requests
+        segments = [np.full((2, segment), 0.01 * (slot + 1), dtype=np.float32)]
+        results[slot] = list(runner.separate("2stems", segments))
+
+    threads = [threading.Thread(target=request, args=(slot,)) for slot in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+    for slot, separated in enumerate(results):
+        assert len(separated) == 1
+        # Each request gets its own segment back
+        assert np.allclose(separated[0].sum(axis=0), 0.01 * (slot + 1), atol=1e-4)
+    stats = runner.stats()
+    assert stats["segments"] == len(results)
+    assert stats["mean_batch_size"] > 1
+
+
+def test_dead_worker_raises_instead_of_hanging(make_runner):
+    runner = make_runner(max_batch=1)
+    segment = np.zeros((2, int(runner.model("2stems").segment_seconds * SAMPLE_RATE)), dtype=np.float32)
+
+    def segments():
+        yield segment
+        # Every worker dies while the request still has segments to run
+        for process in runner._processes:
+            process.kill()
+            process.join()
+        for _ in range(4):
+            yield segment
+
+    with pytest.raises(RuntimeError, match="worker died"):
+        run_in_thread(lambda: list(runner.separate("2stems", segments())))
+    assert runner.stats()["worker_restarts"] == 1
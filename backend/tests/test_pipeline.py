@@ -0,0 +1,23 @@
+import numpy as np
+import soundfile as sf
+
+from services.audio_cache import AudioCache
+from services.pipeline import Pipeline
+
+# Gain and normalize run as two passes, so the first pass's output is a cached prefix
+STEPS = [{"tool": "gain", "gain_db": -6}, {"tool": "normalize", "peak_db": -1}]
+
+
+def test_prefixes_stay_in_memory(tmp_path):
+    source = tmp_path / "in.wav"
+    sf.write(str(source), np.random.default_rng(0).uniform(-0.5, 0.5, (4410, 2)).astype(np.float32), 44100)
+    cache = AudioCache(cache_dir=str(tmp_path / "cache"))
+    pipeline = Pipeline(cache=cache)
+
+    first = pipeline.process_file(str(source), str(tmp_path / "first.wav"), STEPS)
+    second = pipeline.process_file(str(source), str(tmp_path / "second.wav"), STEPS)
+
+    assert first["success"] and second["success"]
+    assert second["cached_steps"] == 1
+    # Only the decode reaches the disk tier
+    assert len(list((tmp_path / "cache").iterdir())) == 1
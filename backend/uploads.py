@@ -0,0 +1,107 @@
+import io
+import os
+from typing import BinaryIO, Optional, Union
+
+from fastapi import UploadFile
+
+from services.audio_cache import content_hasher
+
+CHUNK_BYTES = 1 << 20
+
+
+def _megabytes_env(name: str, default: int) -> int:
+    return int(os.environ.get(name, default)) << 20
+
+
+# Uploads above MAX_UPLOAD_BYTES are rejected; uploads up to
+# MEMORY_UPLOAD_BYTES are handed to the workers as bytes and decoded from
+# memory, larger ones are written to the upload directory exactly once
+MAX_UPLOAD_BYTES = _megabytes_env("ODOREMOVER_MAX_UPLOAD_MB", 500)
+MEMORY_UPLOAD_BYTES = _megabytes_env("ODOREMOVER_MEMORY_UPLOAD_MB", 32)
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeds the configured size limit"""
+
+
+class IngestedUpload:
+    """An upload read once, hashed, and kept in memory or in a single spool file"""
+
+    def __init__(self, filename: str, content_hash: str, size: int,
+                 data: Optional[bytes] = None, path: Optional[str] = None):
+        self.filename = filename
+        self.content_hash = content_hash
+        self.size = size
+        self.data = data
+        self.path = path
+
+    @property
+    def in_memory(self) -> bool:
+        return self.data is not None
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        """What processors take as their input: the bytes, or the spooled path"""
+        return self.data if self.data is not None else self.path
+
+    def open(self) -> BinaryIO:
+        return io.BytesIO(self.data) if self.data is not None else open(self.path, "rb")
+
+    def release(self):
+        """Drop the buffered bytes or delete the spool file"""
+        self.data = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def ingest_upload(file: UploadFile, spool_path: str, max_bytes: Optional[int] = None,
+                  memory_bytes: Optional[int] = None) -> IngestedUpload:
+    """Read an upload once, hashing it and enforcing max_bytes as it streams
+
+    Uploads of at most memory_bytes stay in memory; larger ones are written
+    to spool_path as they are read, so no stage ever copies them again.
+    Raises UploadTooLarge, leaving nothing behind, when the limit is hit.
+    Blocking; call it through run_in_threadpool from async endpoints.
+    """
+    return ingest_stream(file.file, file.filename, spool_path, file.size, max_bytes, memory_bytes)
+
+
+def ingest_stream(stream: BinaryIO, filename: str, spool_path: str, declared_size: Optional[int] = None,
+                  max_bytes: Optional[int] = None, memory_bytes: Optional[int] = None) -> IngestedUpload:
+    """ingest_upload for any readable stream, e.g. a member of an uploaded archive"""
+    max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    memory_bytes = MEMORY_UPLOAD_BYTES if memory_bytes is None else memory_bytes
+    if declared_size is not None and declared_size > max_bytes:
+        raise UploadTooLarge(f"Upload exceeds the {max_bytes >> 20} MB limit")
+
+    hasher = content_hasher()
+    chunks = []
+    size = 0
+    spool = None
+    try:
+        # Spool straight away when the declared size already rules out memory
+        if declared_size is not None and declared_size > memory_bytes:
+            spool = open(spool_path, "wb")
+        for chunk in iter(lambda: stream.read(CHUNK_BYTES), b""):
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {max_bytes >> 20} MB limit")
+            hasher.update(chunk)
+            if spool is None and size > memory_bytes:
+                spool = open(spool_path, "wb")
+                spool.writelines(chunks)
+                chunks = []
+            if spool is None:
+                chunks.append(chunk)
+            else:
+                spool.write(chunk)
+    except BaseException:
+        if spool is not None:
+            spool.close()
+            os.remove(spool_path)
+        raise
+
+    if spool is not None:
+        spool.close()
+        return IngestedUpload(filename, hasher.hexdigest(), size, path=spool_path)
+    return IngestedUpload(filename, hasher.hexdigest(), size, data=b"".join(chunks))